@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
@@ -31,5 +33,6 @@ async def login(request: LoginRequest):
 async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Logout endpoint"""
     session_id = credentials.credentials
-    session_manager.delete_session(session_id)
+    # 撤销要加文件锁并追加写文件，放到线程里，不阻塞事件循环
+    await asyncio.to_thread(session_manager.revoke_session, session_id)
     return {"message": "Logged out successfully"} 
\ No newline at end of file
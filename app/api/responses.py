@@ -0,0 +1,150 @@
+"""
+Fast JSON responses for read-only memory endpoints.
+
+The read endpoints return Elasticsearch hits as-is instead of going through
+``MemoryDocument`` -> ``APIMemoryDocument`` -> FastAPI's encoder. Hits are
+mapped straight to the public fields and encoded once with orjson. Large
+payloads are compressed with brotli (when installed) or gzip, depending on the
+client's ``Accept-Encoding``.
+"""
+
+import gzip
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.core.config import settings
+from app.core.tracing import span, traced
+from app.db.elasticsearch.models import normalize_timestamp
+from app.utils.event_log import Event
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+# Fields exposed by APIMemoryDocument, in the same order
+API_MEMORY_FIELDS = (
+    "content",
+    "memory_type",
+    "tags",
+    "user_id",
+    "title",
+    "summary",
+    "parent_id",
+    "related_ids",
+)
+
+
+def memory_hit_to_api(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an Elasticsearch hit (``_source`` plus ``_id``) to the API shape."""
+    doc = {"id": hit.get("_id")}
+    for field in API_MEMORY_FIELDS:
+        doc[field] = hit.get(field)
+    if doc["tags"] is None:
+        doc["tags"] = []
+    if doc["related_ids"] is None:
+        doc["related_ids"] = []
+    memory_type = doc["memory_type"]
+    if hasattr(memory_type, "value"):
+        doc["memory_type"] = memory_type.value
+    doc["created_at"] = normalize_timestamp(hit.get("created_at"))
+    doc["updated_at"] = normalize_timestamp(hit.get("updated_at"))
+    return doc
+
+
+@traced("serialize.map")
+def memory_hits_to_api(hits: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [memory_hit_to_api(hit) for hit in hits]
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    """Content codings listed in an Accept-Encoding header, minus the ones refused with q=0."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if coding and _quality(params) > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _quality(params: List[str]) -> float:
+    """The q-value among the parameters of an Accept-Encoding entry, 1 if absent or malformed."""
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 1.0
+    return 1.0
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def json_response(
+    request: Request,
+    payload: Any,
+    status_code: int = 200,
+    compress: bool = True,
+) -> Response:
+    """
+    Encode ``payload`` with orjson and optionally compress it.
+
+    Args:
+        request: The incoming request, used for content negotiation
+        payload: Any orjson-serializable object
+        status_code: HTTP status code of the response
+        compress: Whether the body may be compressed (large list responses)
+    """
+    with span("serialize.encode"):
+        body = orjson.dumps(payload)
+    headers = {}
+    if (
+        compress
+        and settings.RESPONSE_COMPRESSION
+        and len(body) >= settings.RESPONSE_COMPRESSION_MIN_SIZE
+    ):
+        encoding = _choose_encoding(request.headers.get("accept-encoding", ""))
+        with span("serialize.compress", encoding=encoding):
+            if encoding == "br":
+                body = brotli.compress(body, quality=settings.RESPONSE_BROTLI_QUALITY)
+            elif encoding == "gzip":
+                body = gzip.compress(body, compresslevel=settings.RESPONSE_GZIP_LEVEL)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def sse_response(events: AsyncIterator[Optional[Event]]) -> StreamingResponse:
+    """Stream events as ``text/event-stream``; None from the iterator becomes a keep-alive comment."""
+    async def body():
+        async for event in events:
+            if event is None:
+                yield b": keep-alive\n\n"
+            else:
+                yield b"id: %d\nevent: %s\ndata: %s\n\n" % (
+                    event.id, event.type.encode("utf-8"), orjson.dumps(event.to_dict())
+                )
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
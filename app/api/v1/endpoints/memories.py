@@ -1,20 +1,24 @@
+import asyncio
 from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Request
 from pydantic import BaseModel, Field
 from enum import Enum
-import pytz
-from dateutil import parser
 import logging
 
+from app.api.responses import json_response, memory_hit_to_api, memory_hits_to_api, sse_response
 from app.db.elasticsearch.memory_repository import MemoryRepository
-from app.db.elasticsearch.models import MemoryDocument, MemoryType
-from app.storage.file_storage import FileStorage
+from app.db.elasticsearch.models import (
+    MemoryDocument, MemoryType, ProcessingState, TIMESTAMP_FORMAT, local_timezone, now_timestamp
+)
+from app.services.event_broker import event_broker
+from app.services.project_catalog import project_catalog
+from app.storage.file_storage import file_storage
+from app.utils.event_log import MEMORY_CREATED, PROJECT_CREATED, PROJECT_UPDATED, event_log
 
 # from app.llm.memory_agent import update_insight_memory
 
 router = APIRouter()
-file_storage = FileStorage()
 
 class MemoryCreate(BaseModel):
     content: str
@@ -55,6 +59,14 @@ class APIMemoryDocument(BaseModel):
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
 
+class MemoryMGetRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=1000)
+    user_id: Optional[str] = None
+
+class MemoryMGetResponse(BaseModel):
+    memories: List[APIMemoryDocument]
+    missing: List[str]
+
 class MemoryListResponse(BaseModel):
     memories: List[APIMemoryDocument]  # Changed from MemoryDocument to APIMemoryDocument
     total: int
@@ -62,6 +74,17 @@ class MemoryListResponse(BaseModel):
     page_size: int
     total_pages: int
 
+class DeadMemory(APIMemoryDocument):
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+class DeadMemoryListResponse(BaseModel):
+    memories: List[DeadMemory]
+    total: int
+    page: int
+    page_size: int
+    total_pages: int
+
 @router.post("/", response_model=MemoryIdResponse)
 async def create_memory(memory: MemoryCreate):
     """
@@ -72,20 +95,21 @@ async def create_memory(memory: MemoryCreate):
         if memory.created_at:
             try:
                 # 使用 dateutil.parser 解析各种格式的日期时间
+                from dateutil import parser
                 created_at = parser.parse(memory.created_at)
                 # 确保时区为 UTC+8
                 if created_at.tzinfo is None:
-                    created_at = pytz.timezone('Asia/Shanghai').localize(created_at)
+                    created_at = created_at.replace(tzinfo=local_timezone())
                 else:
-                    created_at = created_at.astimezone(pytz.timezone('Asia/Shanghai'))
+                    created_at = created_at.astimezone(local_timezone())
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Invalid datetime format: {str(e)}")
         else:
-            created_at = datetime.now(pytz.timezone('Asia/Shanghai'))
+            created_at = datetime.now(local_timezone())
             
         # 统一使用 ISO 格式，包含时区信息
-        created_at_str = created_at.strftime('%Y-%m-%dT%H:%M:%S%z')
-        updated_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+        created_at_str = created_at.strftime(TIMESTAMP_FORMAT)
+        updated_at = now_timestamp()
             
         memory_doc = MemoryDocument(
             content=memory.content,
@@ -106,13 +130,18 @@ async def create_memory(memory: MemoryCreate):
         memory_id = await repo.create_memory(memory_doc)
 
         # Save to local file storage
-        memory_data = memory_doc.to_dict()
-        memory_data["_id"] = memory_id  # Add the ID to the data
-        file_storage.save_memory(memory_id, memory_data)
+        file_storage.save_memory_document(memory_id, memory_doc)
 
         # update insight memory
         # we won't update insight memory here, we will do it in the background
-        # await update_insight_memory(memory_doc)
+        # 通知 worker 立即处理，不用等下次轮询
+        if memory_doc.memory_type == MemoryType.RAW:
+            await asyncio.to_thread(event_log.publish, MEMORY_CREATED, memory_doc.user_id, memory_id=memory_id)
+        elif memory_doc.memory_type == MemoryType.PROJECT:
+            # 项目列表缓存失效（本进程立即失效，worker 通过事件日志）
+            project_catalog.invalidate(memory_doc.user_id)
+            await asyncio.to_thread(event_log.publish, PROJECT_CREATED, memory_doc.user_id, memory_id=memory_id,
+                                    data={"title": memory_doc.title, "content": memory_doc.content})
 
         return MemoryIdResponse(id=memory_id)
 
@@ -130,10 +159,11 @@ async def delete_memory(memory_id: str, user_id: Optional[str] = None):
     """
     try:
         repo = MemoryRepository()
+        # 删除项目时要让项目列表缓存失效，所以总是先读取记忆
+        memory = await repo.get_memory(memory_id)
         
         # 如果提供了user_id，先检查记忆是否属于该用户
         if user_id:
-            memory = await repo.get_memory(memory_id)
             if not memory:
                 raise HTTPException(status_code=404, detail=f"记忆ID '{memory_id}' 不存在")
                 
@@ -142,7 +172,8 @@ async def delete_memory(memory_id: str, user_id: Optional[str] = None):
             
             # 删除本地文件存储
             try:
-                file_storage.delete_memory(memory_id, user_id)
+                # 删除要先查找本地日志（首次使用时会加载索引），放到线程里，不阻塞事件循环
+                await asyncio.to_thread(file_storage.delete_memory, memory_id, user_id)
             except FileNotFoundError:
                 # 如果文件不存在，只记录日志，不影响整体删除流程
                 logging.warning(f"本地文件不存在: {memory_id} for user {user_id}")
@@ -151,6 +182,11 @@ async def delete_memory(memory_id: str, user_id: Optional[str] = None):
         success = await repo.delete_memory(memory_id)
         if not success:
             raise HTTPException(status_code=500, detail=f"删除记忆失败: {memory_id}")
+
+        if memory is not None and memory.memory_type == MemoryType.PROJECT:
+            project_catalog.invalidate(memory.user_id)
+            await asyncio.to_thread(event_log.publish, PROJECT_UPDATED, memory.user_id, memory_id=memory_id,
+                                    data={"deleted": True})
         
         return DeleteMemoryResponse(
             success=True, 
@@ -164,6 +200,7 @@ async def delete_memory(memory_id: str, user_id: Optional[str] = None):
 
 @router.get("/", response_model=MemoryListResponse)
 async def list_memories(
+    request: Request,
     memory_type: Optional[MemoryType] = None,
     user_id: Optional[str] = None,
     parent_id: Optional[str] = None,
@@ -185,50 +222,35 @@ async def list_memories(
     """
     try:
         repo = MemoryRepository()
-        memory_docs, total = await repo.list_memories(
+        hits, total = await repo.list_memories(
             memory_type=memory_type,
             user_id=user_id,
             parent_id=parent_id,
             page=page,
             page_size=page_size,
             sort_by=sort_by,
-            sort_order=sort_order
+            sort_order=sort_order,
+            raw=True
         )
         
-        # Convert MemoryDocument to APIMemoryDocument
-        memories = [
-            APIMemoryDocument(
-                id=doc._id,
-                content=doc.content,
-                memory_type=doc.memory_type,
-                tags=doc.tags,
-                user_id=doc.user_id,
-                title=doc.title,
-                summary=doc.summary,
-                parent_id=doc.parent_id,
-                related_ids=doc.related_ids,
-                created_at=doc.created_at,
-                updated_at=doc.updated_at
-            )
-            for doc in memory_docs
-        ]
-        
         total_pages = (total + page_size - 1) // page_size
         
-        return MemoryListResponse(
-            memories=memories,
-            total=total,
-            page=page,
-            page_size=page_size,
-            total_pages=total_pages
-        )
+        # Serialize the hits directly, the shape matches MemoryListResponse
+        return json_response(request, {
+            "memories": memory_hits_to_api(hits),
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": total_pages
+        })
         
     except Exception as e:
-        print(e)
+        logging.exception("获取记忆列表失败: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/search", response_model=MemoryListResponse)
 async def vector_search(
+    request: Request,
     query: str,
     size: int = Query(10, ge=1, le=100),
     user_id: Optional[str] = None
@@ -244,43 +266,135 @@ async def vector_search(
     """
     try:
         repo = MemoryRepository()
-        memory_docs = await repo.search_by_similarity(
+        hits = await repo.search_by_similarity(
             query=query,
             user_id=user_id,
-            size=size
+            size=size,
+            raw=True
         )
         
-        # Convert MemoryDocument to APIMemoryDocument
-        memories = [
-            APIMemoryDocument(
-                id=doc._id,
-                content=doc.content,
-                memory_type=doc.memory_type,
-                tags=doc.tags,
-                user_id=doc.user_id,
-                title=doc.title,
-                summary=doc.summary,
-                parent_id=doc.parent_id,
-                related_ids=doc.related_ids,
-                created_at=doc.created_at,
-                updated_at=doc.updated_at
-            )
-            for doc in memory_docs
-        ]
-        
-        return MemoryListResponse(
-            memories=memories,
-            total=len(memories),
-            page=1,
-            page_size=size,
-            total_pages=1
-        )
+        memories = memory_hits_to_api(hits)
+        return json_response(request, {
+            "memories": memories,
+            "total": len(memories),
+            "page": 1,
+            "page_size": size,
+            "total_pages": 1
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/mget", response_model=MemoryMGetResponse)
+async def get_memories(request: Request, body: MemoryMGetRequest):
+    """
+    批量获取记忆详情，一次请求代替逐条获取（例如解析 related_ids、任务列表）
+
+    Args:
+        ids: 要获取的记忆ID列表（最多1000个）
+        user_id: 可选的用户ID，不属于该用户的记忆视为不存在
+    """
+    try:
+        repo = MemoryRepository()
+        hits = await repo.get_memories(body.ids, raw=True)
+        if body.user_id:
+            hits = [hit for hit in hits if hit.get("user_id") == body.user_id]
+        found = {hit["_id"] for hit in hits}
+        return json_response(request, {
+            "memories": memory_hits_to_api(hits),
+            "missing": [memory_id for memory_id in dict.fromkeys(body.ids) if memory_id not in found]
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/dead", response_model=DeadMemoryListResponse)
+async def list_dead_memories(
+    request: Request,
+    user_id: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=200)
+):
+    """
+    列出处理失败次数达到上限、不再自动重试的原始记忆（死信）
+
+    Args:
+        user_id: 可选的用户ID过滤
+        page: 页码（从1开始）
+        page_size: 每页数量
+    """
+    try:
+        repo = MemoryRepository()
+        hits, total = await repo.list_dead_memories(user_id=user_id, page=page, page_size=page_size)
+        memories = []
+        for hit in hits:
+            memory = memory_hit_to_api(hit)
+            memory["attempts"] = hit.get("attempts") or 0
+            memory["last_error"] = hit.get("last_error")
+            memories.append(memory)
+        return json_response(request, {
+            "memories": memories,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": (total + page_size - 1) // page_size
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{memory_id}/requeue", response_model=MemoryIdResponse)
+async def requeue_memory(memory_id: str, user_id: Optional[str] = None):
+    """
+    把死信记忆放回处理队列，尝试次数清零，并通知 worker
+
+    Args:
+        memory_id: 记忆ID
+        user_id: 可选的用户ID，用于验证记忆所有权
+    """
+    repo = MemoryRepository()
+    hit = await repo.get_memory(memory_id, raw=True)
+    if not hit:
+        raise HTTPException(status_code=404, detail=f"记忆ID '{memory_id}' 不存在")
+    if user_id and hit.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="没有权限访问此记忆")
+    if hit.get("processing_state") != ProcessingState.DEAD.value:
+        raise HTTPException(status_code=409, detail=f"记忆 '{memory_id}' 不在死信状态")
+    if not await repo.requeue_memory(memory_id):
+        raise HTTPException(status_code=500, detail=f"重新入队失败: {memory_id}")
+    await asyncio.to_thread(event_log.publish, MEMORY_CREATED, hit["user_id"], memory_id=memory_id)
+    return MemoryIdResponse(id=memory_id)
+
+@router.get("/events")
+async def user_events(user_id: str, last_event_id: Optional[int] = Header(None)):
+    """
+    用户的记忆处理事件流（SSE）：processed、insight_created、project_created、task_created、report_ready
+
+    Args:
+        user_id: 用户ID
+        last_event_id: 断线重连时浏览器自动带上的 Last-Event-ID，之后的事件会先补发
+    """
+    return sse_response(event_broker.stream(user_id, last_event_id=last_event_id))
+
+@router.get("/{memory_id}/events")
+async def memory_events(memory_id: str, user_id: Optional[str] = None, last_event_id: Optional[int] = Header(None)):
+    """
+    单条记忆的处理事件流（SSE），包括处理该记忆时创建的洞察、项目和任务，收到 processed 事件后结束
+
+    Args:
+        memory_id: 记忆ID
+        user_id: 可选的用户ID，用于验证记忆所有权
+    """
+    repo = MemoryRepository()
+    hit = await repo.get_memory(memory_id, raw=True)
+    if not hit:
+        raise HTTPException(status_code=404, detail=f"记忆ID '{memory_id}' 不存在")
+    if user_id and hit.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="没有权限访问此记忆")
+    return sse_response(event_broker.stream(
+        hit["user_id"], memory_id=memory_id, last_event_id=last_event_id, processed=bool(hit.get("processed"))
+    ))
+
 @router.get("/{memory_id}", response_model=APIMemoryDocument)
-async def get_memory_detail(memory_id: str, user_id: Optional[str] = None):
+async def get_memory_detail(request: Request, memory_id: str, user_id: Optional[str] = None):
     """
     获取指定ID的记忆详情
     
@@ -290,28 +404,16 @@ async def get_memory_detail(memory_id: str, user_id: Optional[str] = None):
     """
     try:
         repo = MemoryRepository()
-        memory = await repo.get_memory(memory_id)
+        hit = await repo.get_memory(memory_id, raw=True)
         
-        if not memory:
+        if not hit:
             raise HTTPException(status_code=404, detail=f"记忆ID '{memory_id}' 不存在")
             
         # 如果提供了user_id，检查记忆是否属于该用户
-        if user_id and memory.user_id != user_id:
+        if user_id and hit.get("user_id") != user_id:
             raise HTTPException(status_code=403, detail="没有权限访问此记忆")
         
-        return APIMemoryDocument(
-            id=memory._id,
-            content=memory.content,
-            memory_type=memory.memory_type,
-            tags=memory.tags,
-            user_id=memory.user_id,
-            title=memory.title,
-            summary=memory.summary,
-            parent_id=memory.parent_id,
-            related_ids=memory.related_ids,
-            created_at=memory.created_at,
-            updated_at=memory.updated_at
-        )
+        return json_response(request, memory_hit_to_api(hit), compress=False)
         
     except HTTPException:
         raise
@@ -369,13 +471,13 @@ async def update_memory(memory_id: str, memory_update: MemoryUpdate, user_id: Op
         # 只有在实际有更新时才执行更新操作
         if updated:
             # 更新时间戳
-            existing_memory.updated_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+            existing_memory.updated_at = now_timestamp()
             
             # 如果内容发生变化，需要更新向量嵌入
             if memory_update.content is not None:
                 from app.llm.embeddings import embed_text
                 embedding = embed_text(existing_memory.content)
-                if embedding:
+                if embedding is not None:
                     existing_memory.embedding = embedding
             
             # 更新Elasticsearch中的记录
@@ -384,9 +486,12 @@ async def update_memory(memory_id: str, memory_update: MemoryUpdate, user_id: Op
                 raise HTTPException(status_code=500, detail=f"更新记忆失败: {memory_id}")
             
             # 更新本地文件存储
-            memory_data = existing_memory.to_dict()
-            memory_data["_id"] = memory_id
-            file_storage.save_memory(memory_id, memory_data)
+            file_storage.save_memory_document(memory_id, existing_memory)
+
+            if existing_memory.memory_type == MemoryType.PROJECT:
+                project_catalog.invalidate(existing_memory.user_id)
+                await asyncio.to_thread(event_log.publish, PROJECT_UPDATED, existing_memory.user_id,
+                                        memory_id=memory_id, data={"content": existing_memory.content})
         
         # 返回更新后的记忆
         return APIMemoryDocument(
@@ -0,0 +1,174 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+# Route classes with their own concurrency limit
+WRITE = "write"
+SEARCH = "search"
+LIST = "list"
+
+
+class Rejected(Exception):
+    """The request is not admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take one token. Returns 0 on success, otherwise the seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+    """
+    At most ``limit`` requests run at once; up to ``max_queue`` more wait in
+    FIFO order for at most ``timeout`` seconds. Anything beyond is rejected
+    immediately instead of piling up behind a saturated backend.
+    """
+
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Rejected("queue full", self.timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Granted just as the timeout fired: keep the slot
+                return
+            self._waiters.remove(waiter)
+            self.rejected += 1
+            raise Rejected("queue timeout", self.timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next waiter, so active never drops below a waiting queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": self.limit, "active": self.active, "queued": self.queued, "rejected": self.rejected}
+
+
+class AdmissionController:
+    """
+    Per-user token buckets in front of per-route-class concurrency limits.
+
+    The bucket bounds how fast one user can send requests, the limiters bound
+    how many embedding/ES calls run at once for everybody. Idle buckets are
+    dropped once they would be full again anyway.
+    """
+
+    def __init__(
+        self,
+        user_rate: Optional[float] = None,
+        user_burst: Optional[int] = None,
+        limits: Optional[Dict[str, int]] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ):
+        self.user_rate = user_rate or settings.ADMISSION_USER_RATE
+        self.user_burst = user_burst or settings.ADMISSION_USER_BURST
+        limits = limits or {
+            WRITE: settings.ADMISSION_WRITE_CONCURRENCY,
+            SEARCH: settings.ADMISSION_SEARCH_CONCURRENCY,
+            LIST: settings.ADMISSION_LIST_CONCURRENCY,
+        }
+        max_queue = max_queue or settings.ADMISSION_QUEUE_SIZE
+        queue_timeout = queue_timeout or settings.ADMISSION_QUEUE_TIMEOUT
+        self.limiters = {
+            route_class: ConcurrencyLimiter(limit, max_queue, queue_timeout)
+            for route_class, limit in limits.items()
+        }
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+        self.throttled = 0
+
+    def check_rate(self, user_key: str):
+        """Raise Rejected if the user is over their rate."""
+        now = time.monotonic()
+        self._sweep(now)
+        bucket = self._buckets.get(user_key)
+        if bucket is None:
+            bucket = self._buckets[user_key] = TokenBucket(self.user_rate, self.user_burst)
+        wait = bucket.take(now)
+        if wait:
+            self.throttled += 1
+            raise Rejected("rate limited", wait)
+
+    def _sweep(self, now: float):
+        idle = self.user_burst / self.user_rate
+        if now - self._last_sweep < idle:
+            return
+        self._last_sweep = now
+        self._buckets = {key: b for key, b in self._buckets.items() if now - b.updated < idle}
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "users": len(self._buckets),
+            "throttled": self.throttled,
+            "routes": {route_class: limiter.stats() for route_class, limiter in self.limiters.items()},
+        }
+
+
+admission_controller = AdmissionController()
+
+
+def _queue_gauge() -> Dict[tuple, float]:
+    return {(route_class,): limiter.queued for route_class, limiter in admission_controller.limiters.items()}
+
+
+def _active_gauge() -> Dict[tuple, float]:
+    return {(route_class,): limiter.active for route_class, limiter in admission_controller.limiters.items()}
+
+
+registry.gauge("xmemory_admission_queued", "Requests waiting for a slot", ("route_class",), callback=_queue_gauge)
+registry.gauge("xmemory_admission_active", "Requests holding a slot", ("route_class",), callback=_active_gauge)
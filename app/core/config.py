@@ -20,7 +20,8 @@ class Settings(BaseSettings):
     ELASTICSEARCH_PASSWORD: Optional[str] = None
 
     # Security settings
-    SECRET_KEY: str = "your-secret-key-here"
+    # Signs session tokens; if empty, a random key is generated in SESSION_DIR
+    SECRET_KEY: str = ""
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
 
     # Embedding settings
@@ -30,12 +31,87 @@ class Settings(BaseSettings):
     OPENAI_API_KEY_FOR_EMBEDDING: Optional[str] = None
     OPENAI_API_BASE_FOR_EMBEDDING: Optional[str] = None
     EMBEDDING_MODEL: str = "text-embedding-v3"
+    # "base64" avoids parsing 1024 JSON floats per call, if the provider supports it
+    EMBEDDING_ENCODING_FORMAT: str = "float"
 
     # OpenAI settings for LLM
     OPENAI_API_KEY_FOR_LLM: Optional[str] = None
     OPENAI_API_BASE_FOR_LLM: Optional[str] = None
     LLM_MODEL: str = "gpt-4.1"
     OPENAI_RESPONSE_API: bool = True
+    # Local memory storage (append-only journal)
+    MEMORY_STORAGE_DIR: str = os.path.join(BASE_DIR, "data", "memories")
+    MEMORY_JOURNAL_SEGMENT_BYTES: int = 64 * 1024 * 1024
+    MEMORY_JOURNAL_FLUSH_INTERVAL: float = 0.05  # seconds to batch writes into one fsync
+    MEMORY_JOURNAL_COMPACTION_INTERVAL: float = 600  # seconds
+    MEMORY_JOURNAL_COMPACTION_RATIO: float = 0.5  # dead/total bytes that triggers compaction
+
+    # Response settings
+    RESPONSE_COMPRESSION: bool = True
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 4096  # bytes
+    RESPONSE_GZIP_LEVEL: int = 5
+    RESPONSE_BROTLI_QUALITY: int = 4
+
+    # Frontend static assets
+    FRONTEND_BUILD_DIR: str = os.path.join(BASE_DIR, "frontend", "build")
+    STATIC_ASSET_INLINE_MAX_SIZE: int = 256 * 1024  # files up to this size are served from memory
+
+    # Admission control for the memories API
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_USER_RATE: float = 5  # requests per second per session (per client address without one)
+    ADMISSION_USER_BURST: int = 20
+    ADMISSION_WRITE_CONCURRENCY: int = 8  # creates/updates call the embedding provider
+    ADMISSION_SEARCH_CONCURRENCY: int = 8
+    ADMISSION_LIST_CONCURRENCY: int = 32
+    ADMISSION_QUEUE_SIZE: int = 64  # waiting requests per route class
+    ADMISSION_QUEUE_TIMEOUT: float = 5  # seconds a request may wait for a slot
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # "json" or "text"
+    LOG_MAX_MESSAGE_LENGTH: int = 2000  # longer messages are truncated
+    LOG_SAMPLE_PER_SECOND: int = 20  # DEBUG/INFO records per second per source line, 0 disables sampling
+
+    # Request tracing
+    TRACING_ENABLED: bool = True
+    TRACE_SAMPLE_RATE: float = 0.0  # share of requests logged as a JSON span tree
+    TRACE_SLOW_THRESHOLD_MS: float = 1000  # requests slower than this are always logged
+
+    # Memory processor worker
+    MEMORY_PROCESSOR_CONCURRENCY: int = 4  # memories processed at once, different users in parallel
+    MEMORY_LEASE_SECONDS: float = 600  # a claimed memory is reclaimable by other workers after this, unless renewed
+    MEMORY_MAX_ATTEMPTS: int = 5  # after this many failed attempts a memory is dead-lettered
+    MEMORY_RETRY_BASE_DELAY: float = 60  # seconds before the first retry, doubled per attempt
+    MEMORY_RETRY_MAX_DELAY: float = 3600
+    MEMORY_DRAIN_TIMEOUT: float = 120  # seconds in-flight memories may finish after SIGTERM
+    MEMORY_PROCESSOR_WORKERS: int = 0  # worker processes of the supervisor, 0 means one per CPU core
+    # Raw memories of a user created close together are handled in one agent run
+    MEMORY_COALESCE_WINDOW: float = 300  # seconds after the first memory of a batch, 0 disables
+    MEMORY_COALESCE_MAX_TOKENS: int = 2000
+    MEMORY_COALESCE_MAX_MEMORIES: int = 20
+    MEMORY_WORKER_METRICS_PORT: int = 0  # /metrics of the worker, 0 disables; the supervisor adds the shard index
+    MEMORY_METRICS_INTERVAL: float = 30  # seconds between backlog queries for the worker metrics
+    # Reprocessing of already processed raw memories (memory_processor_worker --reprocess)
+    MEMORY_REPROCESS_RATE: float = 10  # memories per minute
+    MEMORY_REPROCESS_MAX_LIVE: int = 0  # pause while more live (unprocessed) memories than this are waiting
+    MEMORY_REPROCESS_CHECKPOINT_DIR: str = os.path.join(BASE_DIR, "data", "reprocess")
+
+    # Memory processing events
+    EVENT_LOG_PATH: str = os.path.join(BASE_DIR, "data", "events.db")
+    EVENT_POLL_INTERVAL: float = 0.25  # seconds between reads of the event log
+    PROJECT_CATALOG_TTL: float = 300  # seconds a user's cached project list is used
+    PROJECT_CATALOG_SYNC_INTERVAL: float = 1  # seconds between checks for project events of other processes
+    # Projects listed in the triage prompt: the most similar to the memory plus the recently updated ones
+    TRIAGE_PROJECTS_TOP_K: int = 5
+    TRIAGE_PROJECTS_RECENT: int = 3
+    TRIAGE_PROJECTS_MAX_TOKENS: int = 1500
+    EVENT_LOG_RETENTION_HOURS: int = 24
+    SSE_KEEPALIVE_INTERVAL: float = 15  # seconds
+
+    # Startup: the index check gates /readyz; the warmup then embeds once and runs a kNN query
+    WARMUP_ENABLED: bool = True
+    WARMUP_RETRY_INTERVAL: float = 5  # seconds between attempts while Elasticsearch is unreachable
+
     # Debug settings
     DEBUG: bool = False
 
@@ -47,6 +123,7 @@ class Settings(BaseSettings):
     AUTH_PASSWORD: str = os.getenv("AUTH_PASSWORD", "admin")
     SESSION_EXPIRY_DAYS: int = 30
     SESSION_DIR: str = os.path.join(BASE_DIR, "data", "sessions")
+    SESSION_REVOCATION_SWEEP_INTERVAL: float = 300  # seconds
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,156 @@
+"""
+Structured, non-blocking logging.
+
+``setup_logging()`` points the root logger at a QueueHandler; a
+QueueListener thread formats the records as JSON lines and writes them to
+stderr (and optionally a file), so a log call on a request path costs a
+queue put instead of a formatted, synchronous write.
+
+Before a record is queued, messages longer than LOG_MAX_MESSAGE_LENGTH are
+truncated, and DEBUG/INFO records are sampled per call site: at most
+LOG_SAMPLE_PER_SECOND per second from one source line get through, the
+number dropped is reported on the next record from that line. Warnings and
+errors are never sampled.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def truncate(value: str, limit: Optional[int] = None) -> str:
+    """Shorten a large payload for logging, keeping the head and the original length."""
+    limit = limit or settings.LOG_MAX_MESSAGE_LENGTH
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}... [truncated, {len(value)} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limit DEBUG/INFO records per source line."""
+
+    def __init__(self, per_second: int):
+        super().__init__()
+        self.per_second = per_second
+        self._windows: Dict[Tuple[str, int], list] = {}  # call site -> [window start, passed, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.per_second <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1:
+                dropped = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if dropped:
+                    record.sampled_out = dropped
+                return True
+            if window[1] < self.per_second:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments here, so the listener thread never touches caller objects
+        record = copy.copy(record)
+        record.msg = record.message = truncate(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(service: str, level: Optional[str] = None, log_file: Optional[str] = None) -> None:
+    """
+    Configure the root logger for a process (idempotent).
+
+    Args:
+        service: Name of the process, added to every line ("api", "worker", ...)
+        level: Root level, LOG_LEVEL by default
+        log_file: Also write to this file, rotated at 50 MB
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter(service) if settings.LOG_FORMAT == "json" else logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = TruncatingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_PER_SECOND))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level or settings.LOG_LEVEL)
+    # Chatty client libraries only above INFO
+    for name in ("elastic_transport", "httpx", "openai", "urllib3"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush the queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
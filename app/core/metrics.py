@@ -0,0 +1,286 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+A deliberately small subset of the Prometheus client: counters, gauges and
+histograms with labels. Updating a metric is a dict lookup and a few float
+additions under an uncontended lock, so it can sit on every request, ES call
+and LLM call. Each process (API, worker) has its own registry.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached ES get to a slow LLM run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, values: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        return tuple(str(value) for value in values)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """A gauge that is either set directly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_all(self, values: Dict[Tuple[str, ...], float]):
+        """Replace all samples, e.g. with a fresh per-user snapshot; labels not in ``values`` disappear."""
+        values = {self._key(key): value for key, value in values.items()}
+        with self._lock:
+            self._values = values
+
+    def _samples(self) -> Iterable[str]:
+        if self.callback is not None:
+            items = list(self.callback().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return int(sum(state[:-1])) if state else 0
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {_format_value(cumulative)}"
+            labels = _label_text(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-1])}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Re-registering (module reloads in tests) returns the existing metric
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "xmemory_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_REQUESTS = registry.counter(
+    "xmemory_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+ES_SECONDS = registry.histogram(
+    "xmemory_es_operation_duration_seconds", "Elasticsearch repository operation latency", ("operation",))
+ES_ERRORS = registry.counter(
+    "xmemory_es_operation_errors_total", "Elasticsearch repository operation errors", ("operation",))
+EMBEDDING_SECONDS = registry.histogram(
+    "xmemory_embedding_duration_seconds", "Embedding request latency", ("model",))
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "xmemory_embedding_batch_size", "Texts per embedding request", ("model",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+EMBEDDING_ERRORS = registry.counter(
+    "xmemory_embedding_errors_total", "Failed embedding requests", ("model",))
+AGENT_RUN_SECONDS = registry.histogram(
+    "xmemory_agent_run_duration_seconds", "Runner.run duration by starting agent", ("agent",))
+AGENT_RUN_ERRORS = registry.counter(
+    "xmemory_agent_run_errors_total", "Failed Runner.run calls by starting agent", ("agent",))
+LLM_CALL_SECONDS = registry.histogram(
+    "xmemory_llm_call_duration_seconds", "Model call latency by agent", ("agent",))
+LLM_TOKENS = registry.counter(
+    "xmemory_llm_tokens_total", "Model tokens by agent and direction", ("agent", "direction"))
+TOOL_CALL_SECONDS = registry.histogram(
+    "xmemory_tool_call_duration_seconds", "Tool call latency by calling agent and tool", ("agent", "tool"))
+
+# Memory processor worker
+WORKER_BACKLOG = registry.gauge(
+    "xmemory_worker_backlog_memories", "Unprocessed raw memories by user (users with the largest backlog)",
+    ("user_id",))
+WORKER_BACKLOG_TOTAL = registry.gauge(
+    "xmemory_worker_backlog_memories_total", "Unprocessed raw memories, dead letters excluded")
+WORKER_BACKLOG_OLDEST_AGE = registry.gauge(
+    "xmemory_worker_backlog_oldest_age_seconds", "Age of the oldest unprocessed raw memory")
+WORKER_MEMORIES = registry.counter(
+    "xmemory_worker_memories_total", "Raw memories handled by the worker by outcome", ("outcome",))
+WORKER_PROCESSED_PER_MINUTE = registry.gauge(
+    "xmemory_worker_processed_per_minute", "Raw memories processed in the last minute")
+WORKER_STAGE_SECONDS = registry.histogram(
+    "xmemory_worker_stage_duration_seconds", "Memory processing time by stage", ("stage",))
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None, *labels: str):
+    """Decorator recording the duration of a sync or async function, and its exceptions."""
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(*labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, *labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(*labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    return registry.render()
+
+
+async def start_http_server(port: int, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """
+    Serve this process's registry at any path, for processes without a web framework (the worker).
+
+    One request per connection, no keep-alive: enough for a Prometheus scrape
+    or curl, and it adds no dependency.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Request line and headers are ignored; read until the blank line that ends them
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            body = render().encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                + f"Content-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,7 +1,15 @@
+import time
+from typing import Optional
+
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.core.admission import LIST, SEARCH, WRITE, Rejected, admission_controller
+from app.core.config import settings
+from app.core.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS
+from app.core.tracing import finish_trace, server_timing, start_trace
 from app.utils.session_manager import session_manager
 
 security = HTTPBearer()
@@ -21,17 +29,111 @@ async def auth_middleware(request: Request, call_next):
         return await call_next(request)
     
     try:
-        credentials: HTTPAuthorizationCredentials = await security(request)
-        session_id = credentials.credentials
+        # EventSource 无法设置请求头，事件流允许通过 ?token= 传递会话
+        session_id = request.query_params.get("token") if request.url.path.endswith("/events") else None
+        if not session_id:
+            credentials: HTTPAuthorizationCredentials = await security(request)
+            session_id = credentials.credentials
         
-        if not session_manager.validate_session(session_id):
+        session = session_manager.decode_session(session_id)
+        if session is None:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid or expired session"
             )
+        request.state.session = session
         return await call_next(request)
     except Exception:
         raise HTTPException(
             status_code=401,
             detail="Not authenticated"
-        ) 
\ No newline at end of file
+        ) 
+
+def route_class(request: Request) -> Optional[str]:
+    """Classify a memories API request for admission control; None means not limited."""
+    path = request.url.path
+    if not path.startswith(AUTH_REQUIRED_PATHS[0]):
+        return None
+    if path.endswith("/events"):
+        # 长连接事件流只受用户速率限制，不占用并发名额
+        return None
+    if path.endswith("/search"):
+        return SEARCH
+    if request.method in ("POST", "PUT", "DELETE") and not path.endswith("/mget"):
+        return WRITE
+    return LIST
+
+async def admission_middleware(request: Request, call_next):
+    """
+    Middleware for admission control: per-session token bucket, then a per-route-class
+    concurrency limit with a bounded queue. Rejected requests get 429 with Retry-After.
+    Runs inside auth_middleware, so the session is known.
+    """
+    if not settings.ADMISSION_CONTROL or not request.url.path.startswith(AUTH_REQUIRED_PATHS[0]):
+        return await call_next(request)
+
+    # 按已认证的会话限流：所有客户端用同一个账号登录，每个会话（客户端）各有自己的令牌桶；
+    # ?user_id 由客户端任意填写，不能作为限流的键。没有会话时按客户端 IP 限流
+    session = getattr(request.state, "session", None) or {}
+    user_key = session.get("jti") or f"@{request.client.host if request.client else ''}"
+    limiter = admission_controller.limiters.get(route_class(request))
+    try:
+        admission_controller.check_rate(user_key)
+        if limiter is not None:
+            await limiter.acquire()
+    except Rejected as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"Too many requests: {e.reason}"},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        if limiter is not None:
+            limiter.release()
+
+def route_template(request: Request) -> str:
+    """
+    The matched route template, e.g. /api/v1/memories/{memory_id}, so that
+    metrics are aggregated per route rather than per memory ID.
+    """
+    # 新版 FastAPI 的 route.path 不含 include_router 的前缀，完整路径在 effective_route_context 中
+    context = request.scope.get("fastapi", {}).get("effective_route_context")
+    path = getattr(context, "path", None)
+    if path:
+        return path
+    return getattr(request.scope.get("route"), "path", "unmatched")
+
+async def metrics_middleware(request: Request, call_next):
+    """Middleware recording latency per route template and request counts per status"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route_path = route_template(request)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route_path)
+        HTTP_REQUESTS.inc(request.method, route_path, str(status))
+
+async def tracing_middleware(request: Request, call_next):
+    """
+    Middleware tracing each request: the per-phase timings (embedding, ES,
+    storage, serialization, agents) are returned in a Server-Timing header,
+    and slow or sampled requests are logged as a JSON span tree.
+    """
+    if not settings.TRACING_ENABLED:
+        return await call_next(request)
+    root, token = start_trace(f"{request.method} {request.url.path}")
+    response = None
+    try:
+        response = await call_next(request)
+        return response
+    finally:
+        if response is not None:
+            root.attrs = {"status": response.status_code}
+        finish_trace(root, token, slow_threshold_ms=settings.TRACE_SLOW_THRESHOLD_MS)
+        if response is not None:
+            response.headers["Server-Timing"] = server_timing(root)
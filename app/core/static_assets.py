@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import Request
+from starlette.responses import FileResponse, Response
+
+from app.api.responses import accepted_encodings
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# The build puts a hex content hash in asset file names, e.g. main.3f2a1b9c.js or 787.28cb0dcd.chunk.js;
+# the hash must contain a digit so that words like asset-manifest.json or foo-settings.json don't count
+HASHED_NAME = re.compile(
+    r"[.-](?=[0-9a-f]*[0-9])[0-9a-f]{8,}(\.chunk)?\.(js|css|map|woff2?|ttf|eot|svg|png|jpe?g|gif|webp|avif|ico|wasm)$"
+)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Precompressed variants, in order of preference
+VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class AssetFile(NamedTuple):
+    path: str
+    stat: os.stat_result
+    etag: str
+    body: Optional[bytes]
+
+
+class Asset(NamedTuple):
+    media_type: str
+    cache_control: str
+    files: Dict[str, AssetFile]  # content-encoding ("identity", "br", "gzip") -> file
+
+
+def _load_file(path: Path, encoding: str, digest: str) -> AssetFile:
+    stat = path.stat()
+    suffix = "" if encoding == "identity" else f"-{encoding}"
+    body = None
+    if stat.st_size <= settings.STATIC_ASSET_INLINE_MAX_SIZE:
+        body = path.read_bytes()
+    return AssetFile(str(path), stat, f'"{digest}{suffix}"', body)
+
+
+def _digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=12)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class StaticAssets:
+    """
+    Frontend build files, indexed once at startup.
+
+    The manifest maps every relative path to its media type, cache policy and
+    files (the original plus any pre-generated ``.br``/``.gz`` variant), each
+    with a content-hash ETag and a cached stat result. Small files are kept in
+    memory. Serving a request is a dictionary lookup: no ``Path.exists()``, no
+    stat, and a 304 when the client already has the ETag.
+
+    File names with a build hash are served as immutable for a year; anything
+    else (index.html, manifest.json, ...) must be revalidated.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest: Dict[str, Asset] = {}
+
+    def build(self) -> "StaticAssets":
+        manifest = {}
+        if not self.root.is_dir():
+            logger.warning(f"Frontend build directory {self.root} not found, static assets are disabled")
+            self.manifest = manifest
+            return self
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file() or path.suffix in (".br", ".gz"):
+                continue
+            digest = _digest(path)
+            files = {"identity": _load_file(path, "identity", digest)}
+            for encoding, suffix in VARIANTS:
+                variant = path.with_name(path.name + suffix)
+                if variant.is_file():
+                    files[encoding] = _load_file(variant, encoding, digest)
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            immutable = HASHED_NAME.search(path.name) is not None
+            manifest[path.relative_to(self.root).as_posix()] = Asset(
+                media_type,
+                IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+                files,
+            )
+        self.manifest = manifest
+        logger.info(f"Indexed {len(manifest)} static assets from {self.root}")
+        return self
+
+    def get(self, path: str) -> Optional[Asset]:
+        return self.manifest.get(path)
+
+    def response(self, request: Request, asset: Asset) -> Response:
+        """Serve an asset, honouring If-None-Match and Accept-Encoding."""
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = "identity"
+        for candidate, _ in VARIANTS:
+            if candidate in asset.files and candidate in accepted:
+                encoding = candidate
+                break
+        file = asset.files[encoding]
+
+        headers = {"etag": file.etag, "cache-control": asset.cache_control}
+        if len(asset.files) > 1:
+            headers["vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or file.etag in if_none_match):
+            return Response(status_code=304, headers=headers)
+
+        if file.body is not None:
+            return Response(file.body, media_type=asset.media_type, headers=headers)
+        return FileResponse(file.path, media_type=asset.media_type, headers=headers, stat_result=file.stat)
@@ -0,0 +1,146 @@
+"""
+Request-scoped span tracing.
+
+A trace is a tree of spans held in a contextvar. ``span()`` and ``@traced``
+add a child to the current span and are a no-op (one contextvar lookup) when
+no trace is active, so the instrumented functions cost nothing in scripts and
+tests. The API middleware starts one trace per request, answers with a
+``Server-Timing`` header of the time spent per span name, and logs the whole
+tree as JSON when the request is sampled or slow.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("trace")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+_TOKEN_UNSAFE = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class Span:
+    __slots__ = ("name", "start", "duration", "children", "attrs")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+        self.attrs = attrs
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        origin = self.start if origin is None else origin
+        data = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+    def totals(self) -> Dict[str, Tuple[float, int]]:
+        """Total duration and count per span name over the whole subtree, the root excluded."""
+        totals: Dict[str, Tuple[float, int]] = {}
+        stack = list(self.children)
+        while stack:
+            span = stack.pop()
+            duration, count = totals.get(span.name, (0.0, 0))
+            totals[span.name] = (duration + (span.duration or 0), count + 1)
+            stack.extend(span.children)
+        return totals
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span; does nothing outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs or None)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def add_span(name: str, start: float, **attrs):
+    """Attach an already finished span, started at perf_counter() ``start``, to the current span."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(name, attrs or None)
+    child.start = start
+    child.finish()
+    parent.children.append(child)
+
+
+def traced(name: str):
+    """Decorator form of span() for sync and async functions."""
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def start_trace(name: str, **attrs) -> Tuple[Span, contextvars.Token]:
+    root = Span(name, attrs or None)
+    return root, _current_span.set(root)
+
+
+def finish_trace(root: Span, token: contextvars.Token, slow_threshold_ms: Optional[float] = None) -> Span:
+    """
+    Close the trace and log it as JSON if it is sampled (TRACE_SAMPLE_RATE)
+    or took longer than slow_threshold_ms.
+    """
+    root.finish()
+    _current_span.reset(token)
+    slow = slow_threshold_ms is not None and root.duration * 1000 >= slow_threshold_ms
+    if slow or (settings.TRACE_SAMPLE_RATE and random.random() < settings.TRACE_SAMPLE_RATE):
+        logger.info(json.dumps(root.to_dict(), ensure_ascii=False))
+    return root
+
+
+def server_timing(root: Span) -> str:
+    """Format a finished trace as a Server-Timing header value."""
+    parts = []
+    for name, (duration, count) in sorted(root.totals().items(), key=lambda item: -item[1][0]):
+        parts.append(f'{_TOKEN_UNSAFE.sub("_", name)};dur={duration * 1000:.1f};desc="{count}x"')
+    parts.append(f"total;dur={(root.duration or 0) * 1000:.1f}")
+    return ", ".join(parts)
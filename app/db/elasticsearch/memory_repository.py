@@ -1,11 +1,74 @@
+import asyncio
 import logging
 import os
-from typing import List, Optional
-from openai import OpenAI
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 from app.core.config import settings
 from app.db.elasticsearch.repository import ElasticsearchRepository
-from app.db.elasticsearch.models import MemoryDocument, MEMORY_DOCUMENT_MAPPING, MemoryType
+from app.db.elasticsearch.models import (
+    MEMORY_DOCUMENT_MAPPING, PROCESSING_FIELDS, MemoryDocument, MemoryType, ProcessingState, now_timestamp
+)
 from app.llm.embeddings import embed_text
+from app.utils.vectors import to_wire
+
+# 只有仍持有租约的 worker 才能确认或释放
+_ACK_SCRIPT = """
+if (ctx._source.lease_owner != params.owner) { ctx.op = 'noop'; return; }
+ctx._source.processed = true;
+ctx._source.updated_at = params.updated_at;
+ctx._source.processing_state = params.state;
+ctx._source.lease_owner = null;
+ctx._source.lease_expires_at = null;
+"""
+
+# 认领后还没开始处理就交还，不计入尝试次数
+_RELEASE_SCRIPT = """
+if (ctx._source.lease_owner != params.owner) { ctx.op = 'noop'; return; }
+ctx._source.processing_state = params.pending;
+ctx._source.lease_owner = null;
+ctx._source.lease_expires_at = null;
+if (ctx._source.attempts != null && ctx._source.attempts > 0) { ctx._source.attempts -= 1; }
+"""
+
+# 处理失败：按尝试次数指数退避，达到上限后进入死信状态
+_FAIL_SCRIPT = """
+if (ctx._source.lease_owner != params.owner) { ctx.op = 'noop'; return; }
+int attempts = ctx._source.attempts == null ? 1 : ctx._source.attempts;
+ctx._source.last_error = params.error;
+ctx._source.lease_owner = null;
+ctx._source.lease_expires_at = null;
+if (attempts >= params.max_attempts) {
+  ctx._source.processing_state = params.dead;
+  ctx._source.next_attempt_at = null;
+} else {
+  ctx._source.processing_state = params.pending;
+  ctx._source.next_attempt_at = params.now + (long) Math.min(params.base_delay * Math.pow(2, attempts - 1), params.max_delay);
+}
+"""
+
+# 与 user_shard() 相同的分片：Java String.hashCode 对分片数取模，没有 user_id 的归分片 0
+_SHARD_SCRIPT = (
+    "doc['user_id'].size() == 0 ? params.index == 0 "
+    ": Math.floorMod(doc['user_id'].value.hashCode(), params.count) == params.index"
+)
+
+
+def user_shard(user_id: str, count: int) -> int:
+    """The shard of a user, computed like the painless filter of claim_unprocessed_memories()."""
+    h = 0
+    data = user_id.encode("utf-16-be")
+    for i in range(0, len(data), 2):
+        # String.hashCode() runs over UTF-16 code units with 32-bit overflow
+        h = (31 * h + int.from_bytes(data[i:i + 2], "big")) & 0xFFFFFFFF
+    if h >= 0x80000000:
+        h -= 0x100000000
+    return h % count
+
+
+def _shard_filter(shard: Tuple[int, int]) -> Dict[str, Any]:
+    """Query clause matching the memories of one (index, count) shard."""
+    return {"script": {"script": {"source": _SHARD_SCRIPT, "params": {"index": shard[0], "count": shard[1]}}}}
+
 
 class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
     def __init__(self, index_name: str = "memories"):
@@ -16,22 +79,54 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         """Initialize the index with proper mapping."""
         logging.info(f"Initializing index with mapping: {self.mapping}")
         await self.create_index(self.mapping)
+        # 已存在的索引补上后加的处理状态字段
+        await self.put_mapping({field: self.mapping["properties"][field] for field in PROCESSING_FIELDS})
 
     async def create_memory(self, memory: MemoryDocument) -> str:
         """Create a new memory document."""
         content = memory.content
         embedding = embed_text(content)
-        if embedding:
+        if embedding is not None:
             memory.embedding = embedding
         return await self.index_document(memory.to_dict())
 
-    async def get_memory(self, id: str) -> Optional[MemoryDocument]:
-        """Get a memory document by ID."""
+    async def get_memory(
+        self,
+        id: str,
+        raw: bool = False
+    ) -> Optional[Union[MemoryDocument, Dict[str, Any]]]:
+        """
+        Get a memory document by ID.
+
+        If raw is True, the ``_source`` dict (with ``_id``) is returned instead of
+        a MemoryDocument, for read-only callers that serialize it directly.
+        """
         doc = await self.get_document(id)
         if doc:
+            if raw:
+                return {**doc, "_id": id}
             return MemoryDocument.from_dict(doc)
         return None
 
+    async def get_memories(
+        self,
+        ids: List[str],
+        raw: bool = False,
+        return_vector: bool = False,
+        source_includes: Optional[List[str]] = None
+    ) -> List[Union[MemoryDocument, Dict[str, Any]]]:
+        """
+        Get several memory documents by ID with a single multi-get.
+
+        Missing IDs are skipped; the others keep the order of ``ids``. The
+        embedding is only fetched when return_vector is True, and
+        source_includes limits the fields fetched.
+        """
+        docs = await self.get_documents(ids, return_vector=return_vector, source_includes=source_includes)
+        if raw:
+            return docs
+        return [MemoryDocument.from_dict(doc) for doc in docs]
+
     async def search_memories(
         self,
         query: str,
@@ -68,27 +163,29 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         user_id: Optional[str] = None,
         tags: Optional[List[str]] = None,
         memory_type: Optional[MemoryType] = None,
-        size: int = 10
-    ) -> List[MemoryDocument]:
+        size: int = 10,
+        raw: bool = False
+    ) -> List[Union[MemoryDocument, Dict[str, Any]]]:
         vector = embed_text(query)
-        if not vector:
+        if vector is None:
             raise ValueError("Failed to generate embedding for query")
-        return await self.search_by_vector(vector, user_id, tags, memory_type, size)
+        return await self.search_by_vector(vector, user_id, tags, memory_type, size, raw=raw)
 
     async def search_by_vector(
         self,
-        vector: List[float],
+        vector: Any,
         user_id: Optional[str] = None,
         tags: Optional[List[str]] = None,
         memory_type: Optional[MemoryType] = None,
         size: int = 10,
-        return_vector: bool = False
-    ) -> List[MemoryDocument]:
+        return_vector: bool = False,
+        raw: bool = False
+    ) -> List[Union[MemoryDocument, Dict[str, Any]]]:
         """Search memories using vector similarity with KNN."""
         query = {
             "knn": {
                 "field": "embedding",
-                "query_vector": vector,
+                "query_vector": to_wire(vector),
                 "k": size,
                 "num_candidates": size * 10
             }
@@ -117,14 +214,16 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         if not return_vector:
             query["_source"] = {"excludes": ["embedding"]}
 
-        results = await self.search(query, size=size)
+        results = await self.search(query, size=size, return_vector=return_vector)
         # logging.info(f"Search results: {results}")
+        if raw:
+            return results
         return [MemoryDocument.from_dict(doc) for doc in results]
 
     async def hybrid_search(
         self,
         query: str,
-        vector: List[float],
+        vector: Any,
         user_id: Optional[str] = None,
         tags: Optional[List[str]] = None,
         size: int = 10,
@@ -147,7 +246,7 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
                             "query": {"match_all": {}},
                             "script": {
                                 "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                                "params": {"query_vector": vector}
+                                "params": {"query_vector": to_wire(vector)}
                             }
                         }
                     }
@@ -173,20 +272,22 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         """Delete a memory document."""
         return await self.delete_document(id)
 
-    async def get_projects(self, user_id: Optional[str] = None) -> List[MemoryDocument]:
+    async def get_projects(self, user_id: Optional[str] = None, return_vector: bool = False) -> List[MemoryDocument]:
         """Get all projects."""
         docs, count = await self.list_memories(
             memory_type=MemoryType.PROJECT,
             user_id=user_id,
             page=1,
-            page_size=1000
+            page_size=1000,
+            return_vector=return_vector
         )
         if len(docs) != count:
             docs, _ = await self.list_memories(
                 memory_type=MemoryType.PROJECT,
                 user_id=user_id,
                 page=1,
-                page_size=count
+                page_size=count,
+                return_vector=return_vector
             )
         
         return docs
@@ -219,8 +320,10 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         page: int = 1,
         page_size: int = 10,
         sort_by: str = "created_at",
-        sort_order: str = "desc"
-    ) -> tuple[List[MemoryDocument], int]:
+        sort_order: str = "desc",
+        raw: bool = False,
+        return_vector: bool = False
+    ) -> tuple[List[Union[MemoryDocument, Dict[str, Any]]], int]:
         """
         List memories with pagination and sorting.
         
@@ -232,6 +335,8 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
             page_size: Number of items per page
             sort_by: Field to sort by (default: created_at)
             sort_order: Sort order (asc or desc)
+            raw: Return the hit dicts instead of MemoryDocument objects
+            return_vector: Include the embeddings
             
         Returns:
             Tuple of (list of memories, total count)
@@ -257,18 +362,21 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
         # Build sort clause
         sort_clause = [{sort_by: {"order": sort_order}}]
         
-        print(f"query: {query}")
+        logging.debug("list_memories query: %s", query)
         # Execute search
         results = await self.search(
             query=query,
             from_=from_,
             size=page_size,
-            sort=sort_clause
+            sort=sort_clause,
+            return_vector=return_vector
         )
         
         # Get total count
         count = await self.count(query)
         
+        if raw:
+            return results, count
         return [MemoryDocument.from_dict(doc) for doc in results], count
 
     async def get_unprocessed_memories(
@@ -316,6 +424,299 @@ class MemoryRepository(ElasticsearchRepository[MemoryDocument]):
             logging.error(f"获取未处理记忆时出错: {str(e)}")
             return []
 
+    async def claim_unprocessed_memories(
+        self,
+        owner: str,
+        batch_size: int = 10,
+        lease_seconds: float = 600,
+        user_id: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+        shard: Optional[Tuple[int, int]] = None
+    ) -> List[MemoryDocument]:
+        """
+        认领最旧的未处理原始记忆，并为 owner 设置租约
+
+        候选是没有租约或租约已过期、且已到 next_attempt_at 的记忆，死信除外。
+        每条记忆用 if_seq_no/if_primary_term 条件更新认领，其他 worker 先一步
+        认领的会冲突并被跳过，所以同一条记忆不会同时被两个 worker 处理。每次
+        认领 attempts 加一；已用完 max_attempts 次的（例如每次都让 worker 崩溃、
+        租约过期）直接转为死信。租约到期前要 renew_leases()，处理完成后
+        ack_memory()，失败时 fail_memory()，放弃时 release_memory()。
+
+        shard 为 (index, count) 时只认领 user_shard(user_id, count) == index
+        的记忆：多个 worker 进程各自处理一部分用户，同一用户的记忆总在同一个
+        进程里按顺序处理。
+
+        Returns:
+            List[MemoryDocument]: 认领成功的记忆，按创建时间升序排序
+        """
+        max_attempts = max_attempts or settings.MEMORY_MAX_ATTEMPTS
+        now_ms = int(time.time() * 1000)
+        query = {
+            "bool": {
+                "must": [
+                    {"term": {"memory_type": MemoryType.RAW.value}},
+                    {"term": {"processed": False}},
+                    {"bool": {
+                        "should": [
+                            {"bool": {"must_not": {"terms": {"processing_state": [
+                                ProcessingState.PROCESSING.value, ProcessingState.DEAD.value
+                            ]}}}},
+                            {"bool": {
+                                "must": {"range": {"lease_expires_at": {"lt": now_ms}}},
+                                "must_not": {"term": {"processing_state": ProcessingState.DEAD.value}}
+                            }}
+                        ],
+                        "minimum_should_match": 1
+                    }},
+                    {"bool": {
+                        "should": [
+                            {"bool": {"must_not": {"exists": {"field": "next_attempt_at"}}}},
+                            {"range": {"next_attempt_at": {"lte": now_ms}}}
+                        ],
+                        "minimum_should_match": 1
+                    }}
+                ]
+            }
+        }
+        if user_id:
+            query["bool"]["must"].append({"term": {"user_id": user_id}})
+        if shard and shard[1] > 1:
+            query["bool"]["must"].append(_shard_filter(shard))
+
+        try:
+            candidates = await self.search(
+                query, size=batch_size, sort=[{"created_at": {"order": "asc"}}], seq_no_primary_term=True
+            )
+        except Exception as e:
+            logging.error(f"查询可认领记忆时出错: {str(e)}")
+            return []
+
+        def claim(doc):
+            attempts = doc.get("attempts") or 0
+            if attempts >= max_attempts:
+                update = {
+                    "processing_state": ProcessingState.DEAD.value,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "last_error": doc.get("last_error") or f"lease expired {attempts} times",
+                }
+            else:
+                update = {
+                    "processing_state": ProcessingState.PROCESSING.value,
+                    "lease_owner": owner,
+                    "lease_expires_at": now_ms + int(lease_seconds * 1000),
+                    "attempts": attempts + 1,
+                }
+            return self.update_document_if(doc["_id"], update, doc["_seq_no"], doc["_primary_term"])
+
+        claimed = await asyncio.gather(*(claim(doc) for doc in candidates), return_exceptions=True)
+        return [
+            MemoryDocument.from_dict(doc)
+            for doc, ok in zip(candidates, claimed)
+            if ok is True and (doc.get("attempts") or 0) < max_attempts
+        ]
+
+    async def renew_leases(self, owner: str, ids: List[str], lease_seconds: float = 600) -> int:
+        """延长 owner 持有的这些记忆的租约，返回实际延长的数量"""
+        if not ids:
+            return 0
+        query = {
+            "bool": {
+                "filter": [
+                    {"ids": {"values": ids}},
+                    {"term": {"lease_owner": owner}},
+                    {"term": {"processing_state": ProcessingState.PROCESSING.value}}
+                ]
+            }
+        }
+        return await self.update_by_query(
+            query,
+            "ctx._source.lease_expires_at = params.expires_at",
+            {"expires_at": int((time.time() + lease_seconds) * 1000)}
+        )
+
+    async def ack_memory(self, id: str, owner: str) -> bool:
+        """
+        确认 owner 已处理完这条记忆：标记 processed 并清除租约
+
+        Returns:
+            bool: 租约已被其他 worker 重新认领时返回 False，记忆保持未处理
+        """
+        return await self.update_script(id, _ACK_SCRIPT, {
+            "owner": owner,
+            "state": ProcessingState.DONE.value,
+            "updated_at": now_timestamp()
+        }) is not None
+
+    async def release_memory(self, id: str, owner: str) -> bool:
+        """交还认领后还没开始处理的记忆，立即可以被重新认领，不计入尝试次数"""
+        return await self.update_script(id, _RELEASE_SCRIPT, {
+            "owner": owner,
+            "pending": ProcessingState.PENDING.value
+        }) is not None
+
+    async def fail_memory(
+        self,
+        id: str,
+        owner: str,
+        error: str,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        记录一次处理失败并交还租约
+
+        第 n 次失败后 base_delay * 2^(n-1) 秒（最多 max_delay）内不会被认领；
+        第 max_attempts 次失败后进入死信状态，直到 requeue_memory()。
+
+        Returns:
+            更新后的 processing_state、attempts 和 next_attempt_at；租约已被
+            其他 worker 认领时返回 None
+        """
+        return await self.update_script(id, _FAIL_SCRIPT, {
+            "owner": owner,
+            "error": error[:2000],
+            "now": int(time.time() * 1000),
+            "max_attempts": max_attempts or settings.MEMORY_MAX_ATTEMPTS,
+            "base_delay": int((base_delay or settings.MEMORY_RETRY_BASE_DELAY) * 1000),
+            "max_delay": int((max_delay or settings.MEMORY_RETRY_MAX_DELAY) * 1000),
+            "pending": ProcessingState.PENDING.value,
+            "dead": ProcessingState.DEAD.value
+        }, return_fields=["processing_state", "attempts", "next_attempt_at"])
+
+    async def count_live_memories(self, user_id: Optional[str] = None) -> int:
+        """
+        正常处理流程中的原始记忆数量：待处理和正在处理的，等待重试的和死信不算
+        """
+        query = {
+            "bool": {
+                "filter": [
+                    {"term": {"memory_type": MemoryType.RAW.value}},
+                    {"term": {"processed": False}},
+                    {"bool": {
+                        "should": [
+                            {"bool": {"must_not": {"exists": {"field": "next_attempt_at"}}}},
+                            {"range": {"next_attempt_at": {"lte": int(time.time() * 1000)}}}
+                        ],
+                        "minimum_should_match": 1
+                    }}
+                ],
+                "must_not": [{"term": {"processing_state": ProcessingState.DEAD.value}}]
+            }
+        }
+        if user_id:
+            query["bool"]["filter"].append({"term": {"user_id": user_id}})
+        return await self.count(query)
+
+    async def list_raw_memories_between(
+        self,
+        user_id: str,
+        since: str,
+        until: str,
+        after: Optional[str] = None,
+        size: int = 100
+    ) -> List[MemoryDocument]:
+        """
+        用户在 since 到 until 之间（含首尾两天，东八区日期 YYYY-MM-DD）创建的、已处理的原始记忆，按创建时间升序
+
+        after 为时间戳时从这个时间（含）开始，用于分页和断点续传：同一秒创建的
+        记忆会再次返回，由调用方按 id 跳过已经处理过的。未处理的记忆由 worker
+        正常处理，不在这里返回。
+        """
+        created_at = {"gte": since, "lt": f"{until}||+1d", "format": "yyyy-MM-dd", "time_zone": "+08:00"}
+        query = {
+            "bool": {
+                "filter": [
+                    {"term": {"memory_type": MemoryType.RAW.value}},
+                    {"term": {"user_id": user_id}},
+                    {"term": {"processed": True}},
+                    {"range": {"created_at": created_at}}
+                ]
+            }
+        }
+        if after:
+            query["bool"]["filter"].append({"range": {"created_at": {"gte": after}}})
+        results = await self.search(query, size=size, sort=[{"created_at": {"order": "asc"}}])
+        return [MemoryDocument.from_dict(doc) for doc in results]
+
+    async def backlog_stats(
+        self,
+        user_id: Optional[str] = None,
+        shard: Optional[Tuple[int, int]] = None,
+        max_users: int = 100
+    ) -> Dict[str, Any]:
+        """
+        未处理原始记忆的积压情况（死信除外，正在处理和等待重试的都算）
+
+        Returns:
+            {"total": 总数, "oldest": 最旧一条的创建时间（epoch 秒，没有积压时为 None）,
+             "users": {user_id: 数量}（积压最多的 max_users 个用户）}
+        """
+        query = {
+            "bool": {
+                "filter": [
+                    {"term": {"memory_type": MemoryType.RAW.value}},
+                    {"term": {"processed": False}}
+                ],
+                "must_not": [{"term": {"processing_state": ProcessingState.DEAD.value}}]
+            }
+        }
+        if user_id:
+            query["bool"]["filter"].append({"term": {"user_id": user_id}})
+        if shard and shard[1] > 1:
+            query["bool"]["filter"].append(_shard_filter(shard))
+        aggs = {
+            "total": {"filter": {"match_all": {}}},
+            "oldest": {"min": {"field": "created_at"}},
+            "users": {"terms": {"field": "user_id", "size": max_users}}
+        }
+        result = await self.aggregate(query, aggs)
+        oldest = result["oldest"]["value"]
+        return {
+            "total": result["total"]["doc_count"],
+            "oldest": oldest / 1000 if oldest is not None else None,
+            "users": {bucket["key"]: bucket["doc_count"] for bucket in result["users"]["buckets"]}
+        }
+
+    async def list_dead_memories(
+        self,
+        user_id: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        查询死信状态的原始记忆，最新的在前
+
+        Returns:
+            原始命中（包含 attempts 和 last_error）和总数
+        """
+        query = {
+            "bool": {
+                "filter": [
+                    {"term": {"processing_state": ProcessingState.DEAD.value}},
+                    {"term": {"processed": False}}
+                ]
+            }
+        }
+        if user_id:
+            query["bool"]["filter"].append({"term": {"user_id": user_id}})
+        hits = await self.search(
+            query, size=page_size, from_=(page - 1) * page_size, sort=[{"created_at": {"order": "desc"}}]
+        )
+        return hits, await self.count(query)
+
+    async def requeue_memory(self, id: str) -> bool:
+        """把死信记忆放回待处理队列，尝试次数清零"""
+        return await self.update_document(id, {
+            "processing_state": ProcessingState.PENDING.value,
+            "attempts": 0,
+            "next_attempt_at": None,
+            "lease_owner": None,
+            "lease_expires_at": None
+        })
+
     async def get_raw_memory_of_the_day(
         self,
         date_str: str,
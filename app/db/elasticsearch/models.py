@@ -1,5 +1,10 @@
+import inspect
+import re
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 from app.core.config import settings
+from app.utils.vectors import as_vector, to_wire
 from enum import Enum
 
 class MemoryType(str, Enum):
@@ -14,6 +19,13 @@ class MemoryType(str, Enum):
     YEARLY = "yearly"  # 年报
     ARCHIVED = "archived"  # 已归档的记忆
 
+class ProcessingState(str, Enum):
+    """原始记忆在 worker 中的处理状态，只存在于索引中"""
+    PENDING = "pending"  # 等待处理（没有该字段的旧文档同样视为等待）
+    PROCESSING = "processing"  # 已被某个 worker 租用，租约到期后可被重新认领
+    DONE = "done"  # 已处理并确认
+    DEAD = "dead"  # 达到最大尝试次数，不再自动重试，等待人工 requeue
+
 # Example document mapping
 MEMORY_DOCUMENT_MAPPING: Dict[str, Any] = {
     "properties": {
@@ -33,12 +45,81 @@ MEMORY_DOCUMENT_MAPPING: Dict[str, Any] = {
             "index": True,
             "similarity": "cosine"
         },
-        'processed': {'type': 'boolean'}
+        'processed': {'type': 'boolean'},
+        # 处理租约：worker 认领原始记忆时设置，确认或释放时清除
+        "processing_state": {"type": "keyword"},
+        "lease_owner": {"type": "keyword"},
+        "lease_expires_at": {"type": "date", "format": "epoch_millis"},
+        # 重试：认领次数、失败后按指数退避的下次尝试时间、最后一次错误
+        "attempts": {"type": "integer"},
+        "next_attempt_at": {"type": "date", "format": "epoch_millis"},
+        "last_error": {"type": "text", "index": False}
     }
 }
 
+# Fields added after the first release; put into the mapping of existing indices on startup
+PROCESSING_FIELDS = (
+    "processing_state", "lease_owner", "lease_expires_at", "attempts", "next_attempt_at", "last_error"
+)
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+# 已经是标准格式（东八区）的时间戳，可以直接使用，无需重新解析
+_CANONICAL_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+0800")
+
+@lru_cache(maxsize=1)
+def local_timezone() -> tzinfo:
+    """The Asia/Shanghai tz object, created once per process."""
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo('Asia/Shanghai')
+    except Exception:
+        # No tz database available; Asia/Shanghai has been a fixed UTC+8 since 1991
+        return timezone(timedelta(hours=8), 'Asia/Shanghai')
+
+def now_timestamp() -> str:
+    """The current time as a normalized timestamp string."""
+    return datetime.now(local_timezone()).strftime(TIMESTAMP_FORMAT)
+
+def normalize_timestamp(value: Optional[str]) -> Optional[str]:
+    """Normalize a timestamp string to ``%Y-%m-%dT%H:%M:%S%z`` in Asia/Shanghai.
+
+    Values that cannot be parsed are returned unchanged.
+    """
+    if not value:
+        return None
+    if _CANONICAL_TIMESTAMP.fullmatch(value):
+        return value
+    try:
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            from dateutil import parser
+            dt = parser.parse(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=local_timezone())
+        else:
+            dt = dt.astimezone(local_timezone())
+        return dt.strftime(TIMESTAMP_FORMAT)
+    except Exception:
+        return value
+
+_UNSET = object()
+
 # Example document structure
 class MemoryDocument:
+    """
+    A memory record as stored in Elasticsearch.
+
+    Uses __slots__ to keep per-object memory small. ``created_at`` and
+    ``updated_at`` keep the raw value and are normalized on first access.
+    """
+    __slots__ = (
+        'content', 'memory_type', 'tags', 'user_id', 'title', 'summary',
+        'parent_id', 'related_ids', 'embedding', '_score', '_id', 'processed',
+        '_created_at_raw', '_created_at', '_updated_at_raw', '_updated_at',
+    )
+
     def __init__(
         self,
         content: str,
@@ -64,41 +145,37 @@ class MemoryDocument:
         self.summary = summary
         self.parent_id = parent_id
         self.related_ids = related_ids or []
-        self.embedding = embedding
-        # 确保日期时间格式一致
-        if created_at:
-            try:
-                from datetime import datetime
-                import pytz
-                from dateutil import parser
-                dt = parser.parse(created_at)
-                if dt.tzinfo is None:
-                    dt = pytz.timezone('Asia/Shanghai').localize(dt)
-                else:
-                    dt = dt.astimezone(pytz.timezone('Asia/Shanghai'))
-                self.created_at = dt.strftime('%Y-%m-%dT%H:%M:%S%z')
-            except Exception:
-                self.created_at = created_at
-        else:
-            self.created_at = None
-            
-        if updated_at:
-            try:
-                dt = parser.parse(updated_at)
-                if dt.tzinfo is None:
-                    dt = pytz.timezone('Asia/Shanghai').localize(dt)
-                else:
-                    dt = dt.astimezone(pytz.timezone('Asia/Shanghai'))
-                self.updated_at = dt.strftime('%Y-%m-%dT%H:%M:%S%z')
-            except Exception:
-                self.updated_at = updated_at
-        else:
-            self.updated_at = None
-            
+        # 向量在内部统一使用 float32 数组
+        self.embedding = as_vector(embedding)
+        # 日期时间格式在第一次访问时统一
+        self.created_at = created_at
+        self.updated_at = updated_at
         self._score = _score
         self._id = _id
         self.processed = processed
 
+    @property
+    def created_at(self) -> Optional[str]:
+        if self._created_at is _UNSET:
+            self._created_at = normalize_timestamp(self._created_at_raw)
+        return self._created_at
+
+    @created_at.setter
+    def created_at(self, value: Optional[str]):
+        self._created_at_raw = value
+        self._created_at = _UNSET
+
+    @property
+    def updated_at(self) -> Optional[str]:
+        if self._updated_at is _UNSET:
+            self._updated_at = normalize_timestamp(self._updated_at_raw)
+        return self._updated_at
+
+    @updated_at.setter
+    def updated_at(self, value: Optional[str]):
+        self._updated_at_raw = value
+        self._updated_at = _UNSET
+
     def to_dict(self) -> Dict[str, Any]:
         doc_dict = {
             "content": self.content,
@@ -118,12 +195,13 @@ class MemoryDocument:
         if self.related_ids:
             doc_dict["related_ids"] = self.related_ids
         if self.embedding is not None:
-            doc_dict["embedding"] = self.embedding
+            doc_dict["embedding"] = to_wire(self.embedding)
         return doc_dict
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'MemoryDocument':
-        return cls(**data)
+        # 忽略未知字段（例如处理状态等只存在于索引中的字段）
+        return cls(**{key: value for key, value in data.items() if key in MEMORY_DOCUMENT_FIELDS})
 
     def __str__(self) -> str:
         id_str = f"id={self._id}, " if self._id else ""
@@ -140,4 +218,7 @@ class MemoryDocument:
         )
 
     def __repr__(self) -> str:
-        return self.__str__() 
+        return self.__str__()
+
+# Keyword arguments accepted by MemoryDocument.__init__
+MEMORY_DOCUMENT_FIELDS = frozenset(inspect.signature(MemoryDocument).parameters)
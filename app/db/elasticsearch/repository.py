@@ -1,10 +1,20 @@
 from typing import Any, Dict, List, Optional, TypeVar, Generic
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, ConflictError, NotFoundError
 from app.db.elasticsearch.client import get_es
+from app.core.metrics import ES_ERRORS, ES_SECONDS, timed
+from app.core.tracing import traced
 import logging
 
+logger = logging.getLogger(__name__)
+
 T = TypeVar('T')
 
+def _instrumented(operation: str):
+    """Record an operation in the ES metrics and as a span of the current trace."""
+    def decorator(func):
+        return timed(ES_SECONDS, ES_ERRORS, operation)(traced(f"es.{operation}")(func))
+    return decorator
+
 class ElasticsearchRepository(Generic[T]):
     def __init__(self, index_name: str):
         self.index_name = index_name
@@ -16,78 +26,132 @@ class ElasticsearchRepository(Generic[T]):
             self._es = await get_es()
         return self._es
 
+    @_instrumented("create_index")
     async def create_index(self, mappings: Dict[str, Any]) -> None:
         """Create an index with the specified mappings if it doesn't exist."""
         es = await self.es
         try:
             if not await es.indices.exists(index=self.index_name):
-                print(f"Creating index {self.index_name} with mappings: {mappings}")
+                logger.info("Creating index %s with mappings: %s", self.index_name, mappings)
                 await es.indices.create(index=self.index_name, mappings=mappings)
-                print(f"Successfully created index {self.index_name}")
+                logger.info("Successfully created index %s", self.index_name)
             else:
-                print(f"Index {self.index_name} already exists")
+                logger.debug("Index %s already exists", self.index_name)
         except Exception as e:
-            print(f"Error creating index {self.index_name}: {str(e)}")
+            logger.error("Error creating index %s: %s", self.index_name, e)
             raise
 
+    @_instrumented("delete_index")
     async def delete_index(self, are_you_sure: bool = False) -> None:
         """Delete the index."""
         es = await self.es
         try:
             if are_you_sure:
                 await es.indices.delete(index=self.index_name)
-                print(f"Successfully deleted index {self.index_name}")
+                logger.info("Successfully deleted index %s", self.index_name)
             else:
-                print(f"Index {self.index_name} not deleted. Use delete_index(are_you_sure=True) to delete it.")
+                logger.warning("Index %s not deleted. Use delete_index(are_you_sure=True) to delete it.", self.index_name)
+        except Exception as e:
+            logger.error("Error deleting index %s: %s", self.index_name, e)
+            raise
+
+    @_instrumented("put_mapping")
+    async def put_mapping(self, properties: Dict[str, Any]) -> None:
+        """Add fields to the mapping of an existing index."""
+        es = await self.es
+        try:
+            await es.indices.put_mapping(index=self.index_name, properties=properties)
         except Exception as e:
-            print(f"Error deleting index {self.index_name}: {str(e)}")
+            logger.error("Error updating mapping of %s: %s", self.index_name, e)
             raise
 
+    @_instrumented("index_document")
     async def index_document(self, document: Dict[str, Any], id: Optional[str] = None) -> str:
         """Index a document and return its ID."""
         es = await self.es
         try:
-            # print(f"Indexing document in {self.index_name}: {document}")
             result = await es.index(
                 index=self.index_name,
                 document=document,
                 id=id,
                 refresh=True  # This ensures the document is immediately available for search
             )
-            print(f"Successfully indexed document with result: {result}")
+            logger.debug("Indexed document %s in %s: %s", result['_id'], self.index_name, result['result'])
             return result['_id']
         except Exception as e:
-            print(f"Error indexing document: {str(e)}")
+            logger.error("Error indexing document in %s: %s", self.index_name, e)
             raise
 
+    @_instrumented("get_document")
     async def get_document(self, id: str) -> Optional[Dict[str, Any]]:
         """Retrieve a document by ID."""
         es = await self.es
         try:
-            print(f"Getting document with ID {id} from {self.index_name}")
             result = await es.get(index=self.index_name, id=id)
-            # print(f"Successfully retrieved document: {result}")
             return result['_source']
+        except NotFoundError:
+            return None
         except Exception as e:
-            print(f"Error getting document {id}: {str(e)}")
+            ES_ERRORS.inc("get_document")
+            logger.error("Error getting document %s: %s", id, e)
             return None
 
+    @_instrumented("get_documents")
+    async def get_documents(
+        self,
+        ids: List[str],
+        return_vector: bool = False,
+        source_includes: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve several documents by ID in one _mget round-trip.
+
+        Found documents are returned as ``_source`` plus ``_id``, in the order
+        of ``ids`` and without duplicates; missing IDs are left out.
+        """
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        es = await self.es
+        try:
+            result = await es.mget(
+                index=self.index_name,
+                ids=ids,
+                _source_includes=source_includes,
+                _source_excludes=None if return_vector else ["embedding"]
+            )
+            return [{**doc['_source'], '_id': doc['_id']} for doc in result['docs'] if doc.get('found')]
+        except Exception as e:
+            logger.error("Error getting %d documents from %s: %s", len(ids), self.index_name, e)
+            raise
+
+    @_instrumented("search")
     async def search(
         self, 
         query: Dict[str, Any], 
         size: int = 10,
         from_: int = 0,
-        sort: Optional[List[Dict[str, Any]]] = None
+        sort: Optional[List[Dict[str, Any]]] = None,
+        return_vector: bool = False,
+        seq_no_primary_term: bool = False
     ) -> List[Dict[str, Any]]:
-        """Search for documents using the specified query."""
+        """
+        Search for documents using the specified query.
+
+        With ``seq_no_primary_term`` the hits carry ``_seq_no`` and
+        ``_primary_term``, for a conditional update_document_if().
+        """
         es = await self.es
+        # 默认排除 embedding 字段
+        source_excludes = None if return_vector else ["embedding"]
         try:
             # Check if this is a KNN query
             if "knn" in query:
                 result = await es.search(
                     index=self.index_name,
                     body=query,
-                    _source_excludes=["embedding"]  # 排除 embedding 字段
+                    _source_excludes=source_excludes,
+                    seq_no_primary_term=seq_no_primary_term or None
                 )
             else:
                 search_body = {
@@ -101,17 +165,24 @@ class ElasticsearchRepository(Generic[T]):
                 result = await es.search(
                     index=self.index_name,
                     body=search_body,
-                    _source_excludes=["embedding"]  # 排除 embedding 字段
+                    _source_excludes=source_excludes,
+                    seq_no_primary_term=seq_no_primary_term or None
                 )
-            return [{
+            hits = [{
                 **hit['_source'],
                 '_score': hit['_score'],
                 '_id': hit['_id']
             } for hit in result['hits']['hits']]
+            if seq_no_primary_term:
+                for doc, hit in zip(hits, result['hits']['hits']):
+                    doc['_seq_no'] = hit['_seq_no']
+                    doc['_primary_term'] = hit['_primary_term']
+            return hits
         except Exception as e:
-            print(f"Error searching documents: {str(e)}")
+            logger.error("Error searching documents in %s: %s", self.index_name, e)
             raise
 
+    @_instrumented("count")
     async def count(self, query: Dict[str, Any]) -> int:
         """Count documents matching the specified query."""
         es = await self.es
@@ -122,38 +193,130 @@ class ElasticsearchRepository(Generic[T]):
             )
             return result['count']
         except Exception as e:
-            print(f"Error counting documents: {str(e)}")
+            logger.error("Error counting documents in %s: %s", self.index_name, e)
             raise
 
+    @_instrumented("aggregate")
+    async def aggregate(self, query: Dict[str, Any], aggs: Dict[str, Any]) -> Dict[str, Any]:
+        """Run aggregations over the documents matching the query, without returning hits."""
+        es = await self.es
+        try:
+            result = await es.search(index=self.index_name, query=query, aggs=aggs, size=0)
+            return result['aggregations']
+        except Exception as e:
+            logger.error("Error aggregating documents in %s: %s", self.index_name, e)
+            raise
+
+    @_instrumented("update_document")
     async def update_document(self, id: str, document: Dict[str, Any]) -> bool:
         """Update a document by ID."""
         es = await self.es
         try:
-            # print(f"Updating document {id} in {self.index_name} with: {document}")
             result = await es.update(
                 index=self.index_name,
                 id=id,
                 doc=document,
                 refresh=True  # This ensures the update is immediately visible
             )
-            print(f"Update result: {result}")
+            logger.debug("Updated document %s in %s: %s", id, self.index_name, result['result'])
             return True
         except Exception as e:
-            print(f"Error updating document {id}: {str(e)}")
+            ES_ERRORS.inc("update_document")
+            logger.error("Error updating document %s: %s", id, e)
             return False
 
+    @_instrumented("update_document_if")
+    async def update_document_if(
+        self,
+        id: str,
+        document: Dict[str, Any],
+        seq_no: int,
+        primary_term: int,
+        refresh: bool = False
+    ) -> bool:
+        """
+        Update a document only if it has not changed since it was read at
+        (seq_no, primary_term). Returns False if another writer got there first.
+        """
+        es = await self.es
+        try:
+            await es.update(
+                index=self.index_name,
+                id=id,
+                doc=document,
+                if_seq_no=seq_no,
+                if_primary_term=primary_term,
+                refresh=refresh
+            )
+            return True
+        except ConflictError:
+            return False
+        except Exception as e:
+            logger.error("Error updating document %s: %s", id, e)
+            raise
+
+    @_instrumented("update_script")
+    async def update_script(
+        self,
+        id: str,
+        source: str,
+        params: Dict[str, Any],
+        refresh: bool = True,
+        return_fields: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update a document with a painless script.
+
+        Returns None if the script chose ``ctx.op = 'noop'``, otherwise the
+        ``return_fields`` of the updated document (an empty dict if none asked).
+        """
+        es = await self.es
+        try:
+            result = await es.update(
+                index=self.index_name,
+                id=id,
+                script={"source": source, "lang": "painless", "params": params},
+                refresh=refresh,
+                source=bool(return_fields) or None,
+                source_includes=return_fields
+            )
+            if result['result'] == 'noop':
+                return None
+            return result.get('get', {}).get('_source', {}) if return_fields else {}
+        except Exception as e:
+            logger.error("Error updating document %s with script: %s", id, e)
+            raise
+
+    @_instrumented("update_by_query")
+    async def update_by_query(self, query: Dict[str, Any], source: str, params: Dict[str, Any]) -> int:
+        """Update all documents matching the query with a painless script; returns the number updated."""
+        es = await self.es
+        try:
+            result = await es.update_by_query(
+                index=self.index_name,
+                query=query,
+                script={"source": source, "lang": "painless", "params": params},
+                conflicts="proceed",
+                refresh=False
+            )
+            return result['updated']
+        except Exception as e:
+            logger.error("Error updating documents by query in %s: %s", self.index_name, e)
+            raise
+
+    @_instrumented("delete_document")
     async def delete_document(self, id: str) -> bool:
         """Delete a document by ID."""
         es = await self.es
         try:
-            print(f"Deleting document {id} from {self.index_name}")
             result = await es.delete(
                 index=self.index_name,
                 id=id,
                 refresh=True  # This ensures the deletion is immediately visible
             )
-            print(f"Delete result: {result}")
+            logger.debug("Deleted document %s from %s: %s", id, self.index_name, result['result'])
             return True
         except Exception as e:
-            print(f"Error deleting document {id}: {str(e)}")
+            ES_ERRORS.inc("delete_document")
+            logger.error("Error deleting document %s: %s", id, e)
             return False
\ No newline at end of file
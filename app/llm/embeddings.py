@@ -1,18 +1,47 @@
-from typing import List
-from openai import OpenAI
+from typing import TYPE_CHECKING, Optional
+import numpy as np
 from app.core.config import settings
+from app.core.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_ERRORS, EMBEDDING_SECONDS, timed
+from app.core.tracing import traced
+from app.utils.vectors import as_vector
 
-def embed_text(text: str) -> List[float]:
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+_client: Optional["OpenAI"] = None
+
+def get_embedding_client() -> "OpenAI":
+    """
+    Get the process-wide embedding client, so connections are reused.
+
+    The SDK is imported on first use: it is the largest import of the API
+    process and only needed once a text is embedded.
+    """
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(
+            api_key=settings.OPENAI_API_KEY_FOR_EMBEDDING,
+            base_url=settings.OPENAI_API_BASE_FOR_EMBEDDING
+        )
+    return _client
+
+def embed_text(text: str) -> Optional[np.ndarray]:
+    """Embed a text and return the vector as a float32 array."""
     if not text:
         return None
-    client = OpenAI(
-        api_key=settings.OPENAI_API_KEY_FOR_EMBEDDING,
-        base_url=settings.OPENAI_API_BASE_FOR_EMBEDDING
-    )    
-    response = client.embeddings.create(
+    EMBEDDING_BATCH_SIZE.observe(1, settings.EMBEDDING_MODEL)
+    response = _create_embedding(text)
+    # base64 is decoded straight into a float32 buffer, float lists are converted once
+    return as_vector(response.data[0].embedding)
+
+@timed(EMBEDDING_SECONDS, EMBEDDING_ERRORS, settings.EMBEDDING_MODEL)
+@traced("embedding")
+def _create_embedding(text):
+    client = get_embedding_client()
+    return client.embeddings.create(
         input=text,
         model=settings.EMBEDDING_MODEL,
         dimensions=settings.EMBEDDING_DIMENSION,
-        encoding_format="float"
+        encoding_format=settings.EMBEDDING_ENCODING_FORMAT
     )
-    return response.data[0].embedding 
\ No newline at end of file
@@ -1,18 +1,29 @@
 import asyncio
-from typing import List
-from datetime import datetime
+import logging
+from typing import List, Optional
 import contextvars
 
-from agents import Agent, Runner, RunConfig
+from pydantic import BaseModel
+from agents import Agent
 from agents import function_tool
-from agents.models.openai_provider import OpenAIProvider
-from app.core.config import settings
+from app.core.tracing import traced
 from app.db.elasticsearch.memory_repository import MemoryRepository
 from app.db.elasticsearch.models import MemoryDocument, MemoryType
-from app.storage.file_storage import FileStorage
+from app.llm.model_provider import get_run_config
+from app.llm.runner import current_time_instructions, metrics_hooks, run_agent
+from app.llm.source_memories import derived_fields, publish_derived, sources_of
+from app.storage.file_storage import file_storage
+from app.utils.event_log import INSIGHT_CREATED
+
+logger = logging.getLogger(__name__)
 
 raw_memory_context = contextvars.ContextVar('raw_memory', default=None)
 
+
+class MemoryUpdate(BaseModel):
+    memory_id: str
+    new_content: str
+
 insight_agent_instructions = """
  你是一个专业的用户记忆管理的助手，你将收到用户输入的一条原始的记忆，你要提炼出关键信息，形成更清晰和有条理的记忆，必要的时候可以使用下面记忆管理工具来查找旧记忆、更新记忆、删除记忆和增加记忆。
  注意：
@@ -150,6 +161,7 @@ Final instructions and prompt to think step by step
 When processing each user input, pause and silently run the Reasoning Steps above. Only after that internal deliberation should you emit either a tool call or no_action. Think step by step before you answer.
 '''
 
+@traced("tool.search_memory")
 async def search_memory(query: str):
     """
     A tool to search for memories.
@@ -162,7 +174,7 @@ async def search_memory(query: str):
     # 在异步多用户场景中，每个用户的请求都有自己的上下文
     # 因此，这里获取的 user_id 总是与当前处理的请求对应的用户 ID
     raw_memory = raw_memory_context.get()
-    print(f"search_memory is called with raw_memory: {raw_memory.user_id}, query: {query}")
+    logger.debug("search_memory is called with raw_memory: %s, query: %s", raw_memory.user_id, query)
     repo = MemoryRepository()
     memory_docs = await repo.search_by_similarity(query, raw_memory.user_id, raw_memory.tags, size=10, memory_type=MemoryType.INSIGHT)
     memory_list = [f"@{memory.created_at}: {memory.content}" for memory in memory_docs if memory.memory_type == MemoryType.INSIGHT]
@@ -171,10 +183,12 @@ async def search_memory(query: str):
     ret = "\n".join(memory_list)
     if not memory_list:
         ret = "No related memories found."
-    print(ret)
+    logger.debug("search_memory result: %s", ret)
     return ret
 
-async def create_memory(memory_to_record: List[str], memory_category: str) -> str:
+@traced("tool.create_memory")
+async def create_memory(memory_to_record: List[str], memory_category: str,
+                        source_ids: Optional[List[str]] = None) -> str:
     """
     A tool to create a new memory.
     Attention:
@@ -182,6 +196,7 @@ async def create_memory(memory_to_record: List[str], memory_category: str) -> st
     Args:
         memory_to_record (List[str]): memory or memories to record
         memory_category (str): could be any of "Factual", "Preferential"
+        source_ids (List[str]): if the input has several <memory> elements, the ids of those the memories come from; null otherwise
     Returns:
         str: success message
     """
@@ -201,7 +216,10 @@ async def create_memory(memory_to_record: List[str], memory_category: str) -> st
     # 在异步多用户场景中，每个用户的请求都有自己的上下文
     # 因此，这里获取的 user_id 总是与当前处理的请求对应的用户 ID
     raw_memory = raw_memory_context.get()
-    print(f"create_memory is called with raw_memory: {raw_memory.user_id}, memory: {memory_to_record}")
+    logger.debug("create_memory is called with raw_memory: %s, memory: %s", raw_memory.user_id, memory_to_record)
+    # 合并处理时，新记忆使用它所来自的原始记忆的时间和标签
+    sources = sources_of(raw_memory, source_ids)
+    fields = derived_fields(sources)
 
     repo = MemoryRepository()
     memory_ids = []
@@ -211,23 +229,22 @@ async def create_memory(memory_to_record: List[str], memory_category: str) -> st
             title=memory_category,
             content=memory,
             memory_type=MemoryType.INSIGHT,
-            tags=raw_memory.tags,
-            created_at=raw_memory.created_at,
-            updated_at=raw_memory.updated_at,
+            tags=fields["tags"],
+            created_at=fields["created_at"],
+            updated_at=fields["updated_at"],
             processed=True
         )
         memory_id = await repo.create_memory(new_memory)
         # Save to local file storage
-        memory_data = new_memory.to_dict()
-        memory_data["_id"] = memory_id  # Add the ID to the data
-        file_storage = FileStorage()
-
-        file_storage.save_memory(memory_id, memory_data)
+        file_storage.save_memory_document(memory_id, new_memory)
+        await publish_derived(INSIGHT_CREATED, raw_memory.user_id, memory_id, sources,
+                              data={"title": memory_category, "content": memory})
         memory_ids.append(memory_id)
-    print(f"Memory created with IDs: {', '.join(memory_ids)}")
+    logger.info("Memory created with IDs: %s", ', '.join(memory_ids))
     return f"success to create memory, ids are {', '.join(memory_ids)}"
 
-async def update_memory(memory_id: str, new_content: str) -> str:
+@traced("tool.update_memory")
+async def update_memory(updates: List[MemoryUpdate]) -> str:
     # """
     # 更新insight记忆的工具
     # 当你发现用户的偏好和之前的记忆发生变化时，或者用户请求更新某些内容时，主动调用此工具。
@@ -241,48 +258,64 @@ async def update_memory(memory_id: str, new_content: str) -> str:
     # """
 
     """
-    A tool to update an existing memory.
+    A tool to update one or more existing memories; update several memories in one call.
     Args:
-        memory_id (str): The ID of the memory to update
-        new_content (str): The new content to update the memory with
+        updates (List[MemoryUpdate]): The memories to update, each with the memory_id and the new_content to update it with
     Returns:
-        str: Success message
+        str: The result for each memory
     """
     repo = MemoryRepository()
-    memory = await repo.get_memory(memory_id)
-    
-    if not memory:
-        return f"Memory with ID {memory_id} not found."
-
-    memory.content = new_content
-    await repo.update_memory(memory)
+    # 一次 mget 取回所有要更新的记忆，而不是逐个查询
+    memories = {memory._id: memory for memory in await repo.get_memories([update.memory_id for update in updates])}
+    results = []
+    for update in updates:
+        memory = memories.get(update.memory_id)
+        if not memory:
+            results.append(f"Memory with ID {update.memory_id} not found.")
+            continue
+
+        memory.content = update.new_content
+        await repo.update_memory(update.memory_id, memory)
+        file_storage.save_memory_document(update.memory_id, memory)
+        results.append(f"Memory with ID {update.memory_id} updated successfully.")
+
+    return "\n".join(results)
+
+# 代理和工具只创建一次；每次运行的原始记忆通过 raw_memory_context 传给工具
+insight_memory_agent = Agent(
+    name="Insight Memory Agent",
+    instructions=current_time_instructions(insight_agent_instructions),
+    # handoff_description="Special Agent for process general purpose memory, such as insights, preference, profiles and facts.",
+    handoff_description="洞察个人记忆的Agent，处理包含个人的喜好、见解、想法、反思、生活或领悟的内容，把原始的记忆处理成更有价值的洞察。"
+    "下面的例子应该使用insight_memory_agent来处理："
+    "- 刚刚完成了一次力量训练（个人生活记录）；"
+    "- 我不喜欢吃海鲜（个人喜好）；"
+    "- 我今天学习了python（个人学习记录）；"
+    "- 我今天吃了两个苹果（个人饮食记录）；"
+    "- 我发现关税政策对经济的影响很大（个人见解）；"
+    "注意重要：本代理不处理关于计划、任务、行动项的记忆，应该使用项目记忆代理来处理。",
+    tools=[
+        function_tool(search_memory),
+        function_tool(create_memory),
+        function_tool(update_memory)
+    ],
+)
 
-    return f"Memory with ID {memory_id} updated successfully."
+insight_memory_agent_tool = insight_memory_agent.as_tool(
+    tool_name="insight_memory_agent",
+    tool_description="A tool to handle insight memory.",
+    hooks=metrics_hooks,
+)
 
 async def update_insight_memory(raw_memory: MemoryDocument):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    global instructions
-    instructions = f"当前时间：{now}\n" + instructions
-
     # 设置上下文变量
     # 在异步多用户场景中，每个用户的请求都有自己的上下文
     # 因此，这里设置的 user_id 只会影响当前处理的请求
     token = raw_memory_context.set(raw_memory)
     
     try:
-        memory_agent = Agent(
-            name="Memory Agent",
-            instructions=instructions,
-            tools=[function_tool(create_memory), function_tool(search_memory), function_tool(update_memory)],
-        )
-        my_model_provider = OpenAIProvider(
-            api_key=settings.OPENAI_API_KEY_FOR_LLM,
-            base_url=settings.OPENAI_API_BASE_FOR_LLM,
-        )
-        my_run_config = RunConfig(model_provider=my_model_provider)
-        
-        result = await Runner.run(memory_agent, raw_memory.content, run_config=my_run_config)
-        print(result.final_output)
+        result = await run_agent(insight_memory_agent, raw_memory.content, run_config=get_run_config())
+        logger.info("Insight agent output for %s: %s", raw_memory.user_id, result.final_output)
         return result.final_output
     finally:
         # 重置上下文变量
@@ -290,43 +323,9 @@ async def update_insight_memory(raw_memory: MemoryDocument):
         # 在异步多用户场景中，这确保了一个用户的上下文不会影响其他用户
         raw_memory_context.reset(token)
 
-def get_insight_memory_agent(raw_memory: MemoryDocument) -> Agent:
+def get_insight_memory_agent() -> Agent:
     """
-    获取用户记忆代理
+    获取用户记忆代理（作为分类代理的工具）
     :return: Agent
     """
-    raw_memory_context.set(raw_memory)
-    instructions = f"当前时间：{datetime.now().strftime('%Y-%m-%d %H:%M')}\n" + insight_agent_instructions 
-
-    agent = Agent(
-        name="Insight Memory Agent",
-        instructions=instructions,
-        # handoff_description="Special Agent for process general purpose memory, such as insights, preference, profiles and facts.",
-        handoff_description="洞察个人记忆的Agent，处理包含个人的喜好、见解、想法、反思、生活或领悟的内容，把原始的记忆处理成更有价值的洞察。"
-        "下面的例子应该使用insight_memory_agent来处理："
-        "- 刚刚完成了一次力量训练（个人生活记录）；"
-        "- 我不喜欢吃海鲜（个人喜好）；"
-        "- 我今天学习了python（个人学习记录）；"
-        "- 我今天吃了两个苹果（个人饮食记录）；"
-        "- 我发现关税政策对经济的影响很大（个人见解）；"
-        "注意重要：本代理不处理关于计划、任务、行动项的记忆，应该使用项目记忆代理来处理。",
-        tools=[
-            function_tool(search_memory),
-            function_tool(create_memory),
-            function_tool(update_memory)
-        ],
-    )
-    tool = agent.as_tool(
-        tool_name="insight_memory_agent",
-        tool_description="A tool to handle insight memory.",
-    )
-    return tool
-    # return agent
-
-def clear_context():
-    """
-    清除上下文变量
-    :return: None
-    """
-    raw_memory_context.set(None)
-    print("Context cleared")
+    return insight_memory_agent_tool
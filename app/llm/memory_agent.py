@@ -1,19 +1,24 @@
 import asyncio
+import logging
 from datetime import datetime
-from openai import AsyncOpenAI
-from pydantic import BaseModel
+from typing import List, Optional
 # from rich.pretty import pprint
-from agents import Agent, Runner, RunConfig, Model, ModelProvider
-from agents.models.openai_provider import OpenAIProvider
+from agents import Agent, RunContextWrapper
 from app.core.config import settings
 from app.db.elasticsearch.models import MemoryDocument, MemoryType
-from app.llm.project_memory_agent import get_project_memory_agent, clear_context as clear_project_context
-from app.llm.insight_memory_agent import get_insight_memory_agent, clear_context as clear_insight_context
-from app.db.elasticsearch.memory_repository import MemoryRepository
-from agents import Agent, OpenAIChatCompletionsModel, Runner, function_tool, set_tracing_disabled
-# from app.storage.file_storage import FileStorage
+from app.llm.embeddings import embed_text
+from app.llm.project_memory_agent import get_project_memory_agent, raw_memory_context as project_raw_memory_context
+from app.llm.insight_memory_agent import get_insight_memory_agent, raw_memory_context as insight_raw_memory_context
+from app.llm.model_provider import get_run_config
+from app.llm.runner import run_agent
+from app.llm.source_memories import source_memories_context
+from app.services.project_catalog import project_catalog
+from app.storage.file_storage import file_storage
+from app.utils.tokens import estimate_tokens
 # from app.llm.agno_memory import AgnoMemory
 
+logger = logging.getLogger(__name__)
+
 triage_agent_instructions = """
 You are a triage agent to handle a user input message, which is a raw memory from recorded by user, you will decide which agent to use to handle the memory.
 You should analyze the user input message and decide which agent(s) to use.
@@ -85,6 +90,7 @@ Use the system-defined function_call mechanism, supplying the target agent’s n
 6.	Construct the function_call payload.
 7.	Output strictly in the required format 
 8.  If more than one memory fragment is identified, call the Agent for each fragment.
+9.  The input may contain several memories recorded close together, each in a <memory> element with its id and created_at. Route every one of them; memories about the same project or insight can be sent to the agent in one call. Always keep the <memory> elements (id and created_at) around the content you send, so the agent can tell which memories what it records comes from.
 
 If route is Split, return an array of two routing objects—one per segment—in the order processed.
 
@@ -121,60 +127,137 @@ Final instructions and prompt to think step by step
 When you receive a memory snippet, think step by step using the Reasoning Steps above before producing your JSON‑formatted output.
 '''
 
-class Project(BaseModel):
-    project_id: str
-    project_name: str
-    project_description: str
-
-async def get_project_information(user_id: str) -> str:
-    repo = MemoryRepository()
-    projects = await repo.get_projects(user_id)
-    projects = [Project(project_id=project._id, project_name=project.title, project_description=project.content) for project in projects]
-    
-    projects = [f"<project>\n<project_name>{project.project_name}</project_name>\n<project_description>{project.project_description}</project_description>\n</project>" for project in projects]
-    return "```<projects>\n" + "\n".join(projects) + "\n</projects>```" if projects else "No Projects Created"
-class CustomModelProvider(ModelProvider):
-    def get_model(self, model_name: str | None) -> Model:
-        client = AsyncOpenAI(base_url=settings.OPENAI_API_BASE_FOR_LLM, api_key=settings.OPENAI_API_KEY_FOR_LLM)
-        return OpenAIChatCompletionsModel(model=model_name or settings.LLM_MODEL, openai_client=client)
-    
-async def process_raw_memory(raw_memory: MemoryDocument):
-    print(f"Processing raw memory for user: {raw_memory.user_id}, content: {raw_memory.content}")
-        
-    insight_memory_agent = get_insight_memory_agent(raw_memory=raw_memory)
-    project_memory_agent = get_project_memory_agent(raw_memory=raw_memory)
-    triage_agent = Agent(
-        name="Triage Agent",
-        instructions=triage_agent_instructions + "\n" + await get_project_information(raw_memory.user_id),
-        tools=[insight_memory_agent, project_memory_agent],
-        # handoff_description="You are a triage agent, you will decide which agent to use. Try to use the most appropriate agent to handle the memory.",
-        # handoffs=[project_memory_agent, insight_memory_agent],
-    )
-
-    if not settings.OPENAI_RESPONSE_API:
-        set_tracing_disabled(disabled=True)
-        my_model_provider = CustomModelProvider()
-
-    else:
-        my_model_provider = OpenAIProvider(
-            api_key=settings.OPENAI_API_KEY_FOR_LLM,
-            base_url=settings.OPENAI_API_BASE_FOR_LLM,
+def format_project(project: MemoryDocument) -> str:
+    return f"<project>\n<project_name>{project.title}</project_name>\n<project_description>{project.content}</project_description>\n</project>"
+
+async def memory_vector(raw_memory: MemoryDocument):
+    """
+    记忆的嵌入：API 创建记忆时已经计算并保存在本地副本里，直接复用；
+    只有合并处理的多条记忆（内容是合并后的输入）或找不到保存的嵌入时才重新计算
+    """
+    sources = source_memories_context.get() or [raw_memory]
+    if len(sources) == 1 and sources[0] is raw_memory and raw_memory._id:
+        if raw_memory.embedding is not None:
+            return raw_memory.embedding
+        vector = await asyncio.to_thread(file_storage.get_vector, raw_memory._id)
+        if vector is not None:
+            return vector
+    # 嵌入请求是同步的，放到线程里，不阻塞其他用户的记忆处理
+    return await asyncio.to_thread(embed_text, raw_memory.content)
+
+async def select_projects(raw_memory: MemoryDocument, projects: List[MemoryDocument]) -> List[MemoryDocument]:
+    """
+    选出放进分类代理指令的项目：和记忆最相似的 TRIAGE_PROJECTS_TOP_K 个，
+    加上最近更新的 TRIAGE_PROJECTS_RECENT 个，合计不超过 TRIAGE_PROJECTS_MAX_TOKENS
+
+    项目不多、全部放得下时不做选择，也不用取记忆的嵌入。
+    """
+    costs = {project._id: estimate_tokens(format_project(project)) for project in projects}
+    limit = settings.TRIAGE_PROJECTS_TOP_K + settings.TRIAGE_PROJECTS_RECENT
+    if len(projects) <= limit and sum(costs.values()) <= settings.TRIAGE_PROJECTS_MAX_TOKENS:
+        return projects
+
+    candidates = []
+    try:
+        vector = await memory_vector(raw_memory)
+        if vector is not None:
+            # 对已取到的项目排序：目录在此期间重新加载时，候选项目仍都在 costs 里
+            similar = await project_catalog.search(raw_memory.user_id, vector, settings.TRIAGE_PROJECTS_TOP_K,
+                                                   projects)
+            candidates += [project for project, _ in similar]
+    except Exception as e:
+        # 没有嵌入时只按更新时间选择
+        logger.warning("Cannot rank projects for %s by similarity: %s", raw_memory.user_id, e)
+    recent = sorted(projects, key=lambda project: project.updated_at or "", reverse=True)
+    candidates += recent[:settings.TRIAGE_PROJECTS_RECENT]
+
+    selected, seen, tokens = [], set(), 0
+    for project in candidates:
+        if project._id in seen:
+            continue
+        seen.add(project._id)
+        # 第一个项目总是放进去，其余的在预算内依次加入
+        if selected and tokens + costs[project._id] > settings.TRIAGE_PROJECTS_MAX_TOKENS:
+            continue
+        selected.append(project)
+        tokens += costs[project._id]
+    return selected
+
+async def get_project_information(raw_memory: MemoryDocument) -> str:
+    projects = await project_catalog.get(raw_memory.user_id)
+    if not projects:
+        return "No Projects Created"
+    selected = await select_projects(raw_memory, projects)
+    information = "```<projects>\n" + "\n".join(format_project(project) for project in selected) + "\n</projects>```"
+    if len(selected) < len(projects):
+        information += (
+            f"\nThe user has {len(projects)} projects; only the {len(selected)} most related to this memory "
+            "or most recently updated are listed. If the memory seems to belong to a project that is not listed, "
+            "route it to project_memory_agent, which can search all projects."
         )
-    my_run_config = RunConfig(model=settings.LLM_MODEL, model_provider=my_model_provider)
-
+    return information
+
+async def triage_instructions(context: RunContextWrapper[MemoryDocument], agent: Agent) -> str:
+    """分类代理的指令：固定的说明加上和这条记忆相关的项目（来自项目缓存）"""
+    return triage_agent_instructions + "\n" + await get_project_information(context.context)
+
+# 分类代理只创建一次；原始记忆作为运行的 context 传给指令，通过 raw_memory_context 传给子代理的工具
+triage_agent = Agent(
+    name="Triage Agent",
+    instructions=triage_instructions,
+    tools=[get_insight_memory_agent(), get_project_memory_agent()],
+    # handoff_description="You are a triage agent, you will decide which agent to use. Try to use the most appropriate agent to handle the memory.",
+    # handoffs=[project_memory_agent, insight_memory_agent],
+)
+
+async def process_raw_memory(raw_memory: MemoryDocument, sources: Optional[List[MemoryDocument]] = None):
+    """
+    处理一条原始记忆；sources 是合并处理时的各条原始记忆，raw_memory 是它们合并后的输入
+    """
+    logger.debug("Processing raw memory for user: %s, content: %s", raw_memory.user_id, raw_memory.content)
+
+    # 在异步多用户场景中，每条记忆的处理在自己的上下文里，不会影响其他用户
+    insight_token = insight_raw_memory_context.set(raw_memory)
+    project_token = project_raw_memory_context.set(raw_memory)
+    sources_token = source_memories_context.set(sources or [raw_memory])
     try:
-        result = await Runner.run(triage_agent, raw_memory.content, run_config=my_run_config)
-        print(result.final_output)
+        result = await run_agent(triage_agent, raw_memory.content, run_config=get_run_config(), context=raw_memory)
+        logger.info("Triage agent output for %s: %s", raw_memory.user_id, result.final_output)
         # agno_agent = AgnoMemory.get_instance(raw_memory.user_id)
         # result_agno = await agno_agent.process_user_message(raw_memory.content)
         # pprint(f"AgnoMemory response: {result_agno.to_dict()}")
         # pprint(f"memories: {agno_agent.get_memories()}")
         return result.final_output
     finally:
-        # 清除上下文变量
-        # 在异步多用户场景中，这确保了一个用户的上下文不会影响其他用户
-        clear_insight_context()
-        clear_project_context()
+        insight_raw_memory_context.reset(insight_token)
+        project_raw_memory_context.reset(project_token)
+        source_memories_context.reset(sources_token)
+
+def format_memory_batch(memories: List[MemoryDocument]) -> str:
+    """多条原始记忆组织成结构化输入，保留每条的 id 和时间"""
+    items = [f'<memory id="{memory._id}" created_at="{memory.created_at}">\n{memory.content}\n</memory>' for memory in memories]
+    return "<memories>\n" + "\n".join(items) + "\n</memories>"
+
+async def process_raw_memories(memories: List[MemoryDocument]):
+    """
+    一次 agent 运行处理同一用户的多条原始记忆
+
+    各条记忆保留在运行的上下文里：工具按代理给出的 <memory> id 使用对应记忆的
+    时间和标签，并为每条来源记忆发布派生内容的事件。
+    """
+    if len(memories) == 1:
+        return await process_raw_memory(memories[0])
+    batch = MemoryDocument(
+        user_id=memories[0].user_id,
+        content=format_memory_batch(memories),
+        memory_type=MemoryType.RAW,
+        tags=list(dict.fromkeys(tag for memory in memories for tag in memory.tags or [])),
+        created_at=memories[-1].created_at,
+        updated_at=memories[-1].updated_at,
+        processed=False,
+    )
+    batch._id = memories[0]._id
+    return await process_raw_memory(batch, memories)
 
 if __name__ == "__main__":
     raw_memory = MemoryDocument(
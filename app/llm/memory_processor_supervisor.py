@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory Processor Supervisor
+===========================
+启动 N 个 memory_processor_worker 进程，按 hash(user_id) 分片共享积压队列：
+
+    python -m app.llm.memory_processor_supervisor --workers 4
+
+崩溃的子进程会被重启（连续快速崩溃时退避）。收到 SIGTERM/SIGINT 后把信号
+转发给所有子进程，它们停止认领、排空正在处理的记忆；超过排空期限仍未退出的
+子进程被强制结束。
+"""
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.core.config import settings
+from app.core.logging_config import setup_logging
+
+logger = logging.getLogger("memory_processor_supervisor")
+
+# 子进程运行不到这么久就退出算作快速崩溃，重启前等待的时间翻倍
+MIN_HEALTHY_SECONDS = 30
+MAX_RESTART_DELAY = 60
+
+
+class WorkerProcess:
+    """一个分片的 worker 子进程"""
+
+    def __init__(self, shard_index: int, shard_count: int, worker_args: List[str], metrics_port: int = 0):
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.worker_args = worker_args
+        self.metrics_port = metrics_port
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.restart_delay = 1.0
+        self.restart_at: Optional[float] = None
+
+    def start(self):
+        command = [
+            sys.executable, "-m", "app.llm.memory_processor_worker",
+            "--shard-index", str(self.shard_index),
+            "--shard-count", str(self.shard_count),
+            "--metrics-port", str(self.metrics_port),
+            *self.worker_args,
+        ]
+        # 子进程继承 stdout/stderr，日志和 supervisor 写到同一个地方
+        self.process = subprocess.Popen(command)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logger.info(f"分片 {self.shard_index}/{self.shard_count} 已启动 (PID: {self.process.pid})")
+
+    def check(self, now: float):
+        """子进程退出时安排重启，到时间后重启"""
+        if self.process is not None and self.process.poll() is not None:
+            code = self.process.returncode
+            self.process = None
+            if now - self.started_at < MIN_HEALTHY_SECONDS:
+                self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+            else:
+                self.restart_delay = 1.0
+            self.restart_at = now + self.restart_delay
+            logger.error(f"分片 {self.shard_index} 退出 (返回码: {code})，{self.restart_delay:.0f}秒后重启")
+        if self.process is None and self.restart_at is not None and now >= self.restart_at:
+            self.start()
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            logger.warning(f"分片 {self.shard_index} 未在期限内退出，强制结束 (PID: {self.process.pid})")
+            self.process.kill()
+
+
+def supervise(workers: List[WorkerProcess], drain_timeout: float) -> int:
+    stopping = False
+
+    def request_stop(sig, frame):
+        nonlocal stopping
+        if not stopping:
+            logger.info(f"接收到信号 {sig}，停止所有 worker...")
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for worker in workers:
+        worker.start()
+
+    while not stopping:
+        now = time.monotonic()
+        for worker in workers:
+            worker.check(now)
+        time.sleep(1)
+
+    # 子进程在排空期限内退出；再留几秒给它们交还租约
+    for worker in workers:
+        worker.terminate()
+    deadline = time.monotonic() + drain_timeout + 10
+    while time.monotonic() < deadline and any(w.process and w.process.poll() is None for w in workers):
+        time.sleep(0.5)
+    for worker in workers:
+        worker.kill()
+    return 0
+
+
+def main():
+    load_dotenv()  # 加载环境变量
+    parser = argparse.ArgumentParser(description="记忆处理Worker的多进程supervisor")
+    parser.add_argument("--workers", type=int, default=settings.MEMORY_PROCESSOR_WORKERS or os.cpu_count() or 1,
+                        help="worker 进程数（分片数），默认每个CPU核一个")
+    parser.add_argument("--drain-timeout", type=float, default=settings.MEMORY_DRAIN_TIMEOUT,
+                        help="停止时等待正在处理的记忆的最长时间（秒）")
+    parser.add_argument("--metrics-port", type=int, default=settings.MEMORY_WORKER_METRICS_PORT,
+                        help="第一个 worker 的指标端口，分片 i 使用 port + i；0 表示不提供")
+    args, worker_args = parser.parse_known_args()
+    setup_logging("supervisor")
+
+    # 其余参数（--interval、--batch-size、--concurrency 等）原样传给每个 worker
+    worker_args += ["--drain-timeout", str(args.drain_timeout)]
+    workers = [
+        WorkerProcess(index, args.workers, worker_args, args.metrics_port + index if args.metrics_port else 0)
+        for index in range(args.workers)
+    ]
+    logger.info(f"启动 {args.workers} 个 worker 进程，参数: {' '.join(worker_args)}")
+    try:
+        return supervise(workers, args.drain_timeout)
+    finally:
+        logger.info("记忆处理supervisor已关闭")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,161 +6,580 @@ Memory Processor Worker
 ======================
 This script runs as a separate process to check for unprocessed RAW memories 
 and process them using the memory_agent.update_insight_memory function.
+
+With --reprocess it instead re-runs the agents over a user's already processed
+memories in a date range, throttled and resumable from a checkpoint file:
+
+    python -m app.llm.memory_processor_worker --reprocess --user-id xuyun --since 2025-01-01 --until 2025-03-31
 """
 
 import asyncio
+import json
 import logging
-import time
+import os
 import signal
+import socket
 import sys
-from typing import List, Optional
+import time
+import uuid
+from collections import deque
 from datetime import datetime
-import pytz
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
+from app.core.config import settings
 from app.db.elasticsearch.memory_repository import MemoryRepository
-from app.db.elasticsearch.models import MemoryDocument, MemoryType
-from app.llm.memory_agent import process_raw_memory
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("memory_processor.log")
-    ]
+from app.db.elasticsearch.models import MemoryDocument, MemoryType, ProcessingState, TIMESTAMP_FORMAT, local_timezone, now_timestamp
+from app.llm.memory_agent import process_raw_memories
+from app.storage.file_storage import file_storage
+from app.utils.event_log import MEMORY_CREATED, MEMORY_PROCESSED, event_log
+from app.utils.tokens import estimate_tokens
+from app.core.logging_config import setup_logging
+from app.core.tracing import finish_trace, start_trace
+from app.core.metrics import (
+    WORKER_BACKLOG, WORKER_BACKLOG_OLDEST_AGE, WORKER_BACKLOG_TOTAL, WORKER_MEMORIES,
+    WORKER_PROCESSED_PER_MINUTE, WORKER_STAGE_SECONDS, start_http_server,
 )
-logger = logging.getLogger("memory_processor")
 
-# Flag to control the worker loop
-is_running = True
+logger = logging.getLogger("memory_processor")
 
-async def process_memory(memory_doc: MemoryDocument) -> bool:
+async def process_memories(memories: List[MemoryDocument], owner: str) -> bool:
     """
-    处理一条记忆并更新状态
+    处理同一用户的一组已认领的记忆（一次 agent 运行）并逐条确认
     
     Args:
-        memory_doc: 待处理的记忆文档
+        memories: 待处理的记忆文档，按 created_at 排序
+        owner: 持有这些记忆租约的 worker
         
     Returns:
-        bool: 处理成功返回True，否则返回False
+        bool: 处理并全部确认成功返回True，否则返回False
     """
+    repo = MemoryRepository()
+    ids = [memory._id for memory in memories]
+    # 按 TRACE_SAMPLE_RATE 采样记录处理过程的span树（LLM调用总是很慢，不按耗时记录）
+    root, token = start_trace("process_memory", memory_id=ids[0], memories=len(memories))
     try:
-        logger.info(f"处理记忆 ID: {memory_doc._id}, 用户: {memory_doc.user_id}, 记忆: {memory_doc.content}")
-        
-        # 使用记忆代理处理记忆
-        await process_raw_memory(memory_doc)
+        logger.info(f"处理记忆 ID: {', '.join(ids)}, 用户: {memories[0].user_id}, 记忆: {' | '.join(m.content for m in memories)}")
         
-        # 更新记忆状态为已处理
-        memory_doc.processed = True
-        memory_doc.updated_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+        # 使用记忆代理处理记忆，多条记忆合并为一次运行
+        start = time.perf_counter()
+        await process_raw_memories(memories)
+        WORKER_STAGE_SECONDS.observe(time.perf_counter() - start, "triage")
         
-        # 更新数据库中的记忆状态
-        repo = MemoryRepository()
-        success = await repo.update_memory(memory_doc._id, memory_doc)
+        # 确认处理完成：标记 processed 并清除租约
+        start = time.perf_counter()
+        acked = await asyncio.gather(*(repo.ack_memory(memory._id, owner) for memory in memories))
         
-        if success:
-            logger.info(f"成功处理记忆 ID: {memory_doc._id}")
-        else:
-            logger.error(f"更新记忆状态失败 ID: {memory_doc._id}")
+        for memory_doc, success in zip(memories, acked):
+            if success:
+                memory_doc.processed = True
+                memory_doc.updated_at = now_timestamp()
+                # 本地副本同步处理状态，重建索引时不会重复处理
+                file_storage.save_memory_document(memory_doc._id, memory_doc)
+                await asyncio.to_thread(event_log.publish, MEMORY_PROCESSED, memory_doc.user_id,
+                                        memory_id=memory_doc._id, data={"batch": ids} if len(ids) > 1 else None)
+                WORKER_MEMORIES.inc("processed")
+                logger.info(f"成功处理记忆 ID: {memory_doc._id}")
+            else:
+                WORKER_MEMORIES.inc("lease_lost")
+                logger.warning(f"租约已被其他 worker 认领，未确认记忆 ID: {memory_doc._id}")
+        WORKER_STAGE_SECONDS.observe(time.perf_counter() - start, "writeback")
             
-        return success
+        return all(acked)
     
+    except asyncio.CancelledError:
+        # 停止时超过了排空期限：交还租约，其他 worker 可以立即重新处理
+        logger.warning(f"处理被中断，交还记忆 ID: {', '.join(ids)}")
+        WORKER_MEMORIES.inc("released", amount=len(ids))
+        for memory_id in ids:
+            try:
+                await repo.release_memory(memory_id, owner)
+            except Exception as release_error:
+                logger.error(f"交还记忆租约失败 ID: {memory_id}: {str(release_error)}")
+        raise
+
     except Exception as e:
-        logger.error(f"处理记忆时出错 ID: {memory_doc._id}: {str(e)}")
+        logger.error(f"处理记忆时出错 ID: {', '.join(ids)}: {str(e)}")
+        for memory_id in ids:
+            try:
+                # 记录失败，按尝试次数退避后重试，达到上限进入死信
+                state = await repo.fail_memory(memory_id, owner, f"{type(e).__name__}: {e}")
+                if state and state.get("processing_state") == ProcessingState.DEAD.value:
+                    WORKER_MEMORIES.inc("dead")
+                    logger.error(f"记忆 ID: {memory_id} 已失败 {state.get('attempts')} 次，转入死信")
+                elif state:
+                    WORKER_MEMORIES.inc("retry")
+                    logger.info(f"记忆 ID: {memory_id} 第 {state.get('attempts')} 次失败，稍后重试")
+            except Exception as fail_error:
+                # 记录失败时出错，租约到期后同样会被重新认领
+                logger.error(f"记录处理失败时出错 ID: {memory_id}: {str(fail_error)}")
         return False
+    finally:
+        finish_trace(root, token)
+
+def _created_at(memory: MemoryDocument) -> Optional[datetime]:
+    try:
+        return datetime.strptime(memory.created_at, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
 
-async def process_batch(batch_size: int = 10, user_id: Optional[str] = None) -> int:
+def take_batch(queue: Deque[MemoryDocument], window: float, max_tokens: int, max_memories: int) -> List[MemoryDocument]:
     """
-    处理一批未处理的记忆
-    
-    Args:
-        batch_size: 每批处理的记忆数量
-        user_id: 可选的用户ID过滤
-    
-    Returns:
-        int: 成功处理的记忆数量
+    从用户队列头部取出一组一起处理的记忆
+
+    取到第一条之后 window 秒内创建的、合计不超过 max_tokens 的连续记忆，
+    最多 max_memories 条；第一条总会被取出，window 为 0 时只取一条。
     """
-    # 使用MemoryRepository类的方法获取未处理的记忆
-    repo = MemoryRepository()
-    memories = await repo.get_unprocessed_memories(batch_size, user_id)
-    
-    if not memories:
-        return 0
-    
-    processed_count = 0
-    for memory in memories:
-        if await process_memory(memory):
-            processed_count += 1
-    
-    return processed_count
+    batch = [queue.popleft()]
+    first = _created_at(batch[0])
+    tokens = estimate_tokens(batch[0].content)
+    while queue and window > 0 and first is not None and len(batch) < max_memories:
+        created_at = _created_at(queue[0])
+        if created_at is None or (created_at - first).total_seconds() > window:
+            break
+        cost = estimate_tokens(queue[0].content)
+        if tokens + cost > max_tokens:
+            break
+        tokens += cost
+        batch.append(queue.popleft())
+    return batch
 
-async def memory_processor_loop(interval: int = 60, batch_size: int = 10):
+def worker_id() -> str:
+    """租约上记录的 worker 标识：主机名、进程号和随机后缀"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class MemoryProcessor:
     """
-    记忆处理器的主循环，定期查找并处理未处理的记忆
+    并发处理未处理的记忆
+
+    不同用户的记忆并行处理，同时最多 concurrency 条（每条要经过多轮 LLM 调用，
+    吞吐量随并发数增长而不是受单次 LLM 延迟限制）。同一用户的记忆由一个任务
+    按 created_at 顺序依次处理，项目和洞察的更新不会互相竞争。
+
+    记忆通过租约认领，多个 worker 进程（可以在不同机器上）共享同一个积压队列
+    而不会重复处理。排队和处理中的记忆的租约由 keep_leases() 定期延长，进程
+    崩溃后租约到期，记忆会被其他 worker 重新认领。
+    """
+
+    def __init__(self, concurrency: int = 4, batch_size: int = 10, user_id: Optional[str] = None,
+                 handler: Callable[[List[MemoryDocument], str], Awaitable[bool]] = process_memories,
+                 lease_seconds: Optional[float] = None,
+                 repo: Optional[MemoryRepository] = None,
+                 shard: Optional[Tuple[int, int]] = None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.user_id = user_id
+        self.handler = handler
+        self.lease_seconds = lease_seconds or settings.MEMORY_LEASE_SECONDS
+        self.repo = repo or MemoryRepository()
+        self.shard = shard  # (index, count)：只认领 hash(user_id) 属于这个分片的记忆
+        self.owner = worker_id()
+        self._pending: Dict[str, Deque[MemoryDocument]] = {}  # user_id -> 待处理记忆，按 created_at 排序
+        self._workers: Dict[str, asyncio.Task] = {}  # user_id -> 处理该用户记忆的任务
+        self._queued_ids: Set[str] = set()  # 已认领、排队或正在处理的记忆
+        self._wakeup = asyncio.Event()  # 新记忆的通知
+        self.stopping = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+        self._processed_at: Deque[float] = deque()  # 最近一分钟内处理完成的时间
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._workers)
+
+    def submit(self, memories: List[MemoryDocument]) -> int:
+        """把已认领的记忆加入各自用户的队列，返回新加入的数量（已排队的会被跳过）"""
+        added = 0
+        for memory in memories:
+            if memory._id in self._queued_ids:
+                continue
+            self._queued_ids.add(memory._id)
+            self._pending.setdefault(memory.user_id, deque()).append(memory)
+            if memory.user_id not in self._workers:
+                self._workers[memory.user_id] = asyncio.create_task(self._drain(memory.user_id))
+            added += 1
+        return added
+
+    async def _drain(self, user_id: str):
+        queue = self._pending[user_id]
+        try:
+            while queue and not self.stopping.is_set():
+                async with self.semaphore:
+                    # 等待名额期间到达的记忆也合并进来
+                    batch = take_batch(queue, settings.MEMORY_COALESCE_WINDOW, settings.MEMORY_COALESCE_MAX_TOKENS,
+                                       settings.MEMORY_COALESCE_MAX_MEMORIES)
+                    try:
+                        success = await self.handler(batch, self.owner)
+                    finally:
+                        self._queued_ids.difference_update(memory._id for memory in batch)
+                if success:
+                    self.processed += len(batch)
+                    self._processed_at.extend([time.monotonic()] * len(batch))
+                else:
+                    self.failed += len(batch)
+        finally:
+            unstarted = list(queue)
+            for memory in unstarted:
+                self._queued_ids.discard(memory._id)
+            del self._pending[user_id]
+            del self._workers[user_id]
+            # 停止时把还没开始处理的记忆交还，其他 worker 可以立即认领
+            for memory in unstarted:
+                try:
+                    await self.repo.release_memory(memory._id, self.owner)
+                except Exception as e:
+                    logger.error(f"释放记忆租约失败 ID: {memory._id}: {str(e)}")
+
+    async def poll(self) -> int:
+        """认领最旧的未处理记忆并加入队列；排队数量保持在 max(batch_size, 2 * concurrency) 以内"""
+        # 在认领之前清除通知：认领查询期间到达的通知会让随后的 wait() 立即返回，不会丢失
+        self._wakeup.clear()
+        wanted = max(self.batch_size, 2 * self.concurrency) - len(self._queued_ids)
+        if wanted <= 0:
+            return 0
+        start = time.perf_counter()
+        memories = await self.repo.claim_unprocessed_memories(
+            self.owner, wanted, self.lease_seconds, self.user_id, shard=self.shard
+        )
+        WORKER_STAGE_SECONDS.observe(time.perf_counter() - start, "fetch")
+        return self.submit(memories)
+
+    def processed_last_minute(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._processed_at and self._processed_at[0] < cutoff:
+            self._processed_at.popleft()
+        return len(self._processed_at)
+
+    async def report_metrics(self, interval: Optional[float] = None):
+        """
+        定期查询本分片的积压情况，更新积压和吞吐的 gauge
+
+        积压数量和最旧记忆的年龄来自 ES 聚合（所有 worker 的积压，不只是
+        本进程认领的），多个分片的 worker 各报各的，求和就是整体积压。
+        """
+        interval = interval or settings.MEMORY_METRICS_INTERVAL
+        while True:
+            try:
+                stats = await self.repo.backlog_stats(self.user_id, self.shard)
+                WORKER_BACKLOG.set_all({(user_id,): count for user_id, count in stats["users"].items()})
+                WORKER_BACKLOG_TOTAL.set(stats["total"])
+                WORKER_BACKLOG_OLDEST_AGE.set(time.time() - stats["oldest"] if stats["oldest"] else 0)
+            except Exception as e:
+                logger.error(f"查询积压情况失败: {str(e)}")
+            WORKER_PROCESSED_PER_MINUTE.set(self.processed_last_minute())
+            await asyncio.sleep(interval)
+
+    async def keep_leases(self):
+        """每隔三分之一租约时长延长一次所有排队和处理中记忆的租约"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.repo.renew_leases(self.owner, list(self._queued_ids), self.lease_seconds)
+            except Exception as e:
+                logger.error(f"延长租约失败: {str(e)}")
+
+    async def watch_created(self, poll_interval: Optional[float] = None):
+        """
+        监听 API 写入事件日志的 memory_created 通知，有新记忆时唤醒 wait()
+
+        事件日志是本机的 SQLite 文件，每次检查只是一次索引查询；其他机器上
+        的 worker 收不到通知，靠 wait() 的超时轮询兜底。
+        """
+        poll_interval = poll_interval or settings.EVENT_POLL_INTERVAL
+        last_id = await asyncio.to_thread(event_log.last_id, MEMORY_CREATED)
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                newest = await asyncio.to_thread(event_log.last_id, MEMORY_CREATED)
+            except Exception as e:
+                logger.error(f"读取事件日志失败: {str(e)}")
+                continue
+            if newest > last_id:
+                last_id = newest
+                self._wakeup.set()
+
+    async def wait(self, timeout: float):
+        """等到有新记忆的通知、某个用户的队列处理完或开始停止，最多 timeout 秒；通知由 poll() 清除"""
+        waiters = [asyncio.create_task(self._wakeup.wait()), asyncio.create_task(self.stopping.wait())]
+        try:
+            await asyncio.wait([*waiters, *self._workers.values()], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    def stop(self):
+        """开始停止：不再认领，排队中的记忆交还，正在处理的继续到 drain() 的期限"""
+        if not self.stopping.is_set():
+            logger.info("接收到停止信号，准备关闭...")
+            self.stopping.set()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """
+        等待正在处理的记忆完成，最多 timeout 秒
+
+        超过期限仍在处理的会被取消，它们的租约立即交还（已经做完的部分
+        会在重新处理时再做一次）。
+        """
+        if not self._workers:
+            return
+        workers = list(self._workers.values())
+        _, unfinished = await asyncio.wait(workers, timeout=timeout)
+        if unfinished:
+            logger.warning(f"排空超时，取消 {len(unfinished)} 个用户正在处理的记忆")
+            for task in unfinished:
+                task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+class Reprocessor:
+    """
+    重新处理一个用户在某段日期内已处理过的原始记忆（提示词或代理修改之后）
+
+    按创建时间顺序逐批交给记忆代理，和 worker 一样合并相近的记忆。速度限制在
+    每分钟 rate 条；有正常流程的记忆在等待时（多于 max_live 条）暂停，不和
+    实时处理抢 LLM 的并发。每批完成后把进度写入检查点文件，中断后用相同的
+    参数再次运行会从检查点继续。
+    """
+
+    def __init__(self, user_id: str, since: str, until: str,
+                 rate: Optional[float] = None,
+                 max_live: Optional[int] = None,
+                 checkpoint_path: Optional[str] = None,
+                 handler: Callable[[List[MemoryDocument]], Awaitable[Any]] = process_raw_memories,
+                 repo: Optional[MemoryRepository] = None,
+                 page_size: int = 100,
+                 yield_interval: float = 30):
+        self.user_id = user_id
+        self.since = since
+        self.until = until
+        self.rate = rate or settings.MEMORY_REPROCESS_RATE
+        self.max_live = settings.MEMORY_REPROCESS_MAX_LIVE if max_live is None else max_live
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            settings.MEMORY_REPROCESS_CHECKPOINT_DIR, f"{user_id}_{since}_{until}.json"
+        )
+        self.handler = handler
+        self.repo = repo or MemoryRepository()
+        self.page_size = page_size
+        self.yield_interval = yield_interval
+        self.stopping = asyncio.Event()
+        self.checkpoint = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        """
+        检查点：after 是最后处理的记忆的创建时间，done_ids 是这个时间创建的、
+        已经处理过的记忆（同一秒可能有多条）
+        """
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            logger.info(f"从检查点继续: {self.checkpoint_path}，已处理 {checkpoint['reprocessed']} 条")
+            return checkpoint
+        return {"user_id": self.user_id, "since": self.since, "until": self.until,
+                "after": None, "done_ids": [], "reprocessed": 0, "failed_ids": [], "finished": False}
+
+    def _save_checkpoint(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _advance(self, batch: List[MemoryDocument], success: bool):
+        checkpoint = self.checkpoint
+        last = batch[-1].created_at
+        if last != checkpoint["after"]:
+            checkpoint["after"], checkpoint["done_ids"] = last, []
+        checkpoint["done_ids"] += [memory._id for memory in batch if memory.created_at == last]
+        if success:
+            checkpoint["reprocessed"] += len(batch)
+        else:
+            checkpoint["failed_ids"] += [memory._id for memory in batch]
+        self._save_checkpoint()
+
+    async def _wait_for_live_backlog(self):
+        """正常流程有记忆在等待时暂停"""
+        while not self.stopping.is_set():
+            try:
+                live = await self.repo.count_live_memories()
+            except Exception as e:
+                logger.error(f"查询待处理记忆数量失败: {str(e)}")
+                live = self.max_live + 1
+            if live <= self.max_live:
+                return
+            logger.info(f"有 {live} 条待处理的记忆，暂停重新处理 {self.yield_interval}秒")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=self.yield_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _next_page(self) -> Deque[MemoryDocument]:
+        memories = await self.repo.list_raw_memories_between(
+            self.user_id, self.since, self.until, after=self.checkpoint["after"], size=self.page_size
+        )
+        done = set(self.checkpoint["done_ids"])
+        page = deque(memory for memory in memories if memory._id not in done)
+        if not page and len(memories) == self.page_size:
+            # 整页都是同一秒创建、已处理过的记忆，按时间分页无法前进
+            raise RuntimeError(f"同一时间 {self.checkpoint['after']} 的记忆超过 {self.page_size} 条，请增大 page_size")
+        return page
+
+    async def run(self) -> Dict[str, Any]:
+        if self.checkpoint["finished"]:
+            logger.info(f"检查点显示已经处理完成，重新开始请删除: {self.checkpoint_path}")
+            return self.checkpoint
+        logger.info(f"重新处理用户 {self.user_id} 在 {self.since} 到 {self.until} 的记忆，每分钟 {self.rate} 条")
+        while not self.stopping.is_set():
+            page = await self._next_page()
+            if not page:
+                self.checkpoint["finished"] = True
+                self._save_checkpoint()
+                break
+            while page and not self.stopping.is_set():
+                await self._wait_for_live_backlog()
+                if self.stopping.is_set():
+                    break
+                batch = take_batch(page, settings.MEMORY_COALESCE_WINDOW, settings.MEMORY_COALESCE_MAX_TOKENS,
+                                   settings.MEMORY_COALESCE_MAX_MEMORIES)
+                started = time.monotonic()
+                root, token = start_trace("reprocess_memory", memory_id=batch[0]._id, memories=len(batch))
+                try:
+                    await self.handler(batch)
+                    success = True
+                    WORKER_MEMORIES.inc("reprocessed", amount=len(batch))
+                except Exception as e:
+                    success = False
+                    WORKER_MEMORIES.inc("reprocess_failed", amount=len(batch))
+                    logger.error(f"重新处理记忆失败 ID: {', '.join(m._id for m in batch)}: {str(e)}")
+                finally:
+                    finish_trace(root, token)
+                self._advance(batch, success)
+                # 按速度限制等待，停止时立即结束
+                delay = len(batch) * 60 / self.rate - (time.monotonic() - started)
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+        logger.info(f"已重新处理 {self.checkpoint['reprocessed']} 条，失败 {len(self.checkpoint['failed_ids'])} 条，"
+                    f"检查点: {self.checkpoint_path}")
+        return self.checkpoint
+
+    def stop(self):
+        if not self.stopping.is_set():
+            logger.info("接收到停止信号，当前批次完成后停止重新处理...")
+            self.stopping.set()
+
+
+async def reprocess_loop(user_id: str, since: str, until: str, rate: Optional[float] = None,
+                         max_live: Optional[int] = None, checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+    """运行 Reprocessor 直到处理完或收到 SIGTERM/SIGINT"""
+    reprocessor = Reprocessor(user_id, since, until, rate, max_live, checkpoint_path)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, reprocessor.stop)
+    return await reprocessor.run()
+
+
+async def memory_processor_loop(interval: int = 300, batch_size: int = 10, concurrency: int = 4,
+                                user_id: Optional[str] = None, shard: Optional[Tuple[int, int]] = None,
+                                drain_timeout: Optional[float] = None, metrics_port: Optional[int] = None):
+    """
+    记忆处理器的主循环，定期认领未处理的记忆并交给 MemoryProcessor 并发处理
     
     Args:
-        interval: 轮询间隔（秒）
-        batch_size: 每批处理的记忆数量
+        interval: 没有通知时的兜底轮询间隔（秒）
+        batch_size: 每次认领的记忆数量
+        concurrency: 同时处理的记忆数量
+        user_id: 可选的用户ID过滤
+        shard: 可选的分片 (index, count)
+        drain_timeout: 收到 SIGTERM/SIGINT 后等待正在处理的记忆的最长时间（秒）
+        metrics_port: 提供 Prometheus 指标的 HTTP 端口，0 或 None 不提供
     """
-    logger.info(f"记忆处理器已启动，轮询间隔: {interval}秒，批处理大小: {batch_size}")
+    processor = MemoryProcessor(concurrency, batch_size, user_id, shard=shard)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, processor.stop)
+    logger.info(f"记忆处理器已启动 ({processor.owner})，轮询间隔: {interval}秒，批处理大小: {batch_size}，并发数: {concurrency}，分片: {shard or '全部'}")
+    # 确保索引有租约字段的映射
+    await processor.repo.initialize()
+    lease_keeper = asyncio.create_task(processor.keep_leases())
+    watcher = asyncio.create_task(processor.watch_created())
+    metrics_server = reporter = None
+    if metrics_port:
+        metrics_server = await start_http_server(metrics_port)
+        reporter = asyncio.create_task(processor.report_metrics())
+        logger.info(f"指标地址: http://0.0.0.0:{metrics_port}/metrics")
     
-    while is_running:
+    while not processor.stopping.is_set():
         try:
-            processed_count = await process_batch(batch_size)
-            
-            if processed_count > 0:
-                logger.info(f"已处理 {processed_count} 条记忆")
-                # 如果成功处理了记忆，立即继续检查是否还有更多记忆需要处理
-                continue
-            else:
+            added = await processor.poll()
+            if added > 0:
+                logger.info(f"新认领 {added} 条记忆，已处理 {processor.processed} 条，失败 {processor.failed} 条")
+            elif not processor.busy:
                 logger.info("没有找到需要处理的记忆，等待下次轮询")
-                
-            # 等待指定的间隔时间后再次轮询
-            await asyncio.sleep(interval)
+            # 新记忆的通知或某个用户的队列完成后立即认领；interval 只是兜底的轮询间隔
+            await processor.wait(interval)
             
         except Exception as e:
             logger.error(f"处理循环中发生错误: {str(e)}")
             # 出错后等待一段时间后再继续
-            await asyncio.sleep(10)
+            await processor.wait(10)
 
-def signal_handler(sig, frame):
-    """信号处理器，用于优雅地关闭Worker"""
-    global is_running
-    logger.info("接收到中断信号，准备关闭...")
-    is_running = False
+    await processor.drain(drain_timeout if drain_timeout is not None else settings.MEMORY_DRAIN_TIMEOUT)
+    lease_keeper.cancel()
+    watcher.cancel()
+    if metrics_server is not None:
+        reporter.cancel()
+        metrics_server.close()
 
 def main():
     load_dotenv()  # 加载环境变量
     """Worker主函数"""
-    # 注册信号处理器
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
     # 从命令行参数获取配置
     import argparse
     parser = argparse.ArgumentParser(description="记忆处理Worker")
-    parser.add_argument("--interval", type=int, default=60, help="轮询间隔（秒）")
+    parser.add_argument("--interval", type=int, default=300, help="没有新记忆通知时的兜底轮询间隔（秒）")
     parser.add_argument("--batch-size", type=int, default=10, help="每批处理的记忆数量")
+    parser.add_argument("--concurrency", type=int, default=settings.MEMORY_PROCESSOR_CONCURRENCY, help="同时处理的记忆数量")
     parser.add_argument("--user-id", type=str, help="可选的用户ID过滤")
+    parser.add_argument("--shard-index", type=int, default=0, help="本进程的分片序号（0 到 shard-count - 1）")
+    parser.add_argument("--shard-count", type=int, default=1, help="分片总数，按 hash(user_id) 分配记忆")
+    parser.add_argument("--drain-timeout", type=float, default=settings.MEMORY_DRAIN_TIMEOUT, help="停止时等待正在处理的记忆的最长时间（秒）")
+    parser.add_argument("--metrics-port", type=int, default=settings.MEMORY_WORKER_METRICS_PORT, help="Prometheus 指标的 HTTP 端口，0 表示不提供")
+    # 重新处理模式：处理完指定范围后退出，不认领新记忆
+    parser.add_argument("--reprocess", action="store_true", help="重新处理 --user-id 在 --since 到 --until 之间已处理过的原始记忆")
+    parser.add_argument("--since", type=str, help="重新处理的开始日期（YYYY-MM-DD，含）")
+    parser.add_argument("--until", type=str, help="重新处理的结束日期（YYYY-MM-DD，含），默认今天")
+    parser.add_argument("--rate", type=float, default=settings.MEMORY_REPROCESS_RATE, help="重新处理的速度（每分钟条数）")
+    parser.add_argument("--max-live", type=int, default=settings.MEMORY_REPROCESS_MAX_LIVE, help="待处理的新记忆多于这个数量时暂停重新处理")
+    parser.add_argument("--checkpoint", type=str, help="检查点文件，默认按用户和日期范围命名")
     
     args = parser.parse_args()
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index 必须在 0 到 --shard-count - 1 之间")
+    if args.reprocess and not (args.user_id and args.since):
+        parser.error("--reprocess 需要 --user-id 和 --since")
+    # 日志写到 stderr，由 run_memory_processor.sh 重定向到日志文件
+    setup_logging("worker")
     
-    logger.info(f"启动参数: 间隔={args.interval}s, 批处理大小={args.batch_size}, 用户ID={args.user_id or '所有'}")
+    logger.info(f"启动参数: 间隔={args.interval}s, 批处理大小={args.batch_size}, 并发数={args.concurrency}, 用户ID={args.user_id or '所有'}")
     
     try:
-        # 启动异步事件循环
-        loop = asyncio.get_event_loop()
-        
-        # 创建并启动主处理循环
-        task = loop.create_task(memory_processor_loop(
+        if args.reprocess:
+            until = args.until or datetime.now(local_timezone()).strftime("%Y-%m-%d")
+            asyncio.run(reprocess_loop(args.user_id, args.since, until, args.rate, args.max_live, args.checkpoint))
+            return 0
+        # 运行主处理循环，直到收到 SIGTERM/SIGINT 并排空
+        asyncio.run(memory_processor_loop(
             interval=args.interval,
-            batch_size=args.batch_size
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            user_id=args.user_id,
+            shard=(args.shard_index, args.shard_count) if args.shard_count > 1 else None,
+            drain_timeout=args.drain_timeout,
+            metrics_port=args.metrics_port
         ))
         
-        # 运行直到接收中断信号
-        loop.run_until_complete(task)
-        
     except Exception as e:
         logger.error(f"Worker发生未捕获异常: {str(e)}")
         return 1
@@ -0,0 +1,50 @@
+import asyncio
+import weakref
+from typing import Optional
+
+from agents import RunConfig, set_tracing_disabled
+from agents.models.openai_provider import OpenAIProvider
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+# Clients hold an httpx connection pool bound to the event loop that first uses it,
+# so they are shared per loop: the worker and the API each run a single one.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_providers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """The AsyncOpenAI client of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncOpenAI(
+            base_url=settings.OPENAI_API_BASE_FOR_LLM,
+            api_key=settings.OPENAI_API_KEY_FOR_LLM,
+        )
+    return client
+
+
+def get_model_provider(use_responses: Optional[bool] = None) -> OpenAIProvider:
+    """
+    A model provider on the shared client of the running loop.
+
+    ``use_responses`` defaults to OPENAI_RESPONSE_API; without the Responses API
+    the Chat Completions API is used, for OpenAI-compatible servers.
+    """
+    if use_responses is None:
+        use_responses = settings.OPENAI_RESPONSE_API
+    providers = _providers.setdefault(asyncio.get_running_loop(), {})
+    provider = providers.get(use_responses)
+    if provider is None:
+        provider = providers[use_responses] = OpenAIProvider(openai_client=get_llm_client(), use_responses=use_responses)
+    return provider
+
+
+def get_run_config() -> RunConfig:
+    """Run config of the memory agents: LLM_MODEL on the shared provider."""
+    if not settings.OPENAI_RESPONSE_API:
+        # Traces are uploaded to OpenAI, which OpenAI-compatible servers do not accept
+        set_tracing_disabled(disabled=True)
+    return RunConfig(model=settings.LLM_MODEL, model_provider=get_model_provider())
@@ -1,15 +1,24 @@
 import asyncio
+import logging
 from enum import Enum
-import pytz
-from datetime import datetime
+from typing import Optional
 import contextvars
 from pydantic import BaseModel
-from agents import Agent, Runner, RunConfig
+from agents import Agent
 from agents import function_tool
-from agents.models.openai_provider import OpenAIProvider
-from app.core.config import settings
+from app.core.tracing import traced
 from app.db.elasticsearch.memory_repository import MemoryRepository
-from app.db.elasticsearch.models import MemoryDocument, MemoryType
+from app.core.config import settings
+from app.db.elasticsearch.models import MemoryDocument, MemoryType, now_timestamp
+from app.llm.embeddings import embed_text
+from app.llm.model_provider import get_run_config
+from app.llm.runner import current_time_instructions, metrics_hooks, run_agent
+from app.llm.source_memories import derived_fields, publish_derived, sources_of
+from app.storage.file_storage import file_storage
+from app.services.project_catalog import project_catalog
+from app.utils.event_log import PROJECT_CREATED, PROJECT_UPDATED, TASK_CREATED
+
+logger = logging.getLogger(__name__)
 
 # 创建一个上下文变量来存储 raw_memory
 # 与全局变量不同，contextvars 为每个异步任务提供独立的上下文
@@ -19,7 +28,7 @@ raw_memory_context = contextvars.ContextVar('raw_memory', default=None)
 project_memory_agent_instructions_cn = """
 你是一个专业的项目信息管理的助手，你将收到一段用户的原始文本信息，你需要分析这段信息，并使用工具对这个信息进行进一步的处理。
 处理方法：
-1. 你需要判断这段原始的信息是否属于一个项目，为此，你可能需要使用list_projects工具来查找相关的项目。
+1. 你需要判断这段原始的信息是否属于一个项目，为此，你可能需要使用search_projects工具，用项目名称或信息中的关键内容来查找相关的项目。
 2. 如果原始信息属于一个既有的项目，你需要判断是否需要根据原始信息来更新这个项目的描述，还是更新项目的任务项，为此，你需要使用list_tasks工具来查找相关的任务。
 3. 如果确实需要更新项目的描述，那么你需要使用update_project工具来更新项目的描述。项目的描述，主要描述的是项目是的目标、范围等，不包括任务项和和任务的状态。
    注意：当你更新项目的Description的时候，你需要结合既有的项目描述的内容以及当前你新了解到的项目的内容来更新。更新后的内容应同时包含旧的描述中的关键信息（除非新的信息删除或者修改了旧的信息），且包含新的信息，应该比较完整、流畅和清晰，并且不丢失重要信息。类似一个追加并改写的过程。
@@ -29,7 +38,7 @@ project_memory_agent_instructions_cn = """
 4. 你收到的原始信息中中可能会包含项目的任务（Tasks）相关的描述，你要根据这些描述，使用工具来管理该项目是的任务：
     - 你可以使用list_tasks工具来查找项目相关的任务。
     - 你可以使用create_task工具为项目来创建一个新的任务。
-    - 你可以使用update_task工具为项目更新一个现有任务的状态。
+    - 你可以使用update_task工具为项目更新现有任务的状态，多个任务的状态变化请在一次调用中一起更新。
 5. 如果用户明确要求创建一个项目，那就创建一个新的项目。在创建项目的时候，应该使用project_create工具来创建一个新的项目。
    在更新项目的时候，应该使用project_update工具来更新这个项目的信息。
    在创建项目的时候，需要提供的三个参数是：
@@ -60,79 +69,106 @@ class Task(BaseModel):
     task_description: str
     task_status: str
 
-async def list_projects() -> list[Project]:
+class TaskUpdate(BaseModel):
+    task_id: str
+    task_status: str
+
+@traced("tool.search_projects")
+async def search_projects(query: str) -> list[Project]:
     """
-    A tool to list all projects of current user.
+    A tool to search the projects of current user by meaning.
     Args:
-        None
+        query: str, what the project is about, e.g. its name or the key information of the memory
     Returns:
-        list, a list of projects
+        list, the most related projects, best match first
     """
 
-    print("list_projects is called")
-
     raw_memory = raw_memory_context.get()
     user_id = raw_memory.user_id
-    print(f"list_projects is called with user_id: {user_id}")
-    repo = MemoryRepository()
-    projects = await repo.get_projects(user_id)
-    projects = [Project(project_id=project._id, project_name=project.title, project_description=project.content) for project in projects]
+    logger.debug("search_projects is called with user_id: %s, query: %s", user_id, query)
+    # 嵌入请求是同步的，放到线程里
+    vector = await asyncio.to_thread(embed_text, query)
+    if vector is None:
+        return "Query is empty"
+    results = await project_catalog.search(user_id, vector, settings.TRIAGE_PROJECTS_TOP_K)
+    projects = [Project(project_id=project._id, project_name=project.title, project_description=project.content)
+                for project, _ in results]
     return projects if projects else "No Projects Created"
 
-async def create_project(project_name: str, project_description: str) -> str:
+@traced("tool.create_project")
+async def create_project(project_name: str, project_description: str, source_ids: Optional[list[str]] = None) -> str:
     """
     A tool to create a new project.
     Args:
         project_name: str, the name of the project
         project_description: str, the description of the project
+        source_ids: list[str], if the input has several <memory> elements, the ids of those it comes from; null otherwise
     Returns:
         str, the id of the created project
     """
 
-    print(f"create_project is called, project_name: {project_name}, project_description: {project_description}")
+    logger.debug("create_project is called, project_name: %s, project_description: %s", project_name, project_description)
     raw_memory = raw_memory_context.get()
+    # 合并处理时，项目使用它所来自的原始记忆的时间和标签
+    sources = sources_of(raw_memory, source_ids)
+    fields = derived_fields(sources)
     doc = MemoryDocument(
         user_id=raw_memory.user_id,
         title=project_name,
         content=project_description,
         memory_type=MemoryType.PROJECT,
-        tags=raw_memory.tags,
-        created_at=raw_memory.created_at,
-        updated_at=raw_memory.updated_at,
+        tags=fields["tags"],
+        created_at=fields["created_at"],
+        updated_at=fields["updated_at"],
         processed=True
     )
     if not doc.created_at:
-        doc.created_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+        doc.created_at = now_timestamp()
     if not doc.updated_at:
         doc.updated_at = doc.created_at
 
     repo = MemoryRepository()
     memory_id = await repo.create_memory(doc)
+    file_storage.save_memory_document(memory_id, doc)
+    project_catalog.invalidate(doc.user_id)
+    await publish_derived(PROJECT_CREATED, doc.user_id, memory_id, sources,
+                          data={"title": project_name, "content": project_description})
     return memory_id
 
-async def update_project(project_id: str, project_description: str) -> bool:
+@traced("tool.update_project")
+async def update_project(project_id: str, project_description: str, source_ids: Optional[list[str]] = None) -> bool:
     """
     A tool to update a project.
     Args:
         project_id: str, the id of the project
         project_description: str, the description of the project
+        source_ids: list[str], if the input has several <memory> elements, the ids of those it comes from; null otherwise
     Returns:
         bool, True if the project is updated successfully, False otherwise
     """
 
-    print(f"update_project is called, project_id: {project_id}, project_description: {project_description}")
+    logger.debug("update_project is called, project_id: %s, project_description: %s", project_id, project_description)
     repo = MemoryRepository()
     project = await repo.get_memory(project_id)
     if not project:
-        print(f"project_id: {project_id} not found")
+        logger.warning("project_id: %s not found", project_id)
         return False
     if project_description:
         project.content = project_description
-    project.updated_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+        # 项目按嵌入的相似度查找，描述变了要重新计算
+        embedding = await asyncio.to_thread(embed_text, project_description)
+        if embedding is not None:
+            project.embedding = embedding
+    project.updated_at = now_timestamp()
     await repo.update_memory(project_id, project)
+    file_storage.save_memory_document(project_id, project)
+    project_catalog.invalidate(project.user_id)
+    await publish_derived(PROJECT_UPDATED, project.user_id, project_id, sources_of(raw_memory_context.get(), source_ids),
+                          data={"content": project.content})
 
     return True
 
+@traced("tool.list_tasks")
 async def list_tasks(project_id: str) -> list[Task]:
     """
     A tool to list all tasks of a project.
@@ -142,29 +178,31 @@ async def list_tasks(project_id: str) -> list[Task]:
         list, a list of tasks
     """
 
-    print(f"list_tasks is called, project_id: {project_id}")
+    logger.debug("list_tasks is called, project_id: %s", project_id)
     repo = MemoryRepository()
     docs = await repo.get_tasks(user_id=raw_memory_context.get().user_id, project_id=project_id)
     if not docs:
-        print(f"project_id: {project_id} not found")
+        logger.warning("project_id: %s not found", project_id)
         return "No Tasks Found"
     tasks = [Task(task_id=doc._id, task_description=doc.content, task_status=doc.summary) for doc in docs]
     tasks = [f"- {task.task_id}: {task.task_description}, status: {task.task_status}" for task in tasks]
     ret = "\n".join(tasks)
-    print(f"list_tasks result: {ret}")
+    logger.debug("list_tasks result: %s", ret)
     return ret
 
-async def create_task(project_id: str, task_description: str) -> str:
+@traced("tool.create_task")
+async def create_task(project_id: str, task_description: str, source_ids: Optional[list[str]] = None) -> str:
     """
     A tool to create a new task. The status of the task is "To Do" by default.
     Args:
         project_id: str, the id of the project
         task_description: str, the description of the task
+        source_ids: list[str], if the input has several <memory> elements, the ids of those it comes from; null otherwise
     Returns:
         str, the id of the created task
     """
 
-    print(f"create_task is called, project_id: {project_id}, task_description: {task_description}")
+    logger.debug("create_task is called, project_id: %s, task_description: %s", project_id, task_description)
     doc = MemoryDocument(
         user_id=raw_memory_context.get().user_id,
         title=task_description,
@@ -173,123 +211,106 @@ async def create_task(project_id: str, task_description: str) -> str:
         summary=TaskStatus.TO_DO,
         parent_id=project_id,
         tags=[],
-        created_at=datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z'),
-        updated_at=datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z'),
+        created_at=now_timestamp(),
+        updated_at=now_timestamp(),
         processed=True
     )
     repo = MemoryRepository()
     task_id = await repo.create_memory(doc)
     if not task_id:
-        print(f"Failed to create task: {task_description}")
+        logger.warning("Failed to create task: %s", task_description)
         return "Failed to create task"
-    print(f"Task created with ID: {task_id}")
+    file_storage.save_memory_document(task_id, doc)
+    await publish_derived(TASK_CREATED, doc.user_id, task_id, sources_of(raw_memory_context.get(), source_ids),
+                          data={"parent_id": project_id, "content": task_description})
+    logger.info("Task created with ID: %s", task_id)
     return "task created successfully, task_id: " + task_id
 
-async def update_task(task_id: str, task_status: str) -> str:
+@traced("tool.update_task")
+async def update_task(updates: list[TaskUpdate]) -> str:
     """
-    此工具用于更新任务的状态。
+    此工具用于更新一个或多个任务的状态，多个任务请在一次调用中一起更新。
 
     Args:
-        task_id: str, 任务的唯一标识符
-        task_status: 任务的新状态，可以是 "To Do"、"In Progress"、"Done" 或 "Deleted"
+        updates: 要更新的任务，每项包括 task_id（任务的唯一标识符）和 task_status（任务的新状态，可以是 "To Do"、"In Progress"、"Done" 或 "Deleted"）
 
     Returns:
-        bool, 如果任务更新成功则返回True，否则返回False
+        str, 每个任务的更新结果
 
     """
 
-    print(f"update_task is called, task_id: {task_id}, task_status: {task_status}")
+    logger.debug("update_task is called, updates: %s", updates)
+    valid_statuses = [status.value for status in TaskStatus]
     repo = MemoryRepository()
-    task = await repo.get_memory(task_id)
-    if not task:
-        print(f"task_id: {task_id} not found")
-        return "Task not found" 
-    if task_status not in [status.value for status in TaskStatus]:
-        print(f"Invalid task status: {task_status}")
-        return (f"Invalid task status: {task_status}, valid values are: {[status.value for status in TaskStatus]}")
-    task.summary = task_status
-    task.updated_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
-    await repo.update_memory(task_id, task)
-
-    return "Task updated successfully"
-
-def get_project_memory_agent(raw_memory: MemoryDocument) -> Agent:
-    """
-    获取项目记忆代理
-    :return: Agent
-    """
-    raw_memory_context.set(raw_memory)
-    
-    instructions = f"当前时间：{datetime.now().strftime('%Y-%m-%d %H:%M')}\n" + project_memory_agent_instructions_cn 
-    agent = Agent(
-        name="Project Memory Agent",
-        instructions=instructions,
-        # handoff_description="Special Agent for project memory management, such as creating, updating, and listing projects and tasks.",
-        handoff_description="处理与具体项目、任务、计划或行动项相关的内容"
-        "例子：为项目xmemory增加一个任务：实现项目的任务管理功能（）"
-        "下面的例子应该使用project_memory_agent来处理："
-        "为项目xmemory增加一个任务：实现项目的任务管理功能；"
-        "我今天完成了一体机项目的需求分析文档编写"
-        "完成了周报的编写",
-        tools=[
-            function_tool(list_projects),
-            function_tool(create_project),
-            function_tool(update_project),
-            function_tool(list_tasks),
-            function_tool(create_task),
-            function_tool(update_task)
-        ],
-    )
-    tool = agent.as_tool(
-        tool_name="project_memory_agent",
-        tool_description="处理与具体项目、任务、计划或行动项相关的内容"
-        "例子：为项目xmemory增加一个任务：实现项目的任务管理功能（）"
-        "下面的例子应该使用project_memory_agent来处理："
-        "为项目xmemory增加一个任务：实现项目的任务管理功能；"
-        "我今天完成了一体机项目的需求分析文档编写；"
-        "完成了周报的编写",
-    )
-    return tool
+    # 一次 mget 取回所有任务，而不是逐个查询
+    tasks = {task._id: task for task in await repo.get_memories([update.task_id for update in updates])}
+    results = []
+    for update in updates:
+        task = tasks.get(update.task_id)
+        if not task:
+            logger.warning("task_id: %s not found", update.task_id)
+            results.append(f"{update.task_id}: Task not found")
+            continue
+        if update.task_status not in valid_statuses:
+            logger.warning("Invalid task status: %s", update.task_status)
+            results.append(f"{update.task_id}: Invalid task status: {update.task_status}, valid values are: {valid_statuses}")
+            continue
+        task.summary = update.task_status
+        task.updated_at = now_timestamp()
+        await repo.update_memory(update.task_id, task)
+        file_storage.save_memory_document(update.task_id, task)
+        results.append(f"{update.task_id}: Task updated successfully")
+
+    return "\n".join(results) if results else "No tasks to update"
 
-def clear_context():
+# 代理和工具只创建一次；每次运行的原始记忆通过 raw_memory_context 传给工具
+project_memory_agent = Agent(
+    name="Project Memory Agent",
+    instructions=current_time_instructions(project_memory_agent_instructions_cn),
+    # handoff_description="Special Agent for project memory management, such as creating, updating, and listing projects and tasks.",
+    handoff_description="处理与具体项目、任务、计划或行动项相关的内容"
+    "例子：为项目xmemory增加一个任务：实现项目的任务管理功能（）"
+    "下面的例子应该使用project_memory_agent来处理："
+    "为项目xmemory增加一个任务：实现项目的任务管理功能；"
+    "我今天完成了一体机项目的需求分析文档编写"
+    "完成了周报的编写",
+    tools=[
+        function_tool(search_projects),
+        function_tool(create_project),
+        function_tool(update_project),
+        function_tool(list_tasks),
+        function_tool(create_task),
+        function_tool(update_task)
+    ],
+)
+
+project_memory_agent_tool = project_memory_agent.as_tool(
+    tool_name="project_memory_agent",
+    tool_description="处理与具体项目、任务、计划或行动项相关的内容"
+    "例子：为项目xmemory增加一个任务：实现项目的任务管理功能（）"
+    "下面的例子应该使用project_memory_agent来处理："
+    "为项目xmemory增加一个任务：实现项目的任务管理功能；"
+    "我今天完成了一体机项目的需求分析文档编写；"
+    "完成了周报的编写",
+    hooks=metrics_hooks,
+)
+
+def get_project_memory_agent() -> Agent:
     """
-    清除上下文变量
-    :return: None
+    获取项目记忆代理（作为分类代理的工具）
+    :return: Agent
     """
-    raw_memory_context.set(None)
-    print("Context cleared")
+    return project_memory_agent_tool
 
 async def update_project_memory(raw_memory: MemoryDocument):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    global instructions
-    instructions = f"当前时间：{now}\n" + instructions
-
     # 设置上下文变量
     # 在异步多用户场景中，每个用户的请求都有自己的上下文
     # 因此，这里设置的 user_id 只会影响当前处理的请求
     token = raw_memory_context.set(raw_memory)
     
     try:
-        memory_agent = Agent(
-            name="Project Memory Agent",
-            instructions=instructions,
-            tools=[
-                function_tool(list_projects),
-                function_tool(create_project),
-                function_tool(update_project),
-                function_tool(list_tasks),
-                function_tool(create_task),
-                function_tool(update_task)
-            ],
-        )
-        my_model_provider = OpenAIProvider(
-            api_key=settings.OPENAI_API_KEY_FOR_LLM,
-            base_url=settings.OPENAI_API_BASE_FOR_LLM,
-        )
-        my_run_config = RunConfig(model_provider=my_model_provider)
-        
-        result = await Runner.run(memory_agent, raw_memory.content, run_config=my_run_config)
-        print(result.final_output)
+        result = await run_agent(project_memory_agent, raw_memory.content, run_config=get_run_config())
+        logger.info("Project agent output for %s: %s", raw_memory.user_id, result.final_output)
         return result.final_output
     finally:
         raw_memory_context.reset(token)
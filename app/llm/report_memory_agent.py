@@ -1,16 +1,21 @@
 import asyncio
+import logging
 # from enum import Enum
-import pytz
 from datetime import datetime
 import contextvars
 # from pydantic import BaseModel
-from agents import Agent, Runner, RunConfig
+from agents import Agent, RunConfig
 from agents import function_tool
-from agents.models.openai_provider import OpenAIProvider
-from app.core.config import settings
+from app.core.tracing import traced
 from app.db.elasticsearch.memory_repository import MemoryRepository
-from app.db.elasticsearch.models import MemoryDocument, MemoryType
-from app.storage.file_storage import FileStorage
+from app.db.elasticsearch.models import MemoryDocument, MemoryType, now_timestamp
+from app.llm.model_provider import get_model_provider
+from app.llm.runner import run_agent
+from app.services.project_catalog import project_catalog
+from app.storage.file_storage import file_storage
+from app.utils.event_log import REPORT_READY, event_log
+
+logger = logging.getLogger(__name__)
 
 instructions = """
 你是一个日报生成器，负责生成流畅、清晰和调理清晰的日报。
@@ -33,7 +38,7 @@ async def generate_report_by(user_id: str, date_str: str, content: str) -> str:
     from dateutil import parser
     date_obj = parser.parse(date_str)
     date = date_obj.date()
-    created_at = datetime.now(pytz.timezone('Asia/Shanghai')).strftime('%Y-%m-%dT%H:%M:%S%z')
+    created_at = now_timestamp()
     updated_at = created_at
     doc = MemoryDocument(
         user_id=user_id,
@@ -46,9 +51,13 @@ async def generate_report_by(user_id: str, date_str: str, content: str) -> str:
     )
     repo = MemoryRepository()
     memory_id = await repo.create_memory(doc)
-    print(f"success to create memory, id is {memory_id}")
+    file_storage.save_memory_document(memory_id, doc)
+    await asyncio.to_thread(event_log.publish, REPORT_READY, user_id, memory_id=memory_id,
+                            data={"title": doc.title, "date": str(date)})
+    logger.info("success to create memory, id is %s", memory_id)
     return f"success to create memory, id is {memory_id}"
 
+@traced("tool.save_report")
 async def save_report(report_content: str) -> str:
     """
     保存生成的日报，传入的参数是报告的正文，不需要有标题。
@@ -59,10 +68,11 @@ async def save_report(report_content: str) -> str:
     """
     user_id = user_id_context.get()
     request_date = request_date_context.get()
-    print(f"save_report is called: {user_id}, date: {request_date}, report: {report_content}")
+    logger.debug("save_report is called: %s, date: %s, report: %s", user_id, request_date, report_content)
     return await generate_report_by(user_id, request_date, report_content)
 
 
+@traced("tool.search_memory")
 async def search_memory(query: str) -> str:
     """
     从用户既往的记忆中搜索与当前记忆相关的记忆。当你需要了解用户偏好、过去做了什么，学到了什么，或者需要了解用户对某些事情的看法时，可以调用此工具。
@@ -73,7 +83,7 @@ async def search_memory(query: str) -> str:
     """
 
     user_id = user_id_context.get()
-    print(f"search_memory is called with user_id: {user_id}, query: {query}")
+    logger.debug("search_memory is called with user_id: %s, query: %s", user_id, query)
     repo = MemoryRepository()
     memory_docs = await repo.search_by_similarity(query, user_id, memory_type=MemoryType.RAW, size=15)
     memory_list = [f"@{memory.created_at}: {memory.content}" for memory in memory_docs  ]
@@ -82,7 +92,7 @@ async def search_memory(query: str) -> str:
     ret = "\n".join(memory_list)
     if not memory_list:
         ret = "No related memories found."
-    print(ret)
+    logger.debug("search_memory result: %s", ret)
     return ret
 
 async def get_projects_summary() -> str:
@@ -93,29 +103,24 @@ async def get_projects_summary() -> str:
     Returns:
         str, 项目名称以及项目的信息的列表
     """
-    repo = MemoryRepository()
     user_id = user_id_context.get()
-    projects = await repo.get_projects(user_id)
+    projects = await project_catalog.get(user_id)
     projects = [f"- {p.summary}: {p.content}" for p in projects]
     return "\n".join(projects) if projects else "No projects found"
 
+# 代理只创建一次；用户和日期通过 user_id_context、request_date_context 传给工具
+report_agent = Agent(
+    name="Diary Report Agent",
+    instructions=instructions,
+    tools=[function_tool(save_report), function_tool(search_memory)],
+)
+
 async def generate_report(user_id: str, request_date: str):
     repo = MemoryRepository()
     user_id_token = user_id_context.set(user_id)
     request_date_token = request_date_context.set(request_date)
 
     try:
-        report_agent = Agent(
-            name="Diary Report Agent",
-            instructions=instructions,
-            tools=[function_tool(save_report), function_tool(search_memory)],
-        )
-        my_model_provider = OpenAIProvider(
-            api_key=settings.OPENAI_API_KEY_FOR_LLM,
-            base_url=settings.OPENAI_API_BASE_FOR_LLM,
-        )
-        my_run_config = RunConfig(model_provider=my_model_provider)
-        
         raw_memory = await repo.get_raw_memory_of_the_day(request_date, user_id)
         raw_memory_list = [f"@{memory.created_at}: {memory.content}" for memory in raw_memory]
         raw_memory_list = [f"<memory>\n{memory}\n</memory>" for memory in raw_memory_list]
@@ -125,8 +130,10 @@ async def generate_report(user_id: str, request_date: str):
         projects_summary = f"<projects_summary>\n{projects_summary}\n</projects_summary>\n"
         input_content = f"{raw_memory_content}\n{projects_summary}\n"
 
-        result = await Runner.run(report_agent, input_content, run_config=my_run_config)
-        print(result.final_output)
+        # 日报一直使用 Responses API 和 SDK 的默认模型，共享进程内的 LLM 客户端
+        my_run_config = RunConfig(model_provider=get_model_provider(use_responses=True))
+        result = await run_agent(report_agent, input_content, run_config=my_run_config)
+        logger.info("Report agent output for %s: %s", user_id, result.final_output)
         return result.final_output
     finally:
         user_id_context.reset(user_id_token)
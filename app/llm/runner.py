@@ -0,0 +1,77 @@
+import time
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from agents import Agent, RunContextWrapper, RunHooks, Runner, Tool
+from agents.items import ModelResponse
+
+from app.core.metrics import AGENT_RUN_ERRORS, AGENT_RUN_SECONDS, LLM_CALL_SECONDS, LLM_TOKENS, TOOL_CALL_SECONDS
+from app.core.tracing import add_span, span
+
+
+class MetricsHooks(RunHooks):
+    """
+    Records model call latency and token usage per agent, and tool call latency.
+
+    Passed to the top-level run and to ``Agent.as_tool``, so that the agents
+    running as tools of the triage agent are accounted for under their own name.
+    """
+
+    def __init__(self):
+        self._llm_started: Dict[Tuple[int, str], float] = {}
+        self._tool_started: Dict[Tuple[int, str], float] = {}
+
+    async def on_llm_start(self, context: RunContextWrapper, agent: Agent, system_prompt, input_items) -> None:
+        self._llm_started[(id(context), agent.name)] = time.perf_counter()
+
+    async def on_llm_end(self, context: RunContextWrapper, agent: Agent, response: ModelResponse) -> None:
+        start = self._llm_started.pop((id(context), agent.name), None)
+        if start is not None:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - start, agent.name)
+            add_span(f"llm.{agent.name}", start)
+        usage = response.usage
+        if usage is not None:
+            LLM_TOKENS.inc(agent.name, "input", amount=usage.input_tokens or 0)
+            LLM_TOKENS.inc(agent.name, "output", amount=usage.output_tokens or 0)
+
+    @staticmethod
+    def _tool_key(context: RunContextWrapper, tool: Tool) -> Tuple[int, str]:
+        # Parallel calls of the same tool are told apart by the call id of their ToolContext
+        return id(context), getattr(context, "tool_call_id", None) or tool.name
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Tool) -> None:
+        self._tool_started[self._tool_key(context, tool)] = time.perf_counter()
+
+    async def on_tool_end(self, context: RunContextWrapper, agent: Agent, tool: Tool, result) -> None:
+        start = self._tool_started.pop(self._tool_key(context, tool), None)
+        if start is not None:
+            TOOL_CALL_SECONDS.observe(time.perf_counter() - start, agent.name, tool.name)
+            add_span(f"tool.{tool.name}", start)
+
+
+metrics_hooks = MetricsHooks()
+
+
+def current_time_instructions(instructions: str):
+    """
+    Agent instructions prefixed with the current time, computed at each run.
+
+    The agents are built once at import and reused for every memory; only
+    their instructions (and the raw memory, through contextvars) change per run.
+    """
+    def build(context: RunContextWrapper, agent: Agent) -> str:
+        return f"当前时间：{datetime.now().strftime('%Y-%m-%d %H:%M')}\n" + instructions
+    return build
+
+
+async def run_agent(agent: Agent, input: Any, **kwargs):
+    """Runner.run with its duration and failures recorded under the starting agent's name."""
+    start = time.perf_counter()
+    try:
+        with span(f"agent.{agent.name}"):
+            return await Runner.run(agent, input, hooks=metrics_hooks, **kwargs)
+    except Exception:
+        AGENT_RUN_ERRORS.inc(agent.name)
+        raise
+    finally:
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - start, agent.name)
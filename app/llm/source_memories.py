@@ -0,0 +1,41 @@
+import asyncio
+import contextvars
+from typing import Any, Dict, List, Optional
+
+from app.db.elasticsearch.models import MemoryDocument
+from app.utils.event_log import event_log
+
+# 当前 agent 运行处理的原始记忆；合并处理时有多条，每条保留自己的 id、时间和标签
+source_memories_context = contextvars.ContextVar('source_memories', default=None)
+
+
+def sources_of(raw_memory: MemoryDocument, source_ids: Optional[List[str]] = None) -> List[MemoryDocument]:
+    """
+    工具产生的内容所来自的原始记忆
+
+    source_ids 是代理给出的 <memory> 元素的 id；没有给出或都不认识时，
+    取本次运行的全部原始记忆。不是经 process_raw_memories 运行的（单独调用
+    子代理）只有 raw_memory 本身。
+    """
+    memories = source_memories_context.get() or [raw_memory]
+    chosen = [memory for memory in memories if memory._id in (source_ids or ())]
+    return chosen or memories
+
+
+def derived_fields(sources: List[MemoryDocument]) -> Dict[str, Any]:
+    """派生记忆的标签和时间：来源记忆的标签并集，创建时间取最早一条，更新时间取最晚一条"""
+    created = [memory.created_at for memory in sources if memory.created_at]
+    updated = [memory.updated_at for memory in sources if memory.updated_at]
+    return {
+        "tags": list(dict.fromkeys(tag for memory in sources for tag in memory.tags or [])),
+        "created_at": min(created) if created else None,
+        "updated_at": max(updated) if updated else None,
+    }
+
+
+async def publish_derived(event_type: str, user_id: str, memory_id: str, sources: List[MemoryDocument],
+                          data: Optional[Dict[str, Any]] = None):
+    """每条来源记忆发布一个事件，每条记忆的事件流都能看到它派生的内容"""
+    for source in sources:
+        await asyncio.to_thread(event_log.publish, event_type, user_id, memory_id=memory_id,
+                                source_id=source._id, data=data)
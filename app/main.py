@@ -1,21 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pathlib import Path
 from app.core.config import settings
+from app.core.logging_config import setup_logging
+from app.core.static_assets import StaticAssets
 from app.api.v1.endpoints import memories
-from app.core.middleware import auth_middleware
+from app.core.admission import admission_controller
+from app.core import metrics
+from app.core.middleware import admission_middleware, auth_middleware, metrics_middleware, tracing_middleware
 from app.api import auth
-from app.db.elasticsearch.memory_repository import MemoryRepository
+from app.utils.session_manager import session_manager
+from app.services.event_broker import event_broker
+from app.services.warmup import warmup
 from contextlib import asynccontextmanager
+import asyncio
+
+setup_logging("api")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize the memory repository on startup."""
-    memory_repo = MemoryRepository()
-    await memory_repo.initialize()
+    """Start background services; the index check and warmup run after the server starts listening."""
+    warmup.start()
+    await asyncio.to_thread(session_manager.load)
+    sweeper = asyncio.create_task(session_manager.run_sweeper())
+    event_broker.start()
     yield
+    await event_broker.stop()
+    sweeper.cancel()
+    await warmup.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -33,32 +45,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount the frontend build directory
-frontend_build = Path(__file__).parent.parent / "frontend" / "build"
-app.mount("/static", StaticFiles(directory=str(frontend_build / "static")), name="static")
+# Index the frontend build once; /static/* and the SPA routes are served from the manifest
+static_assets = StaticAssets(settings.FRONTEND_BUILD_DIR).build()
 
 # Include routers with API prefix
 app.include_router(memories.router, prefix=f"{settings.API_V1_STR}/memories", tags=["memories"])
 
+# Admission control runs inside authentication (middlewares added later wrap earlier ones)
+app.middleware("http")(admission_middleware)
+
 # Add authentication middleware
 app.middleware("http")(auth_middleware)
 
+# Tracing covers authentication and admission; metrics are outermost, so rejected requests are measured too
+app.middleware("http")(tracing_middleware)
+app.middleware("http")(metrics_middleware)
+
 # Include auth routes
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth")
 
+def serve_index(request: Request):
+    index = static_assets.get("index.html")
+    if index is None:
+        raise HTTPException(status_code=404, detail="Frontend build not found")
+    return static_assets.response(request, index)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics of this API process"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop answers"""
+    return {"status": "ok", "uptime": warmup.status()["uptime"]}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 503 until the Elasticsearch index is checked; the warmup steps are reported"""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get(f"{settings.API_V1_STR}/admission")
+async def admission_stats():
+    """Queue depth, active requests and rejections of the admission control"""
+    return admission_controller.stats()
+
 @app.get("/")
-async def root():
-    return FileResponse(str(frontend_build / "index.html"))
+async def root(request: Request):
+    return serve_index(request)
 
 @app.get("/{full_path:path}")
-async def catch_all(full_path: str):
+async def catch_all(full_path: str, request: Request):
     # Don't handle API routes here
     if full_path.startswith("api/"):
         raise HTTPException(status_code=404, detail="Not found")
     
     # Try to serve the requested path from the frontend build
-    file_path = frontend_build / full_path
-    if file_path.exists():
-        return FileResponse(str(file_path))
-    # If the file doesn't exist, serve index.html for client-side routing
-    return FileResponse(str(frontend_build / "index.html")) 
\ No newline at end of file
+    asset = static_assets.get(full_path)
+    if asset is not None:
+        return static_assets.response(request, asset)
+    # Missing build files are real 404s, everything else is a client-side route
+    if full_path.startswith("static/"):
+        raise HTTPException(status_code=404, detail="Not found")
+    return serve_index(request) 
\ No newline at end of file
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.utils.event_log import MEMORY_PROCESSED, Event, EventLog, event_log
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+
+class EventBroker:
+    """
+    Tails the event log and fans new events out to the SSE subscribers.
+
+    One task per API process reads the log by id; every stream is fed from
+    in-memory queues, so the number of clients does not add log reads. A
+    subscriber that falls behind by more than its queue size is dropped, and
+    the client resumes with Last-Event-ID.
+    """
+
+    def __init__(self, log: EventLog, poll_interval: Optional[float] = None, queue_size: int = 1000):
+        self.log = log
+        self.poll_interval = poll_interval or settings.EVENT_POLL_INTERVAL
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._last_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    await asyncio.to_thread(self.log.prune, settings.EVENT_LOG_RETENTION_HOURS * 3600)
+                if self._last_id is None:
+                    self._last_id = await asyncio.to_thread(self.log.last_id)
+                events = await asyncio.to_thread(self.log.read_since, self._last_id)
+                for event in events:
+                    self._dispatch(event)
+                    self._last_id = event.id
+                if events:
+                    continue
+            except Exception as e:
+                logger.error(f"Error reading the event log: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _dispatch(self, event: Event):
+        for subscription in list(self._subscribers.get(event.user_id, ())):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self._unsubscribe(subscription)
+
+    def _subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    async def stream(
+        self,
+        user_id: str,
+        memory_id: Optional[str] = None,
+        last_event_id: Optional[int] = None,
+        keepalive: Optional[float] = None,
+        processed: bool = False,
+    ) -> AsyncIterator[Optional[Event]]:
+        """
+        Yield the events of a user, or only those of one memory.
+
+        Events after last_event_id are replayed from the log first. A memory
+        stream replays the memory's whole history and ends after its
+        ``processed`` event. None is yielded when nothing happened for
+        ``keepalive`` seconds, so the caller can send a heartbeat.
+
+        ``processed`` tells that the memory is already processed: if its
+        processed event was pruned from the log, a synthetic one ends the
+        stream after the replay instead of waiting forever.
+        """
+        keepalive = keepalive or settings.SSE_KEEPALIVE_INTERVAL
+        matches: Callable[[Event], bool] = (
+            (lambda event: event.memory_id == memory_id or event.source_id == memory_id)
+            if memory_id else (lambda event: True)
+        )
+        # Subscribe before replaying so that nothing falls in between
+        subscription = self._subscribe(user_id)
+        try:
+            if memory_id:
+                replay = await asyncio.to_thread(self.log.read_for_memory, memory_id, last_event_id or 0)
+            elif last_event_id is not None:
+                replay = [e for e in await asyncio.to_thread(self.log.read_since, last_event_id, 10000)
+                          if e.user_id == user_id]
+            else:
+                replay = []
+            seen = last_event_id or 0
+            for event in replay:
+                seen = event.id
+                yield event
+                if memory_id and event.type == MEMORY_PROCESSED:
+                    return
+            if memory_id and processed:
+                yield Event(seen, MEMORY_PROCESSED, user_id, memory_id, None, {}, time.time())
+                return
+
+            while not subscription.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event.id <= seen or not matches(event):
+                    continue
+                seen = event.id
+                yield event
+                if memory_id and event.type == MEMORY_PROCESSED:
+                    return
+        finally:
+            self._unsubscribe(subscription)
+
+
+event_broker = EventBroker(event_log)
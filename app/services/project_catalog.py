@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.db.elasticsearch.memory_repository import MemoryRepository
+from app.db.elasticsearch.models import MemoryDocument
+from app.utils.event_log import PROJECT_CREATED, PROJECT_UPDATED, EventLog, event_log
+from app.utils.vectors import stack, top_k
+
+logger = logging.getLogger(__name__)
+
+# Events after which a user's cached projects are stale
+INVALIDATING_EVENTS = [PROJECT_CREATED, PROJECT_UPDATED]
+
+
+class ProjectCatalog:
+    """
+    Per-user cache of project documents, shared by the triage agent, the project tools and reports.
+
+    Entries expire after PROJECT_CATALOG_TTL seconds. Changes made in this
+    process invalidate the user's entry right away (``invalidate()``); changes
+    made by another process (the API editing a project, another worker) are
+    picked up from the project events of the event log, read at most every
+    PROJECT_CATALOG_SYNC_INTERVAL seconds. The TTL is the fallback for edits
+    that bypass both, e.g. an index rebuilt from the local files.
+
+    Concurrent lookups of the same user share one ES query. The returned
+    documents are shared between callers and must not be modified. They
+    carry their embeddings, so ``search()`` ranks a user's projects without
+    another ES query.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, log: EventLog = event_log,
+                 repo: Optional[MemoryRepository] = None):
+        self.ttl = settings.PROJECT_CATALOG_TTL if ttl is None else ttl
+        self.log = log
+        self.repo = repo or MemoryRepository()
+        self._entries: Dict[str, Tuple[float, List[MemoryDocument]]] = {}  # user_id -> (loaded at, projects)
+        self._loading: Dict[str, asyncio.Task] = {}
+        # user_id -> (the cached project list, its projects with an embedding, their vectors as a matrix)
+        self._matrices: Dict[str, Tuple[List[MemoryDocument], List[MemoryDocument], np.ndarray]] = {}
+        self._last_event_id: Optional[int] = None
+        self._synced_at = 0.0
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+        self._matrices.pop(user_id, None)
+        # A query already running may miss the change: its result is returned but not cached
+        self._loading.pop(user_id, None)
+
+    async def _sync(self):
+        """Drop the users with project events newer than the last sync."""
+        now = time.monotonic()
+        if now - self._synced_at < settings.PROJECT_CATALOG_SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        try:
+            # The event log is SQLite: read it in a thread, off the event loop
+            if self._last_event_id is None:
+                # Entries are only created after this point, older events do not matter
+                self._last_event_id = await asyncio.to_thread(self.log.last_id)
+                return
+            while True:
+                events = await asyncio.to_thread(
+                    self.log.read_since, self._last_event_id, event_types=INVALIDATING_EVENTS
+                )
+                for event in events:
+                    self.invalidate(event.user_id)
+                if not events:
+                    break
+                self._last_event_id = events[-1].id
+        except Exception as e:
+            # Without the event log the TTL still bounds staleness
+            logger.warning("Cannot read project events: %s", e)
+
+    async def get(self, user_id: str) -> List[MemoryDocument]:
+        await self._sync()
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        task = self._loading.get(user_id)
+        if task is None:
+            # A task of its own, so that a cancelled caller does not cancel the load for the others
+            task = self._loading[user_id] = asyncio.create_task(self._load(user_id))
+            # Retrieve the exception so a load nobody waits for any more does not log it
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: str) -> List[MemoryDocument]:
+        task = asyncio.current_task()
+        try:
+            loaded_at = time.monotonic()
+            projects = await self.repo.get_projects(user_id, return_vector=True)
+            if self._loading.get(user_id) is task:
+                self._entries[user_id] = (loaded_at, projects)
+            return projects
+        finally:
+            if self._loading.get(user_id) is task:
+                del self._loading[user_id]
+
+    async def search(self, user_id: str, vector: Any, k: int,
+                     projects: Optional[List[MemoryDocument]] = None) -> List[Tuple[MemoryDocument, float]]:
+        """
+        The k projects of the user most similar to the vector, best first, with their cosine similarity.
+
+        Pass the list a caller already got from the catalog to rank exactly those projects; otherwise
+        the current catalog is used.
+        """
+        if projects is None:
+            projects = await self.get(user_id)
+        cached = self._matrices.get(user_id)
+        if cached is None or cached[0] is not projects:
+            embedded = [project for project in projects if project.embedding is not None]
+            matrix = stack([project.embedding for project in embedded])
+            cached = self._matrices[user_id] = (projects, embedded, matrix)
+        _, embedded, matrix = cached
+        if not embedded:
+            return []
+        indices, scores = top_k(vector, matrix, k)
+        return [(embedded[i], float(score)) for i, score in zip(indices, scores)]
+
+
+project_catalog = ProjectCatalog()
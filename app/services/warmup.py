@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.db.elasticsearch.memory_repository import MemoryRepository
+from app.llm.embeddings import embed_text
+
+logger = logging.getLogger(__name__)
+
+# kNN warmup query is filtered to a user that never exists, so it returns nothing
+WARMUP_USER_ID = "__warmup__"
+
+
+class Warmup:
+    """
+    Startup work of the API process, run in the background after it starts listening.
+
+    The index check (and creation) is required: it is retried until
+    Elasticsearch answers, and the process is ready only after it. With
+    WARMUP_ENABLED it then embeds one text, which opens the connection to the
+    embedding provider, and runs a kNN query that loads the vector index.
+    These are best effort; a failure is logged and reported, but does not
+    keep the process out of rotation.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready = False
+        self.done = False
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _step(self, name: str, func):
+        start = time.perf_counter()
+        try:
+            result = await func()
+        except Exception as e:
+            self.steps[name] = {"ok": False, "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+            raise
+        self.steps[name] = {"ok": True, "seconds": round(time.perf_counter() - start, 3)}
+        return result
+
+    async def run(self):
+        repo = MemoryRepository()
+        while True:
+            try:
+                await self._step("elasticsearch", repo.initialize)
+                break
+            except Exception as e:
+                logger.warning("Elasticsearch not available yet, retrying in %ss: %s", settings.WARMUP_RETRY_INTERVAL, e)
+                await asyncio.sleep(settings.WARMUP_RETRY_INTERVAL)
+        self.ready = True
+
+        if settings.WARMUP_ENABLED:
+            try:
+                # 嵌入请求是同步的，放到线程里，不阻塞已经开始服务的事件循环
+                vector = await self._step("embedding", lambda: asyncio.to_thread(embed_text, "warmup"))
+                await self._step("knn", lambda: repo.search_by_vector(vector, user_id=WARMUP_USER_ID, size=1, raw=True))
+            except Exception as e:
+                logger.warning("Warmup incomplete: %s", e)
+        self.done = True
+        logger.info("Warmup finished in %.2fs: %s", time.time() - self.started_at, self.steps)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warmup_done": self.done,
+            "uptime": round(time.time() - self.started_at, 3),
+            "steps": self.steps,
+        }
+
+
+warmup = Warmup()
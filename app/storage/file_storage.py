@@ -1,82 +1,712 @@
+import atexit
 import json
+import logging
 import os
+import queue
+import re
+import socket
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from app.core.config import settings
+from app.core.tracing import traced
+from app.utils.vectors import VECTOR_DTYPE, as_vector
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single writer process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+VECTOR_SUFFIX = ".vec"
+COMPACTION_LOCK = "compaction.lock"
+# Reads of a stored vector retried after its segment was compacted away by another process
+VECTOR_READ_ATTEMPTS = 3
+
+# Sentinel put on the write queue to stop the writer thread
+_STOP = object()
+
+
+class Location(NamedTuple):
+    """Where the latest record of a memory lives in the journal."""
+    segment: str
+    offset: int
+    length: int
+    user_id: str
+    seq: int
+    deleted: bool
+
+
+def _writer_name() -> str:
+    return re.sub(r"[^A-Za-z0-9_.]", "_", f"{socket.gethostname()}-{os.getpid()}")
+
+
+def _try_lock(f) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
 
 class FileStorage:
-    def __init__(self, base_dir: str = "data/memories"):
+    """
+    Local copy of the memories, kept in an append-only journal.
+
+    Every save or delete is appended as one NDJSON record to a segment under
+    ``<base_dir>/journal``. Callers only enqueue the record; a background writer
+    thread appends batches and fsyncs once per batch. An in-memory index maps
+    each memory ID to the offset of its latest record, and sealed segments are
+    compacted periodically once enough of them is dead. The index is built on
+    first use, not at import; after that only new segments and the records
+    appended to known ones are read.
+
+    Embeddings are stored next to each segment in a ``.vec`` sidecar of raw
+    float32 values; the record keeps their offset and dimension, so the search
+    index can be rebuilt without re-embedding.
+
+    Several processes (the API and the workers) can share one journal: each
+    writes its own segments, holds a lock on its active segment, and records
+    are ordered by a time-based ``seq`` so the latest write wins on replay.
+
+    Memories saved by older versions as ``<base_dir>/<user_id>/<id>.json`` are
+    still readable and deletable.
+    """
+
+    def __init__(
+        self,
+        base_dir: str = "data/memories",
+        segment_max_bytes: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        compaction_interval: Optional[float] = None,
+        compaction_ratio: Optional[float] = None,
+    ):
         self.base_dir = Path(base_dir)
-        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.journal_dir = self.base_dir / "journal"
 
+        self.segment_max_bytes = segment_max_bytes or settings.MEMORY_JOURNAL_SEGMENT_BYTES
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MEMORY_JOURNAL_FLUSH_INTERVAL
+        self.compaction_interval = compaction_interval or settings.MEMORY_JOURNAL_COMPACTION_INTERVAL
+        self.compaction_ratio = compaction_ratio or settings.MEMORY_JOURNAL_COMPACTION_RATIO
+        self.writer_name = _writer_name()
+
+        self._lock = threading.Lock()
+        # Serializes scans of the journal; the index itself is guarded by _lock
+        self._scan_lock = threading.RLock()
+        self._loaded = False
+        self._index: Dict[str, Location] = {}
+        # segment name -> bytes of it already read into the index
+        self._scanned: Dict[str, int] = {}
+        # memory_id -> record enqueued but not yet on disk
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._last_seq = 0
+        self._dead_bytes = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._segment_number = 1
+        self._active_file = None
+        self._active_vectors = None
+        self._active_name: Optional[str] = None
+        self._last_compaction = time.monotonic()
+
+    @traced("storage.save")
     def save_memory(self, memory_id: str, memory_data: Dict[str, Any]) -> str:
         """
-        Save a memory to a local JSON file.
-        
+        Enqueue a memory to be written to the local journal.
+
         Args:
             memory_id: The ID of the memory
             memory_data: The memory data to save
-            
+
         Returns:
-            The path to the saved file
+            The path of the journal directory the memory is written to
         """
-        # Create a directory for the user if it doesn't exist
-        user_dir = self.base_dir / memory_data["user_id"]
-        user_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Create the file path
-        file_path = user_dir / f"{memory_id}.json"
-        
         # Add timestamp if not present
         if "saved_at" not in memory_data:
             memory_data["saved_at"] = datetime.now().isoformat()
-        
-        # Create a copy of memory_data without the embedding property
+
+        # The embedding goes to the binary sidecar, not into the JSON record
         memory_data_to_save = memory_data.copy()
-        if "embedding" in memory_data_to_save:
-            del memory_data_to_save["embedding"]
-        
-        # Save to file
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(memory_data_to_save, f, ensure_ascii=False, indent=2)
-        
-        return str(file_path)
+        embedding = memory_data_to_save.pop("embedding", None)
+
+        record = {
+            "op": "put",
+            "id": memory_id,
+            "user_id": memory_data["user_id"],
+            "data": memory_data_to_save,
+        }
+        if embedding is not None:
+            record["vector"] = as_vector(embedding)
+        self._enqueue(record)
+        return str(self.journal_dir)
 
+    @traced("storage.save_document")
+    def save_memory_document(self, memory_id: str, memory_doc) -> str:
+        """
+        Save a MemoryDocument (including its embedding) to the local journal.
+
+        Args:
+            memory_id: The ID of the memory
+            memory_doc: The MemoryDocument to save
+
+        Returns:
+            The path of the journal directory the memory is written to
+        """
+        memory_data = memory_doc.to_dict()
+        memory_data["_id"] = memory_id  # Add the ID to the data
+        if memory_doc.embedding is not None:
+            memory_data["embedding"] = memory_doc.embedding
+        return self.save_memory(memory_id, memory_data)
+
+    def get_vector(self, memory_id: str) -> Optional[np.ndarray]:
+        """The stored embedding of a memory, or None if it has none."""
+        for _ in range(VECTOR_READ_ATTEMPTS):
+            record = self._read_latest(memory_id)
+            if record is None or record["op"] != "put":
+                return None
+            if "vector" in record:
+                return record["vector"]
+            if "vec" not in record:
+                return None
+            try:
+                with open(self._vector_path(record["_segment"]), "rb") as f:
+                    return self._read_vector(f, record["vec"])
+            except FileNotFoundError:
+                # Compacted away by another process since the record was read
+                self._refresh_index()
+        logger.warning(f"Cannot read the stored embedding of {memory_id}")
+        return None
+
+    @traced("storage.get")
     def get_memory(self, memory_id: str, user_id: str) -> Dict[str, Any]:
         """
-        Retrieve a memory from a local JSON file.
-        
+        Retrieve a memory from the local journal.
+
         Args:
             memory_id: The ID of the memory
             user_id: The ID of the user
-            
+
         Returns:
             The memory data
+
+        Raises:
+            FileNotFoundError: If the memory does not exist for this user
         """
-        file_path = self.base_dir / user_id / f"{memory_id}.json"
+        record = self._read_latest(memory_id)
+        if record is not None:
+            if record["op"] == "put" and record["user_id"] == user_id:
+                return record["data"]
+            raise FileNotFoundError(f"Memory not found: {memory_id}")
+
+        file_path = self._legacy_path(memory_id, user_id)
         if not file_path.exists():
             raise FileNotFoundError(f"Memory file not found: {file_path}")
-        
         with open(file_path, "r", encoding="utf-8") as f:
             return json.load(f)
-            
+
     def delete_memory(self, memory_id: str, user_id: str) -> bool:
         """
-        删除指定记忆的本地文件
-        
+        删除指定记忆的本地副本
+
         Args:
             memory_id: 要删除的记忆ID
             user_id: 记忆所属的用户ID
-            
+
         Returns:
             如果删除成功返回True
-            
+
         Raises:
-            FileNotFoundError: 如果文件不存在
+            FileNotFoundError: 如果记忆不存在
         """
-        file_path = self.base_dir / user_id / f"{memory_id}.json"
-        if not file_path.exists():
-            raise FileNotFoundError(f"Memory file not found: {file_path}")
-            
-        os.remove(file_path)
-        return True
\ No newline at end of file
+        record = self._read_latest(memory_id)
+        exists = record is not None and record["op"] == "put" and record["user_id"] == user_id
+
+        file_path = self._legacy_path(memory_id, user_id)
+        if file_path.exists():
+            os.remove(file_path)
+            exists = True
+        if not exists:
+            raise FileNotFoundError(f"Memory not found: {memory_id}")
+
+        self._enqueue({"op": "del", "id": memory_id, "user_id": user_id})
+        return True
+
+    def iter_memories(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the latest data of every live memory in the journal."""
+        for record, _ in self._iter_records():
+            yield record["data"]
+
+    def iter_memories_with_vectors(self) -> Iterator[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """Iterate over (data, embedding) of every live memory; embedding may be None."""
+        for record, vector in self._iter_records(with_vectors=True):
+            yield {**record["data"], "_id": record["id"]}, vector
+
+    def flush(self) -> None:
+        """Block until every enqueued record is written and fsynced."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Flush pending records and stop the writer thread."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        self._writer = None
+        self._seal_active_segment()
+
+    def compact(self) -> None:
+        """Compact the sealed segments now. Runs on the writer thread if it is alive."""
+        if self._writer is not None and self._writer.is_alive():
+            done = threading.Event()
+            self._queue.put(("compact", done))
+            done.wait()
+        else:
+            self._compact()
+
+    def _iter_records(
+        self, with_vectors: bool = False
+    ) -> Iterator[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """Iterate over the latest put record of every memory, in journal order."""
+        self.flush()
+        self._refresh_index()
+        with self._lock:
+            locations = sorted(location for location in self._index.values() if not location.deleted)
+        f = None
+        vectors = None
+        segment = None
+        try:
+            for location in locations:
+                if location.segment != segment:
+                    for handle in (f, vectors):
+                        if handle is not None:
+                            handle.close()
+                    segment = location.segment
+                    f = open(self.journal_dir / segment, "rb")
+                    vector_path = self._vector_path(segment)
+                    vectors = open(vector_path, "rb") if with_vectors and vector_path.exists() else None
+                f.seek(location.offset)
+                record = orjson.loads(f.read(location.length))
+                vector = None
+                if vectors is not None and "vec" in record:
+                    vector = self._read_vector(vectors, record["vec"])
+                yield record, vector
+        finally:
+            for handle in (f, vectors):
+                if handle is not None:
+                    handle.close()
+
+    def _enqueue(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            # Wall-clock based so that records of different processes order correctly
+            self._last_seq = max(time.time_ns(), self._last_seq + 1)
+            record["seq"] = self._last_seq
+            self._pending[record["id"]] = record
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._writer_loop, name="file-storage-writer", daemon=True
+                )
+                self._writer.start()
+        self._queue.put(record)
+
+    def _writer_loop(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.compaction_interval)
+            except queue.Empty:
+                self._maybe_compact()
+                continue
+
+            batch: List[Dict[str, Any]] = []
+            control = []
+            self._sort_item(item, batch, control)
+            # Collect whatever arrives within the flush interval into the same fsync
+            deadline = time.monotonic() + self.flush_interval
+            while item is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                self._sort_item(item, batch, control)
+            stop = any(entry is _STOP for entry in control)
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+                for entry in control:
+                    if isinstance(entry, tuple) and entry[0] == "compact":
+                        self._compact()
+                        entry[1].set()
+                if not stop:
+                    self._maybe_compact()
+            except Exception as e:
+                logger.error(f"Error writing memory journal: {str(e)}")
+            finally:
+                for _ in range(len(batch) + len(control)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    @staticmethod
+    def _sort_item(item: Any, batch: list, control: list) -> None:
+        if isinstance(item, dict):
+            batch.append(item)
+        else:
+            control.append(item)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        f = self._open_active_segment()
+
+        # Vectors first, so a record never points past the end of its sidecar
+        vector_offset = self._active_vectors.tell()
+        chunks = []
+        lines_to_write = []
+        batch_vectors = {}
+        for record in batch:
+            # The pending record keeps the array until it is indexed, the line gets the offset
+            line_record = {key: value for key, value in record.items() if key != "vector"}
+            vector = record.get("vector")
+            if vector is None and record["op"] == "put":
+                # Updates loaded without their embedding keep the stored one
+                vector = batch_vectors.get(record["id"])
+                if vector is None:
+                    vector = self._previous_vector(record["id"])
+            batch_vectors[record["id"]] = vector
+            if vector is not None:
+                data = np.ascontiguousarray(vector, dtype="<f4").tobytes()
+                line_record["vec"] = [vector_offset, len(vector)]
+                chunks.append(data)
+                vector_offset += len(data)
+            lines_to_write.append(line_record)
+        if chunks:
+            self._active_vectors.write(b"".join(chunks))
+            self._active_vectors.flush()
+            os.fsync(self._active_vectors.fileno())
+
+        offset = f.tell()
+        lines = []
+        locations = []
+        for record, line_record in zip(batch, lines_to_write):
+            line = orjson.dumps(line_record) + b"\n"
+            lines.append(line)
+            locations.append(Location(
+                self._active_name, offset, len(line),
+                record["user_id"], record["seq"], record["op"] == "del"
+            ))
+            offset += len(line)
+        f.write(b"".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+        with self._lock:
+            for record, location in zip(batch, locations):
+                self._apply(record["id"], location)
+                if self._pending.get(record["id"]) is record:
+                    del self._pending[record["id"]]
+            self._scanned[self._active_name] = offset
+
+        if offset >= self.segment_max_bytes:
+            self._seal_active_segment()
+
+    def _apply(self, memory_id: str, location: Location) -> None:
+        """Point the index at a newer record. Caller holds the lock."""
+        previous = self._index.get(memory_id)
+        if previous is not None:
+            if previous.seq >= location.seq:
+                self._dead_bytes += location.length
+                return
+            self._dead_bytes += previous.length
+        if location.deleted:
+            self._dead_bytes += location.length
+        self._index[memory_id] = location
+
+    def _read_latest(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        """The latest record of a memory, including records not yet flushed."""
+        self._ensure_index()
+        for attempt in range(2):
+            with self._lock:
+                pending = self._pending.get(memory_id)
+                location = self._index.get(memory_id)
+            if pending is not None:
+                return pending
+            if location is not None:
+                try:
+                    with open(self.journal_dir / location.segment, "rb") as f:
+                        f.seek(location.offset)
+                        record = orjson.loads(f.read(location.length))
+                    record["_segment"] = location.segment
+                    return record
+                except FileNotFoundError:
+                    pass  # compacted away by another process
+            if attempt == 0:
+                # Another process may have written or compacted it since the last scan
+                self._refresh_index()
+        return None
+
+    def _previous_vector(self, memory_id: str) -> Optional[np.ndarray]:
+        self._ensure_index()
+        for _ in range(VECTOR_READ_ATTEMPTS):
+            with self._lock:
+                location = self._index.get(memory_id)
+            if location is None or location.deleted:
+                return None
+            try:
+                with open(self.journal_dir / location.segment, "rb") as f:
+                    f.seek(location.offset)
+                    record = orjson.loads(f.read(location.length))
+                if "vec" not in record:
+                    return None
+                with open(self._vector_path(location.segment), "rb") as f:
+                    return self._read_vector(f, record["vec"])
+            except FileNotFoundError:
+                # Compacted away by another process: find the record in its new segment
+                self._refresh_index()
+        logger.error(f"Cannot read the stored embedding of {memory_id}, the update is written without it")
+        return None
+
+    def _vector_path(self, segment: str) -> Path:
+        return self.journal_dir / (segment[:-len(SEGMENT_SUFFIX)] + VECTOR_SUFFIX)
+
+    @staticmethod
+    def _read_vector(f, vec: List[int]) -> np.ndarray:
+        offset, dim = vec
+        f.seek(offset)
+        return np.frombuffer(f.read(dim * 4), dtype="<f4").astype(VECTOR_DTYPE, copy=False)
+
+    def _segment_name(self, number: int) -> str:
+        return f"{SEGMENT_PREFIX}{self.writer_name}-{number:08d}{SEGMENT_SUFFIX}"
+
+    def _segment_names(self) -> List[str]:
+        return sorted(path.name for path in self.journal_dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+    def _open_active_segment(self):
+        if self._active_file is None:
+            # Loading the index also picks the first segment number free for this writer
+            self._ensure_index()
+            name = self._segment_name(self._segment_number)
+            tmp_path = self.journal_dir / f"{name}.tmp"
+            # Lock before the segment becomes visible, so compaction never takes an active segment
+            f = open(tmp_path, "ab")
+            _try_lock(f)
+            self._active_vectors = open(self._vector_path(name), "ab")
+            os.replace(tmp_path, self.journal_dir / name)
+            self._active_file = f
+            self._active_name = name
+        return self._active_file
+
+    def _seal_active_segment(self) -> None:
+        if self._active_file is not None:
+            self._active_vectors.close()
+            self._active_file.close()
+            self._active_file = None
+            self._active_vectors = None
+            self._active_name = None
+            self._segment_number += 1
+
+    def _scan(
+        self, names: List[str], start_offsets: Optional[Dict[str, int]] = None
+    ) -> Tuple[Dict[str, Location], int, Dict[str, int]]:
+        """
+        Replay segments, each from its start offset (0 by default).
+
+        Returns the latest location per memory, the bytes read and the offset
+        each segment was read up to.
+        """
+        latest: Dict[str, Location] = {}
+        total_bytes = 0
+        end_offsets: Dict[str, int] = {}
+        for name in names:
+            offset = (start_offsets or {}).get(name, 0)
+            try:
+                f = open(self.journal_dir / name, "rb")
+            except FileNotFoundError:
+                continue  # compacted meanwhile
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # a line still being written, or torn at the end of the segment
+                    length = len(line)
+                    total_bytes += length
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        offset += length
+                        continue
+                    current = latest.get(record["id"])
+                    if current is None or record["seq"] > current.seq:
+                        latest[record["id"]] = Location(
+                            name, offset, length, record["user_id"], record["seq"], record["op"] == "del"
+                        )
+                    offset += length
+            end_offsets[name] = offset
+        return latest, total_bytes, end_offsets
+
+    def _ensure_index(self) -> None:
+        """Build the index on first use."""
+        if not self._loaded:
+            self._refresh_index()
+
+    def _refresh_index(self) -> None:
+        """
+        Catch up with the records written since the last scan, by this or another process.
+
+        Only new segments and the bytes appended to known ones are read. The
+        first call, or a segment gone because another process compacted it,
+        replays the whole journal.
+        """
+        with self._scan_lock:
+            if not self._loaded:
+                self._load_index()
+                return
+            names = self._segment_names()
+            if not set(self._scanned) <= set(names):
+                self._load_index()
+                return
+            start_offsets = {}
+            for name in names:
+                try:
+                    size = (self.journal_dir / name).stat().st_size
+                except FileNotFoundError:
+                    self._load_index()
+                    return
+                if size > self._scanned.get(name, 0):
+                    start_offsets[name] = self._scanned.get(name, 0)
+            if not start_offsets:
+                return
+            latest, _, end_offsets = self._scan(list(start_offsets), start_offsets)
+            with self._lock:
+                for memory_id, location in latest.items():
+                    # Records this process wrote itself are already indexed
+                    if self._index.get(memory_id) != location:
+                        self._apply(memory_id, location)
+                self._scanned.update(end_offsets)
+
+    def _load_index(self) -> None:
+        """Rebuild the index from all segments, keeping newer in-memory entries."""
+        with self._scan_lock:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            names = self._segment_names()
+            latest, total_bytes, end_offsets = self._scan(names)
+
+            own_prefix = f"{SEGMENT_PREFIX}{self.writer_name}-"
+            own_numbers = [
+                int(name[len(own_prefix):-len(SEGMENT_SUFFIX)])
+                for name in names if name.startswith(own_prefix)
+            ]
+            with self._lock:
+                for memory_id, location in self._index.items():
+                    current = latest.get(memory_id)
+                    if current is None or location.seq > current.seq:
+                        latest[memory_id] = location
+                self._index = latest
+                live_bytes = sum(location.length for location in latest.values() if not location.deleted)
+                self._dead_bytes = max(total_bytes - live_bytes, 0)
+                self._scanned = end_offsets
+                if self._active_file is None and own_numbers:
+                    # Never append to a segment left by a previous process with the same name
+                    self._segment_number = max(self._segment_number, max(own_numbers) + 1)
+            self._loaded = True
+
+    def _maybe_compact(self) -> None:
+        if not self._loaded or time.monotonic() - self._last_compaction < self.compaction_interval:
+            return
+        self._last_compaction = time.monotonic()
+        with self._lock:
+            live_bytes = sum(location.length for location in self._index.values() if not location.deleted)
+            dead_bytes = self._dead_bytes
+        if dead_bytes and dead_bytes / (live_bytes + dead_bytes) >= self.compaction_ratio:
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rewrite the latest record of every memory in the sealed segments into one new segment.
+
+        Segments still locked by a writer (its active segment) are left alone.
+        A tombstone is only kept while such a segment still holds a record of
+        the same memory, which may be an older put it shadows; the others are
+        dropped, so deletes do not stay dead bytes forever. Records keep their
+        seq, so a crash in the middle of compaction still replays to the latest
+        version of each memory.
+        """
+        self._ensure_index()
+        with open(self.journal_dir / COMPACTION_LOCK, "a") as lock_file:
+            if not _try_lock(lock_file):
+                return  # another process is compacting
+            self._seal_active_segment()
+
+            sealed = []
+            for name in self._segment_names():
+                with open(self.journal_dir / name, "rb") as f:
+                    if _try_lock(f):
+                        sealed.append(name)
+            if not sealed:
+                return
+
+            latest, _, _ = self._scan(sealed)
+            active, _, _ = self._scan([name for name in self._segment_names() if name not in sealed])
+            latest = {
+                memory_id: location for memory_id, location in latest.items()
+                if not location.deleted or memory_id in active
+            }
+            target = self._segment_name(self._segment_number)
+            self._segment_number += 1
+            tmp_path = self.journal_dir / f"{target}.tmp"
+            handles = {}
+            try:
+                with open(tmp_path, "wb") as out, open(self._vector_path(target), "wb") as out_vectors:
+                    for location in sorted(latest.values()):
+                        f = handles.get(location.segment)
+                        if f is None:
+                            f = handles[location.segment] = open(self.journal_dir / location.segment, "rb")
+                        f.seek(location.offset)
+                        line = f.read(location.length)
+                        if b'"vec":' in line:
+                            # Move the vector into the new sidecar and repoint the record
+                            record = orjson.loads(line)
+                            with open(self._vector_path(location.segment), "rb") as vectors:
+                                vector = self._read_vector(vectors, record["vec"])
+                            record["vec"] = [out_vectors.tell(), len(vector)]
+                            out_vectors.write(vector.astype("<f4", copy=False).tobytes())
+                            line = orjson.dumps(record) + b"\n"
+                        out.write(line)
+                    for handle in (out_vectors, out):
+                        handle.flush()
+                        os.fsync(handle.fileno())
+            finally:
+                for f in handles.values():
+                    f.close()
+            os.replace(tmp_path, self.journal_dir / target)
+            for name in sealed:
+                (self.journal_dir / name).unlink(missing_ok=True)
+                self._vector_path(name).unlink(missing_ok=True)
+
+        with self._lock:
+            # Every location in the removed segments has moved, let the rescan find them
+            self._index = {
+                memory_id: location for memory_id, location in self._index.items()
+                if location.segment not in sealed
+            }
+        self._load_index()
+        self._last_compaction = time.monotonic()
+        logger.info(f"Compacted {len(sealed)} journal segments into {target} ({len(latest)} records)")
+
+    def _legacy_path(self, memory_id: str, user_id: str) -> Path:
+        return self.base_dir / user_id / f"{memory_id}.json"
+
+
+file_storage = FileStorage(settings.MEMORY_STORAGE_DIR)
+atexit.register(file_storage.close)
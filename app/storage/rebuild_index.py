@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Rebuild Index
+=============
+Replays the local memory journal into Elasticsearch with bulk requests.
+
+Embeddings come from the journal's float32 sidecars, so no memory has to be
+re-embedded through the provider. Memories saved before vectors were kept
+locally are indexed without an embedding, unless --embed-missing is given.
+
+Usage:
+    python -m app.storage.rebuild_index --index memories --concurrency 4
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from elasticsearch.helpers import async_bulk
+
+from app.db.elasticsearch.memory_repository import MemoryRepository
+from app.storage.file_storage import FileStorage, file_storage
+from app.utils.vectors import to_wire
+
+logger = logging.getLogger("rebuild_index")
+
+# Local-only bookkeeping fields that are not part of the indexed document
+LOCAL_ONLY_FIELDS = ("_id", "_score", "saved_at")
+
+
+def iter_actions(
+    storage: FileStorage,
+    index_name: str,
+    embed_missing: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Turn the live memories of the journal into bulk index actions."""
+    stats = stats if stats is not None else {}
+    for data, vector in storage.iter_memories_with_vectors():
+        memory_id = data.get("_id")
+        if not memory_id:
+            stats["skipped"] = stats.get("skipped", 0) + 1
+            continue
+        source = {key: value for key, value in data.items() if key not in LOCAL_ONLY_FIELDS}
+        if vector is None and embed_missing:
+            from app.llm.embeddings import embed_text
+            vector = embed_text(source.get("content"))
+            stats["embedded"] = stats.get("embedded", 0) + 1
+        if vector is not None:
+            source["embedding"] = to_wire(vector)
+        else:
+            stats["without_vector"] = stats.get("without_vector", 0) + 1
+        yield {"_op_type": "index", "_index": index_name, "_id": memory_id, "_source": source}
+
+
+def iter_chunks(actions: Iterator[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for action in actions:
+        chunk.append(action)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def rebuild_index(
+    index_name: str = "memories",
+    chunk_size: int = 500,
+    concurrency: int = 4,
+    recreate: bool = False,
+    embed_missing: bool = False,
+    storage: Optional[FileStorage] = None,
+) -> Tuple[int, int]:
+    """
+    Stream the local journal into an Elasticsearch index.
+
+    Args:
+        index_name: The index to rebuild
+        chunk_size: Number of documents per bulk request
+        concurrency: Number of bulk requests in flight
+        recreate: Delete and recreate the index first
+        embed_missing: Embed memories that have no stored vector
+        storage: The journal to read, the shared file_storage by default
+
+    Returns:
+        Tuple of (indexed documents, failed documents)
+    """
+    storage = storage or file_storage
+    repo = MemoryRepository(index_name=index_name)
+    if recreate:
+        await repo.delete_index(are_you_sure=True)
+    await repo.initialize()
+    es = await repo.es
+
+    # No refreshes while loading, one at the end
+    await es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+    semaphore = asyncio.Semaphore(concurrency)
+    indexed = 0
+    failed = 0
+    stats: Dict[str, int] = {}
+
+    async def send(chunk: List[Dict[str, Any]]):
+        nonlocal indexed, failed
+        try:
+            success, errors = await async_bulk(es, chunk, raise_on_error=False, refresh=False)
+            indexed += success
+            failed += len(errors)
+            for error in errors[:3]:
+                logger.error(f"Bulk index error: {error}")
+        finally:
+            semaphore.release()
+
+    start = time.monotonic()
+    tasks = []
+    try:
+        for chunk in iter_chunks(iter_actions(storage, index_name, embed_missing, stats), chunk_size):
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(send(chunk)))
+        await asyncio.gather(*tasks)
+    finally:
+        await es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": None}})
+        await es.indices.refresh(index=index_name)
+
+    logger.info(
+        f"Rebuilt index {index_name}: {indexed} indexed, {failed} failed, "
+        f"{stats.get('without_vector', 0)} without vector, {stats.get('embedded', 0)} re-embedded, "
+        f"{stats.get('skipped', 0)} skipped, in {time.monotonic() - start:.1f}s"
+    )
+    return indexed, failed
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="从本地记忆日志重建Elasticsearch索引")
+    parser.add_argument("--index", type=str, default="memories", help="要重建的索引名称")
+    parser.add_argument("--chunk-size", type=int, default=500, help="每个bulk请求的文档数量")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发的bulk请求数量")
+    parser.add_argument("--recreate", action="store_true", help="先删除并重新创建索引")
+    parser.add_argument("--embed-missing", action="store_true", help="为没有本地向量的记忆重新生成向量")
+    args = parser.parse_args()
+
+    try:
+        indexed, failed = asyncio.run(rebuild_index(
+            index_name=args.index,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            recreate=args.recreate,
+            embed_missing=args.embed_missing,
+        ))
+    except Exception as e:
+        logger.error(f"重建索引失败: {str(e)}")
+        return 1
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Event types
+MEMORY_CREATED = "memory_created"  # a raw memory waits for the worker
+MEMORY_PROCESSED = "processed"
+INSIGHT_CREATED = "insight_created"
+PROJECT_CREATED = "project_created"
+PROJECT_UPDATED = "project_updated"  # description, title or tags edited, or the project deleted
+TASK_CREATED = "task_created"
+REPORT_READY = "report_ready"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    memory_id TEXT,
+    source_id TEXT,
+    data TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_memory_id ON events (memory_id);
+CREATE INDEX IF NOT EXISTS events_source_id ON events (source_id);
+CREATE INDEX IF NOT EXISTS events_created_at ON events (created_at);
+CREATE INDEX IF NOT EXISTS events_type ON events (type, id);
+"""
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    user_id: str
+    memory_id: Optional[str]
+    source_id: Optional[str]  # the raw memory whose processing produced the event
+    data: Dict[str, Any]
+    created_at: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "user_id": self.user_id,
+            "memory_id": self.memory_id,
+            "source_id": self.source_id,
+            "data": self.data,
+            "created_at": self.created_at,
+        }
+
+
+def _row_to_event(row) -> Event:
+    return Event(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]) if row[5] else {}, row[6])
+
+
+class EventLog:
+    """
+    Memory processing events shared between the worker and the API processes.
+
+    Events are rows in a SQLite database in WAL mode: the worker and the agent
+    tools append, the API tails the table by id and fans the events out to
+    its SSE subscribers. Ids only grow, so they double as SSE event ids.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def publish(
+        self,
+        event_type: str,
+        user_id: str,
+        memory_id: Optional[str] = None,
+        source_id: Optional[str] = None,
+        data: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """
+        Append an event. Errors are logged, not raised: a missing notification
+        must not fail the memory processing that produced it.
+
+        Returns:
+            The event id, or None if it could not be written
+        """
+        try:
+            cursor = self._connection().execute(
+                "INSERT INTO events (type, user_id, memory_id, source_id, data, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (event_type, user_id, memory_id, source_id,
+                 json.dumps(data, ensure_ascii=False) if data else None, time.time()),
+            )
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            logger.error(f"Error publishing {event_type} event for {memory_id}: {str(e)}")
+            return None
+
+    def read_since(self, after_id: int, limit: int = 500, event_types: Optional[List[str]] = None) -> List[Event]:
+        """Events with an id greater than after_id, oldest first, optionally only of some types."""
+        if event_types:
+            placeholders = ",".join("?" * len(event_types))
+            rows = self._connection().execute(
+                "SELECT id, type, user_id, memory_id, source_id, data, created_at FROM events "
+                f"WHERE type IN ({placeholders}) AND id > ? ORDER BY id LIMIT ?",
+                (*event_types, after_id, limit),
+            ).fetchall()
+            return [_row_to_event(row) for row in rows]
+        rows = self._connection().execute(
+            "SELECT id, type, user_id, memory_id, source_id, data, created_at FROM events "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def read_for_memory(self, memory_id: str, after_id: int = 0) -> List[Event]:
+        """Events about a memory or produced while processing it, oldest first."""
+        rows = self._connection().execute(
+            "SELECT id, type, user_id, memory_id, source_id, data, created_at FROM events "
+            "WHERE (memory_id = ? OR source_id = ?) AND id > ? ORDER BY id",
+            (memory_id, memory_id, after_id),
+        ).fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def last_id(self, event_type: Optional[str] = None) -> int:
+        """The id of the newest event, or of the newest event of a type."""
+        if event_type is None:
+            row = self._connection().execute("SELECT MAX(id) FROM events").fetchone()
+        else:
+            row = self._connection().execute("SELECT MAX(id) FROM events WHERE type = ?", (event_type,)).fetchone()
+        return row[0] or 0
+
+    def prune(self, max_age: float) -> int:
+        """Delete events older than max_age seconds, returns the number deleted."""
+        cursor = self._connection().execute("DELETE FROM events WHERE created_at < ?", (time.time() - max_age,))
+        return cursor.rowcount
+
+
+event_log = EventLog(settings.EVENT_LOG_PATH)
@@ -1,62 +1,211 @@
-import os
+import asyncio
+import base64
+import hashlib
+import hmac
 import json
-import time
+import logging
+import os
 import secrets
-from datetime import datetime, timedelta
+import threading
+import time
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 from app.core.config import settings
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_FILE = "revoked.txt"
+REVOCATION_LOCK = "revoked.lock"
+SECRET_KEY_FILE = "secret.key"
+# The old default of SECRET_KEY, public and therefore never used to sign tokens
+PLACEHOLDER_SECRET_KEY = "your-secret-key-here"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
 class SessionManager:
-    def __init__(self):
-        self.session_dir = Path(settings.SESSION_DIR)
-        self.session_dir.mkdir(parents=True, exist_ok=True)
-    
+    """
+    Stateless session tokens signed with SECRET_KEY.
+
+    A token is ``<payload>.<signature>``, where the payload is the base64url
+    JSON ``{"u": user_id, "iat": issued_at, "exp": expires_at, "jti": token_id}``
+    and the signature is its HMAC-SHA256. Validating a token needs no disk
+    access, so any API node that shares SECRET_KEY accepts it. Without a
+    SECRET_KEY a random key is generated once and kept in
+    ``<SESSION_DIR>/secret.key``, shared by the processes using that directory.
+
+    Logout revokes the token id until the token would have expired anyway. The
+    revocations are kept in memory and appended as ``<jti> <exp>`` lines to
+    ``<SESSION_DIR>/revoked.txt``; the periodic sweep drops expired entries,
+    rewrites the file and picks up revocations made by other processes.
+    """
+
+    def __init__(self, secret_key: Optional[str] = None, session_dir: Optional[str] = None,
+                 expiry_days: Optional[int] = None):
+        self.expiry_seconds = int((expiry_days or settings.SESSION_EXPIRY_DAYS) * 86400)
+        self.session_dir = Path(session_dir or settings.SESSION_DIR)
+        self._secret_key = secret_key
+        self._key: Optional[bytes] = None
+        self._revoked: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Create SESSION_DIR, resolve the signing key and read the revocations.
+
+        Runs once: from the app lifespan, or on first use. Importing the module
+        touches no files.
+        """
+        with self._lock:
+            if self._key is not None:
+                return
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            key = self._resolve_key(self._secret_key or settings.SECRET_KEY)
+            self._load_revocations()
+            self._key = key.encode("utf-8")
+
+    def _resolve_key(self, secret_key: Optional[str]) -> str:
+        """The configured key, or the generated one persisted in SESSION_DIR if none is set"""
+        if secret_key and secret_key != PLACEHOLDER_SECRET_KEY:
+            return secret_key
+        path = self.session_dir / SECRET_KEY_FILE
+        with self._file_lock():
+            try:
+                key = path.read_text(encoding="utf-8").strip()
+            except FileNotFoundError:
+                key = ""
+            if not key:
+                key = secrets.token_urlsafe(32)
+                tmp_path = path.with_suffix(".tmp")
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(key)
+                os.replace(tmp_path, path)
+        logger.warning(
+            "SECRET_KEY is not set, session tokens are signed with the generated key in %s. "
+            "Set SECRET_KEY to a random value shared by all API nodes.", path
+        )
+        return key
+
+    def _sign(self, payload: bytes) -> str:
+        if self._key is None:
+            self.load()
+        return _b64encode(hmac.new(self._key, payload, hashlib.sha256).digest())
+
     def create_session(self, user_id: str) -> str:
-        """Create a new session and return the session ID"""
-        session_id = secrets.token_urlsafe(32)
-        session_data = {
-            "user_id": user_id,
-            "created_at": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(days=settings.SESSION_EXPIRY_DAYS)).isoformat()
-        }
-        
-        session_file = self.session_dir / f"{session_id}.json"
-        with open(session_file, "w") as f:
-            json.dump(session_data, f)
-        
-        return session_id
-    
+        """Create a new signed session token for the user"""
+        now = int(time.time())
+        payload = json.dumps(
+            {"u": user_id, "iat": now, "exp": now + self.expiry_seconds, "jti": secrets.token_urlsafe(12)},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        encoded = _b64encode(payload)
+        return f"{encoded}.{self._sign(encoded.encode('ascii'))}"
+
+    def decode_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the token payload if the signature is valid and it is neither expired nor revoked"""
+        encoded, _, signature = session_id.partition(".")
+        if not signature or not hmac.compare_digest(signature, self._sign(encoded.encode("ascii", "replace"))):
+            return None
+        try:
+            payload = json.loads(_b64decode(encoded))
+        except ValueError:
+            return None
+        if payload.get("exp", 0) <= time.time() or payload.get("jti") in self._revoked:
+            return None
+        return payload
+
     def validate_session(self, session_id: str) -> bool:
-        """Validate if a session exists and is not expired"""
-        session_file = self.session_dir / f"{session_id}.json"
-        
-        if not session_file.exists():
-            return False
-            
-        with open(session_file, "r") as f:
-            session_data = json.load(f)
-            
-        expires_at = datetime.fromisoformat(session_data["expires_at"])
-        if datetime.now() > expires_at:
-            self.delete_session(session_id)
-            return False
-            
-        return True
-    
-    def delete_session(self, session_id: str):
-        """Delete a session"""
-        session_file = self.session_dir / f"{session_id}.json"
-        if session_file.exists():
-            session_file.unlink()
-    
-    def cleanup_expired_sessions(self):
-        """Clean up all expired sessions"""
-        for session_file in self.session_dir.glob("*.json"):
-            with open(session_file, "r") as f:
-                session_data = json.load(f)
-                expires_at = datetime.fromisoformat(session_data["expires_at"])
-                if datetime.now() > expires_at:
-                    session_file.unlink()
-
-session_manager = SessionManager() 
\ No newline at end of file
+        """Validate if a session token is authentic and not expired or revoked"""
+        return self.decode_session(session_id) is not None
+
+    def revoke_session(self, session_id: str):
+        """Revoke a session token until it expires"""
+        payload = self.decode_session(session_id)
+        if payload is None:
+            return
+        with self._lock:
+            self._revoked[payload["jti"]] = int(payload["exp"])
+        with self._file_lock():
+            with open(self.session_dir / REVOCATION_FILE, "a", encoding="utf-8") as f:
+                f.write(f"{payload['jti']} {int(payload['exp'])}\n")
+
+    def sweep_revocations(self):
+        """Drop expired revocations and merge the ones written by other processes"""
+        self.load()
+        now = time.time()
+        path = self.session_dir / REVOCATION_FILE
+        with self._file_lock():
+            revoked = self._read_revocations(path)
+            with self._lock:
+                revoked.update(self._revoked)
+                revoked = {jti: exp for jti, exp in revoked.items() if exp > now}
+                self._revoked = revoked
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{jti} {exp}\n" for jti, exp in revoked.items())
+            os.replace(tmp_path, path)
+
+    async def run_sweeper(self, interval: Optional[float] = None):
+        """Sweep the revocations periodically until cancelled"""
+        interval = interval or settings.SESSION_REVOCATION_SWEEP_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.sweep_revocations)
+            except Exception as e:
+                logger.error(f"Error sweeping revoked sessions: {str(e)}")
+
+    def _load_revocations(self):
+        now = time.time()
+        revoked = self._read_revocations(self.session_dir / REVOCATION_FILE)
+        self._revoked = {jti: exp for jti, exp in revoked.items() if exp > now}
+
+    @staticmethod
+    def _read_revocations(path: Path) -> Dict[str, int]:
+        revoked = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    jti, _, exp = line.strip().partition(" ")
+                    if jti and exp.isdigit():
+                        revoked[jti] = int(exp)
+        except FileNotFoundError:
+            pass
+        return revoked
+
+    def _file_lock(self):
+        return _FileLock(self.session_dir / REVOCATION_LOCK)
+
+
+class _FileLock:
+    """Exclusive flock across the API processes sharing SESSION_DIR"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        self._file = None
+
+
+session_manager = SessionManager()
@@ -0,0 +1,6 @@
+"""Token estimates for prompt budgets, without loading a tokenizer."""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文约一个字一个 token（UTF-8 三个字节），英文约三四个字符一个"""
+    return len(text.encode("utf-8")) // 3 + 1
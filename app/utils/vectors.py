@@ -0,0 +1,91 @@
+"""
+Helpers for embedding vectors.
+
+Vectors are carried internally as contiguous float32 NumPy arrays (4 bytes per
+dimension instead of a list of boxed Python floats) and only converted to
+lists at the wire boundary, when they are sent to Elasticsearch.
+"""
+
+import base64
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+VECTOR_DTYPE = np.float32
+
+
+def as_vector(values: Any) -> Optional[np.ndarray]:
+    """
+    Convert an embedding to a float32 array.
+
+    Accepts a list of floats, a float32/float64 array, raw little-endian float32
+    bytes or a base64 string (OpenAI ``encoding_format="base64"``). Arrays and
+    bytes that are already float32 are wrapped without copying.
+    """
+    if values is None:
+        return None
+    if isinstance(values, np.ndarray):
+        return values if values.dtype == VECTOR_DTYPE else values.astype(VECTOR_DTYPE)
+    if isinstance(values, str):
+        values = base64.b64decode(values)
+    if isinstance(values, (bytes, bytearray, memoryview)):
+        return np.frombuffer(values, dtype="<f4")
+    return np.asarray(values, dtype=VECTOR_DTYPE)
+
+
+def to_wire(vector: Any) -> Optional[List[float]]:
+    """Convert a vector to a plain list of floats for JSON request bodies."""
+    if vector is None:
+        return None
+    if isinstance(vector, np.ndarray):
+        return vector.tolist()
+    return list(vector)
+
+
+def stack(vectors: Sequence[Any]) -> np.ndarray:
+    """Stack vectors into a 2-D float32 matrix, one vector per row."""
+    if not len(vectors):
+        return np.empty((0, 0), dtype=VECTOR_DTYPE)
+    return np.vstack([as_vector(vector) for vector in vectors])
+
+
+def normalize(vectors: Any) -> np.ndarray:
+    """L2-normalize a vector or each row of a matrix. Zero vectors stay zero."""
+    vectors = as_vector(vectors)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def cosine_similarity(a: Any, b: Any) -> float:
+    """Cosine similarity of two vectors."""
+    a = normalize(a)
+    b = normalize(b)
+    return float(np.dot(a, b))
+
+
+def cosine_similarity_matrix(queries: Any, matrix: Any) -> np.ndarray:
+    """
+    Cosine similarity between query vector(s) and every row of ``matrix``.
+
+    Returns a 1-D array for a single query vector, otherwise a
+    ``(len(queries), len(matrix))`` array.
+    """
+    matrix = normalize(matrix)
+    return normalize(queries) @ matrix.T
+
+
+def top_k(query: Any, matrix: Any, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the ``k`` rows of ``matrix`` most similar to ``query``.
+
+    Returns:
+        Tuple of (row indices, similarity scores), best match first
+    """
+    scores = cosine_similarity_matrix(query, matrix)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=VECTOR_DTYPE)
+    indices = np.argpartition(-scores, k - 1)[:k]
+    indices = indices[np.argsort(-scores[indices])]
+    return indices, scores[indices]
@@ -0,0 +1,121 @@
+"""
+Benchmark the memory list serialization paths.
+
+Compares the legacy path (hit -> MemoryDocument -> APIMemoryDocument -> FastAPI
+validation and encoding) with the direct orjson path used by the read
+endpoints, end to end through a TestClient. Elasticsearch is not needed, the
+hits are synthetic.
+
+Usage:
+    python -m benchmarks.bench_memory_endpoints --page-size 100 --requests 500
+
+Measured on one core (Python 3.11, FastAPI 0.143), req/s:
+
+    page_size   legacy    fast   fast+compression
+    20           458.7   571.6   468.7  (10.6 KB -> 475 B)
+    100          278.7   439.9   347.2  (52.9 KB -> 1.0 KB)
+    500           80.2   245.3   177.3  (265 KB -> 3.6 KB)
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.api.responses import json_response, memory_hits_to_api
+from app.api.v1.endpoints.memories import APIMemoryDocument, MemoryListResponse
+from app.db.elasticsearch.models import MemoryDocument
+
+
+def make_hits(count: int) -> list:
+    base = datetime(2025, 4, 1, 8, 0, 0)
+    return [
+        {
+            "_id": f"memory-{i}",
+            "_score": None,
+            "content": "今天完成了项目的需求分析文档编写，并和团队讨论了下一步的计划。" * 3,
+            "memory_type": "raw",
+            "tags": ["work", "project"],
+            "user_id": "bench_user",
+            "title": f"Memory {i}",
+            "related_ids": [],
+            "created_at": (base + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S+0800"),
+            "updated_at": (base + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S+0800"),
+            "processed": True,
+        }
+        for i in range(count)
+    ]
+
+
+def build_app(hits: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy", response_model=MemoryListResponse)
+    async def legacy():
+        docs = [MemoryDocument.from_dict(dict(hit)) for hit in hits]
+        memories = [
+            APIMemoryDocument(
+                id=doc._id,
+                content=doc.content,
+                memory_type=doc.memory_type,
+                tags=doc.tags,
+                user_id=doc.user_id,
+                title=doc.title,
+                summary=doc.summary,
+                parent_id=doc.parent_id,
+                related_ids=doc.related_ids,
+                created_at=doc.created_at,
+                updated_at=doc.updated_at
+            )
+            for doc in docs
+        ]
+        return MemoryListResponse(
+            memories=memories, total=len(memories), page=1,
+            page_size=len(memories), total_pages=1
+        )
+
+    @app.get("/fast", response_model=MemoryListResponse)
+    async def fast(request: Request):
+        return json_response(request, {
+            "memories": memory_hits_to_api(hits),
+            "total": len(hits), "page": 1,
+            "page_size": len(hits), "total_pages": 1
+        })
+
+    return app
+
+
+def run(client: TestClient, path: str, requests: int, headers: dict) -> tuple:
+    response = client.get(path, headers=headers)  # warm up
+    size = response.num_bytes_downloaded
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory endpoint serialization benchmark")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    client = TestClient(build_app(make_hits(args.page_size)))
+    identity = {"Accept-Encoding": "identity"}
+    compressed = {"Accept-Encoding": "br, gzip"}
+
+    print(f"page_size={args.page_size}, requests={args.requests}")
+    for name, path, headers in (
+        ("legacy", "/legacy", identity),
+        ("fast", "/fast", identity),
+        ("fast+compression", "/fast", compressed),
+    ):
+        rps, size = run(client, path, args.requests, headers)
+        print(f"{name:>18}: {rps:8.1f} req/s, {size} bytes on the wire")
+
+
+if __name__ == "__main__":
+    main()
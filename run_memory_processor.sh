@@ -5,13 +5,18 @@
 export PYTHONPATH=$(pwd):$PYTHONPATH
 
 # 启动参数（可根据需要调整）
-INTERVAL=60  # 轮询间隔（秒）
+INTERVAL=300  # 兜底轮询间隔（秒），新记忆由 API 的事件通知立即唤醒
 BATCH_SIZE=20  # 每批处理的记忆数量
+CONCURRENCY=4  # 每个进程同时处理的记忆数量（不同用户并行，同一用户按顺序）
+WORKERS=$(nproc)  # worker 进程数，按 hash(user_id) 分片
+DRAIN_TIMEOUT=120  # 停止时等待正在处理的记忆的最长时间（秒）
+METRICS_PORT=9464  # 第一个 worker 的 Prometheus 指标端口，分片 i 使用 METRICS_PORT + i；0 表示不提供
 LOG_FILE="memory_processor.log"  # 日志文件
 
-# 启动工作器在后台运行
+# 启动 supervisor 在后台运行，由它启动和重启各分片的 worker 进程
 echo "启动记忆处理工作器..."
-nohup python -m app.llm.memory_processor_worker --interval $INTERVAL --batch-size $BATCH_SIZE > $LOG_FILE 2>&1 &
+nohup python -m app.llm.memory_processor_supervisor --workers $WORKERS --drain-timeout $DRAIN_TIMEOUT --metrics-port $METRICS_PORT \
+    --interval $INTERVAL --batch-size $BATCH_SIZE --concurrency $CONCURRENCY > $LOG_FILE 2>&1 &
 
 # 获取进程ID
 PID=$!
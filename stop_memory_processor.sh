@@ -17,12 +17,12 @@ if ! ps -p $PID > /dev/null; then
     exit 0
 fi
 
-# 发送终止信号
+# 发送终止信号，supervisor 转发给各 worker，它们排空正在处理的记忆后退出
 echo "正在停止记忆处理工作器 (PID: $PID)..."
 kill $PID
 
-# 等待进程结束
-TIMEOUT=10
+# 等待进程结束：排空期限（run_memory_processor.sh 中的 DRAIN_TIMEOUT）加上余量
+TIMEOUT=150
 for ((i=1; i<=TIMEOUT; i++)); do
     if ! ps -p $PID > /dev/null; then
         echo "记忆处理工作器已成功停止"
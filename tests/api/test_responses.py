@@ -0,0 +1,59 @@
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.api.responses import accepted_encodings, json_response, memory_hit_to_api
+from app.core.config import settings
+from app.db.elasticsearch.models import MemoryType
+
+
+def test_memory_hit_to_api():
+    hit = {
+        "_id": "abc",
+        "_score": 1.2,
+        "content": "我爱吃鸡蛋西红柿",
+        "memory_type": MemoryType.RAW,
+        "tags": ["food"],
+        "user_id": "test_user",
+        "created_at": "2025-04-07 10:30:00",
+        "embedding": [0.1, 0.2],
+        "processed": True,
+    }
+    doc = memory_hit_to_api(hit)
+
+    assert doc == {
+        "id": "abc",
+        "content": "我爱吃鸡蛋西红柿",
+        "memory_type": "raw",
+        "tags": ["food"],
+        "user_id": "test_user",
+        "title": None,
+        "summary": None,
+        "parent_id": None,
+        "related_ids": [],
+        "created_at": "2025-04-07T10:30:00+0800",
+        "updated_at": None,
+    }
+
+
+def test_json_response_compresses_large_payloads():
+    payload = {"memories": [{"content": "x" * 100}] * (settings.RESPONSE_COMPRESSION_MIN_SIZE // 50)}
+    app = FastAPI()
+
+    @app.get("/")
+    async def endpoint(request: Request):
+        return json_response(request, payload)
+
+    client = TestClient(app)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == payload
+
+    response = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert orjson.loads(response.content) == payload
+
+
+def test_encodings_refused_with_any_zero_q_value():
+    assert accepted_encodings("br;q=0.0, gzip; q=0.000, deflate;q=0.5") == {"deflate"}
+    assert accepted_encodings("gzip;q=1, br") == {"gzip", "br"}
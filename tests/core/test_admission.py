@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core import middleware
+from app.core.admission import AdmissionController, ConcurrencyLimiter, Rejected
+from app.core.config import settings
+
+
+def test_token_bucket_limits_each_user():
+    controller = AdmissionController(user_rate=1, user_burst=2)
+    controller.check_rate("u1")
+    controller.check_rate("u1")
+    with pytest.raises(Rejected) as excinfo:
+        controller.check_rate("u1")
+    assert excinfo.value.retry_after == 1
+    # Other users are not affected
+    controller.check_rate("u2")
+    assert controller.stats()["throttled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_queues_then_rejects():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=0.05)
+    await limiter.acquire()
+
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.stats() == {"limit": 1, "active": 1, "queued": 1, "rejected": 0}
+    with pytest.raises(Rejected):
+        await limiter.acquire()
+
+    # Releasing hands the slot to the queued request
+    limiter.release()
+    await waiting
+    assert limiter.active == 1 and limiter.queued == 0
+
+    # A queued request gives up after the timeout
+    with pytest.raises(Rejected):
+        await limiter.acquire()
+    limiter.release()
+    assert limiter.stats() == {"limit": 1, "active": 0, "queued": 0, "rejected": 2}
+
+
+def test_rate_is_keyed_on_the_session(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr(middleware, "admission_controller", AdmissionController(user_rate=1, user_burst=2))
+    app = FastAPI()
+
+    @app.get("/api/v1/memories/")
+    async def memories():
+        return {}
+
+    app.middleware("http")(middleware.admission_middleware)
+
+    @app.middleware("http")
+    async def session(request: Request, call_next):
+        if "x-session" in request.headers:
+            request.state.session = {"u": "admin", "jti": request.headers["x-session"]}
+        return await call_next(request)
+
+    client = TestClient(app)
+    # Rotating ?user_id does not give a fresh bucket
+    statuses = [client.get("/api/v1/memories/", params={"user_id": f"u{i}"}, headers={"x-session": "s1"}).status_code
+                for i in range(3)]
+    assert statuses == [200, 200, 429]
+    # ...and cannot drain the bucket of another client logged in as the same user
+    assert client.get("/api/v1/memories/", params={"user_id": "admin"}, headers={"x-session": "s2"}).status_code == 200
+    # Requests without a session share a bucket per client address
+    statuses = [client.get("/api/v1/memories/").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
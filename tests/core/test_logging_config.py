@@ -0,0 +1,50 @@
+import json
+import logging
+import queue
+import sys
+
+from app.core.logging_config import JsonFormatter, SamplingFilter, TruncatingQueueHandler, truncate
+
+
+def make_record(msg, *args, level=logging.INFO, lineno=10, created=100.0, exc_info=None):
+    record = logging.LogRecord("test", level, "module.py", lineno, msg, args, exc_info)
+    record.created = created
+    return record
+
+
+def test_truncate():
+    assert truncate("short", 10) == "short"
+    assert truncate("x" * 30, 10) == "x" * 10 + "... [truncated, 30 chars]"
+
+
+def test_sampling_is_per_call_site_and_reports_dropped():
+    sampler = SamplingFilter(per_second=2)
+    passed = [sampler.filter(make_record("hot")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    # Another line and warnings are not affected
+    assert sampler.filter(make_record("other", lineno=20))
+    assert sampler.filter(make_record("warn", level=logging.WARNING))
+
+    # Next window: the first record carries the number dropped
+    record = make_record("hot", created=101.5)
+    assert sampler.filter(record)
+    assert record.sampled_out == 3
+
+
+def test_queue_handler_truncates_and_keeps_traceback():
+    log_queue = queue.Queue()
+    handler = TruncatingQueueHandler(log_queue)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record("payload: %s", "y" * 5000, level=logging.ERROR, exc_info=sys.exc_info())
+    handler.handle(record)
+
+    queued = log_queue.get_nowait()
+    assert queued.args is None and queued.exc_info is None
+    assert "truncated, 5009 chars" in queued.getMessage()
+
+    line = json.loads(JsonFormatter("api").format(queued))
+    assert line["service"] == "api" and line["level"] == "ERROR"
+    assert "ValueError: boom" in line["exc"]
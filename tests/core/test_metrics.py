@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.core.metrics import Registry, start_http_server, timed
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("route",))
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    registry.gauge("queued", "Queued", callback=lambda: {(): 3})
+
+    requests.inc("/a")
+    requests.inc("/a", amount=2)
+    latency.observe(0.05, "/a")
+    latency.observe(0.5, "/a")
+    latency.observe(5, "/a")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/a"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{route="/a"} 5.55' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert "queued 3" in lines
+
+
+def test_gauge_set_all_drops_missing_labels():
+    registry = Registry()
+    backlog = registry.gauge("backlog", "Backlog", ("user_id",))
+    backlog.set_all({("a",): 2, ("b",): 1})
+    backlog.set_all({("b",): 4})
+    lines = registry.render().splitlines()
+    assert 'backlog{user_id="b"} 4' in lines
+    assert not any(line.startswith('backlog{user_id="a"}') for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_timed_records_duration_and_errors():
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "Latency", ("op",))
+    errors = registry.counter("op_errors_total", "Errors", ("op",))
+
+    @timed(latency, errors, "get")
+    async def get(fail):
+        if fail:
+            raise RuntimeError("boom")
+        return 1
+
+    assert await get(False) == 1
+    with pytest.raises(RuntimeError):
+        await get(True)
+    assert latency.count("get") == 2
+    assert errors.get("get") == 1
+
+
+@pytest.mark.asyncio
+async def test_http_server_serves_registry():
+    server = await start_http_server(0, host="127.0.0.1")
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE xmemory_worker_memories_total counter" in response
@@ -0,0 +1,60 @@
+import gzip
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core.static_assets import IMMUTABLE_CACHE_CONTROL, StaticAssets
+
+
+def make_client(root):
+    assets = StaticAssets(root).build()
+    app = FastAPI()
+
+    @app.get("/{full_path:path}")
+    async def serve(full_path: str, request: Request):
+        return assets.response(request, assets.get(full_path))
+
+    return TestClient(app)
+
+
+def test_hashed_assets_are_immutable_and_revalidated(tmp_path):
+    (tmp_path / "static" / "js").mkdir(parents=True)
+    (tmp_path / "static" / "js" / "main.3f2a1b9c.js").write_text("console.log(1)")
+    (tmp_path / "static" / "js" / "787.28cb0dcd.chunk.js").write_text("console.log(2)")
+    (tmp_path / "index.html").write_text("<html></html>")
+    (tmp_path / "asset-manifest.json").write_text("{}")
+    (tmp_path / "foo-settings.json").write_text("{}")
+    client = make_client(tmp_path)
+
+    response = client.get("/static/js/main.3f2a1b9c.js")
+    assert response.status_code == 200
+    assert response.text == "console.log(1)"
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert "javascript" in response.headers["content-type"]
+
+    etag = response.headers["etag"]
+    not_modified = client.get("/static/js/main.3f2a1b9c.js", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    assert client.get("/static/js/787.28cb0dcd.chunk.js").headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    # Names that only look hashed are revalidated
+    for path in ("/index.html", "/asset-manifest.json", "/foo-settings.json"):
+        assert client.get(path).headers["cache-control"] == "no-cache"
+
+
+def test_precompressed_variant_is_served(tmp_path):
+    body = b"body { color: red; }" * 100
+    (tmp_path / "app.css").write_bytes(body)
+    (tmp_path / "app.css.gz").write_bytes(gzip.compress(body))
+    client = make_client(tmp_path)
+
+    response = client.get("/app.css", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == body
+
+    plain = client.get("/app.css", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != response.headers["etag"]
+    assert plain.content == body
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.core.tracing import finish_trace, server_timing, span, start_trace, traced
+
+
+@traced("es.search")
+async def search():
+    await asyncio.sleep(0)
+    with span("serialize"):
+        return 1
+
+
+def test_spans_are_noops_outside_a_trace():
+    with span("embedding") as current:
+        assert current is None
+    assert asyncio.run(search()) == 1
+
+
+@pytest.mark.asyncio
+async def test_span_tree_and_server_timing():
+    root, token = start_trace("GET /search")
+    await search()
+    await search()
+    with span("embedding"):
+        pass
+    finish_trace(root, token)
+
+    assert [child.name for child in root.children] == ["es.search", "es.search", "embedding"]
+    assert root.children[0].children[0].name == "serialize"
+    totals = root.totals()
+    assert totals["es.search"][1] == 2 and totals["serialize"][1] == 2
+
+    header = server_timing(root)
+    assert 'es.search;dur=' in header and 'desc="2x"' in header
+    assert header.endswith(f"total;dur={root.duration * 1000:.1f}")
+    # The trace is closed: new spans are no-ops again
+    with span("late") as late:
+        assert late is None
@@ -1,7 +1,7 @@
 import pytest
 import pytest_asyncio
 from typing import List
-from app.db.elasticsearch.memory_repository import MemoryRepository
+from app.db.elasticsearch.memory_repository import MemoryRepository, user_shard
 from app.db.elasticsearch.models import MemoryDocument, MemoryType
 from app.llm.embeddings import embed_text
 from app.db.elasticsearch.client import get_es, es_client
@@ -130,4 +130,82 @@ async def test_search_with_tags(memory_repository, setup_test_memories):
     assert len(results) == 2
     # Results should be about outdoor activities
     assert all("hiking" in result.content.lower() or "mountains" in result.content.lower() for result in results)
-    assert all("hobbies" in result.tags for result in results) 
\ No newline at end of file
+    assert all("hobbies" in result.tags for result in results)
+
+
+@pytest.mark.asyncio
+async def test_get_memories(memory_repository):
+    ids = []
+    for content in ["first memory", "second memory"]:
+        ids.append(await memory_repository.create_memory(
+            MemoryDocument(content=content, user_id="test_user", tags=[], memory_type=MemoryType.RAW)
+        ))
+
+    # Order follows the requested ids, duplicates and missing ids are dropped
+    results = await memory_repository.get_memories([ids[1], "missing-id", ids[0], ids[1]])
+    assert [result._id for result in results] == [ids[1], ids[0]]
+    assert [result.content for result in results] == ["second memory", "first memory"]
+    assert results[0].embedding is None
+
+    raw = await memory_repository.get_memories(ids, raw=True, return_vector=True)
+    assert len(raw[0]["embedding"]) == len(raw[1]["embedding"])
+
+
+@pytest.mark.asyncio
+async def test_leases_are_exclusive_until_released_or_expired(memory_repository):
+    for content in ["first memory", "second memory"]:
+        await memory_repository.create_memory(
+            MemoryDocument(content=content, user_id="test_user", tags=[], memory_type=MemoryType.RAW)
+        )
+
+    claimed = await memory_repository.claim_unprocessed_memories("worker-a", batch_size=10)
+    assert len(claimed) == 2
+    await (await memory_repository.es).indices.refresh(index=memory_repository.index_name)
+    assert await memory_repository.claim_unprocessed_memories("worker-b", batch_size=10) == []
+
+    # Only the owner can acknowledge
+    assert not await memory_repository.ack_memory(claimed[0]._id, "worker-b")
+    assert await memory_repository.ack_memory(claimed[0]._id, "worker-a")
+    assert (await memory_repository.get_memory(claimed[0]._id)).processed
+
+    assert await memory_repository.release_memory(claimed[1]._id, "worker-a")
+    reclaimed = await memory_repository.claim_unprocessed_memories("worker-b", batch_size=10, lease_seconds=-1)
+    assert [memory._id for memory in reclaimed] == [claimed[1]._id]
+
+    # An expired lease is taken over
+    await (await memory_repository.es).indices.refresh(index=memory_repository.index_name)
+    taken = await memory_repository.claim_unprocessed_memories("worker-c", batch_size=10)
+    assert [memory._id for memory in taken] == [claimed[1]._id]
+
+
+@pytest.mark.asyncio
+async def test_failures_back_off_then_dead_letter(memory_repository):
+    memory_id = await memory_repository.create_memory(
+        MemoryDocument(content="poison memory", user_id="test_user", tags=[], memory_type=MemoryType.RAW)
+    )
+
+    claimed = await memory_repository.claim_unprocessed_memories("worker-a", batch_size=10, max_attempts=2)
+    state = await memory_repository.fail_memory(memory_id, "worker-a", "boom", max_attempts=2, base_delay=60)
+    assert state["processing_state"] == "pending" and state["attempts"] == 1
+    # Not claimable before next_attempt_at
+    assert await memory_repository.claim_unprocessed_memories("worker-a", batch_size=10, max_attempts=2) == []
+
+    await memory_repository.update_document(memory_id, {"next_attempt_at": 0})
+    claimed = await memory_repository.claim_unprocessed_memories("worker-a", batch_size=10, max_attempts=2)
+    assert [memory._id for memory in claimed] == [memory_id]
+    state = await memory_repository.fail_memory(memory_id, "worker-a", "boom again", max_attempts=2)
+    assert state["processing_state"] == "dead"
+
+    dead, total = await memory_repository.list_dead_memories(user_id="test_user")
+    assert total == 1 and dead[0]["last_error"] == "boom again"
+    assert await memory_repository.requeue_memory(memory_id)
+    claimed = await memory_repository.claim_unprocessed_memories("worker-a", batch_size=10, max_attempts=2)
+    assert [memory._id for memory in claimed] == [memory_id]
+
+
+def test_user_shard_matches_java_string_hash_code():
+    # "hello".hashCode() == 99162322, "你好".hashCode() == 652829 in Java
+    assert user_shard("hello", 2 ** 31) == 99162322
+    assert user_shard("你好", 1000) == 829
+    # Negative hash codes are taken modulo like Math.floorMod
+    assert user_shard("polygenelubricants", 7) == (-2147483648) % 7
@@ -0,0 +1,48 @@
+import pytest
+
+from app.db.elasticsearch.models import MemoryDocument, MemoryType, normalize_timestamp
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-04-07T10:30:00+0800", "2025-04-07T10:30:00+0800"),
+    ("2025-04-07T10:30:00+08:00", "2025-04-07T10:30:00+0800"),
+    ("2025-04-07 10:30:00", "2025-04-07T10:30:00+0800"),
+    ("2025-04-07", "2025-04-07T00:00:00+0800"),
+    ("2025-04-07T02:30:00Z", "2025-04-07T10:30:00+0800"),
+    ("2025/04/07 10:30", "2025-04-07T10:30:00+0800"),
+    ("not a date", "not a date"),
+    (None, None),
+    ("", None),
+])
+def test_normalize_timestamp(value, expected):
+    assert normalize_timestamp(value) == expected
+
+
+def test_memory_document_normalizes_timestamps_lazily():
+    doc = MemoryDocument(
+        content="test",
+        memory_type=MemoryType.RAW,
+        tags=[],
+        user_id="test_user",
+        created_at="2025-04-07 10:30:00",
+    )
+    assert doc.created_at == "2025-04-07T10:30:00+0800"
+    assert doc.updated_at is None
+
+    doc.updated_at = "2025-04-08T01:00:00+00:00"
+    assert doc.updated_at == "2025-04-08T09:00:00+0800"
+    assert doc.to_dict()["updated_at"] == "2025-04-08T09:00:00+0800"
+
+
+def test_memory_document_from_dict_ignores_unknown_fields():
+    doc = MemoryDocument.from_dict({
+        "_id": "abc",
+        "_score": 1.0,
+        "content": "test",
+        "memory_type": "raw",
+        "tags": ["a"],
+        "user_id": "test_user",
+        "saved_at": "2025-04-07T10:30:00",
+    })
+    assert doc._id == "abc"
+    assert not hasattr(doc, "__dict__")
@@ -0,0 +1,161 @@
+import asyncio
+
+import numpy as np
+import pytest
+from agents import RunContextWrapper
+
+from app.core.config import settings
+from app.db.elasticsearch.models import MemoryDocument, MemoryType
+from app.llm import insight_memory_agent, memory_agent, source_memories
+from app.services.project_catalog import ProjectCatalog
+from app.utils.event_log import EventLog
+
+
+def make_project(index, vector):
+    project = MemoryDocument(user_id="u", title=f"p{index}", content=f"project {index}", memory_type=MemoryType.PROJECT,
+                             tags=[], embedding=vector, updated_at=f"2025-01-{index + 1:02d}T10:00:00+0800")
+    project._id = f"p{index}"
+    return project
+
+
+class ProjectRepository:
+    def __init__(self, projects):
+        self.projects = projects
+
+    async def get_projects(self, user_id=None, return_vector=False):
+        return self.projects
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    # p0 points the same way as the memory, the others away from it; p9 is the most recently updated
+    vectors = [[1.0, 0.0]] + [[-1.0, float(i)] for i in range(1, 10)]
+    projects = [make_project(i, vector) for i, vector in enumerate(vectors)]
+    catalog = ProjectCatalog(log=EventLog(str(tmp_path / "events.db")), repo=ProjectRepository(projects))
+    monkeypatch.setattr(memory_agent, "project_catalog", catalog)
+    monkeypatch.setattr(memory_agent, "embed_text", lambda text: np.array([1.0, 0.1], dtype=np.float32))
+    return catalog
+
+
+@pytest.mark.asyncio
+async def test_triage_lists_similar_and_recent_projects(catalog, monkeypatch):
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_TOP_K", 1)
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_RECENT", 2)
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+
+    prompt = await memory_agent.triage_agent.get_system_prompt(RunContextWrapper(context=memory))
+    names = [line for line in prompt.splitlines() if line.startswith("<project_name>")]
+    assert names == ["<project_name>p0</project_name>", "<project_name>p9</project_name>",
+                     "<project_name>p8</project_name>"]
+    assert "The user has 10 projects; only the 3" in prompt
+
+    # The token budget wins over the counts, but the best match is always listed
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_MAX_TOKENS", 1)
+    selected = await memory_agent.select_projects(memory, await catalog.get("u"))
+    assert [project._id for project in selected] == ["p0"]
+
+
+def test_few_projects_are_all_listed(catalog, monkeypatch):
+    def embed_text(text):
+        raise AssertionError("no embedding needed")
+
+    monkeypatch.setattr(memory_agent, "embed_text", embed_text)
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+    projects = asyncio.run(catalog.get("u"))[:3]
+    assert asyncio.run(memory_agent.select_projects(memory, projects)) == projects
+
+
+@pytest.mark.asyncio
+async def test_stored_vector_is_reused(catalog, monkeypatch):
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_TOP_K", 1)
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_RECENT", 0)
+
+    def embed_text(text):
+        raise AssertionError("the stored embedding is reused")
+
+    class Storage:
+        def get_vector(self, memory_id):
+            return np.array([1.0, 0.0], dtype=np.float32) if memory_id == "m1" else None
+
+    monkeypatch.setattr(memory_agent, "embed_text", embed_text)
+    monkeypatch.setattr(memory_agent, "file_storage", Storage())
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+    memory._id = "m1"
+    selected = await memory_agent.select_projects(memory, await catalog.get("u"))
+    assert [project._id for project in selected] == ["p0"]
+
+
+@pytest.mark.asyncio
+async def test_projects_ranked_are_the_ones_listed(catalog, monkeypatch):
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_TOP_K", 1)
+    monkeypatch.setattr(settings, "TRIAGE_PROJECTS_RECENT", 0)
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+    projects = await catalog.get("u")
+
+    # A project created meanwhile reloads the catalog; the ranking still picks from the listed projects
+    catalog.repo.projects = [make_project(10, [1.0, 0.1])] + projects
+    catalog.invalidate("u")
+    selected = await memory_agent.select_projects(memory, projects)
+    assert [project._id for project in selected] == ["p0"]
+
+
+@pytest.mark.asyncio
+async def test_no_projects(tmp_path, monkeypatch):
+    catalog = ProjectCatalog(log=EventLog(str(tmp_path / "events.db")), repo=ProjectRepository([]))
+    monkeypatch.setattr(memory_agent, "project_catalog", catalog)
+
+    def embed_text(text):
+        raise AssertionError("no embedding needed")
+
+    monkeypatch.setattr(memory_agent, "embed_text", embed_text)
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+    prompt = await memory_agent.triage_agent.get_system_prompt(RunContextWrapper(context=memory))
+    assert prompt.endswith("No Projects Created")
+    assert "<project>" not in prompt
+
+
+class CreatingRepository:
+    def __init__(self):
+        self.created = []
+
+    async def create_memory(self, memory):
+        self.created.append(memory)
+        return f"new{len(self.created)}"
+
+
+class Storage:
+    def save_memory_document(self, memory_id, memory_doc):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_batch_tools_keep_each_source_memory(tmp_path, monkeypatch):
+    log = EventLog(str(tmp_path / "events.db"))
+    repo = CreatingRepository()
+    monkeypatch.setattr(source_memories, "event_log", log)
+    monkeypatch.setattr(insight_memory_agent, "MemoryRepository", lambda: repo)
+    monkeypatch.setattr(insight_memory_agent, "file_storage", Storage())
+    memories = []
+    for i, tags in enumerate([["a"], ["b"]]):
+        memory = MemoryDocument(user_id="u", content=f"memory {i}", memory_type=MemoryType.RAW, tags=tags,
+                                processed=False, created_at=f"2025-01-01T10:0{i}:00+0800",
+                                updated_at=f"2025-01-01T10:0{i}:00+0800")
+        memory._id = f"m{i}"
+        memories.append(memory)
+
+    async def run_agent(agent, input, **kwargs):
+        assert 'id="m1"' in input
+        # The agent names the memory an insight comes from; without a name it comes from all of them
+        await insight_memory_agent.create_memory(["insight 1"], "Factual", ["m1"])
+        await insight_memory_agent.create_memory(["both"], "Factual", None)
+        return type("Result", (), {"final_output": "done"})()
+
+    monkeypatch.setattr(memory_agent, "run_agent", run_agent)
+    monkeypatch.setattr(memory_agent, "get_run_config", lambda: None)
+    await memory_agent.process_raw_memories(memories)
+
+    first, both = repo.created
+    assert (first.created_at, first.tags) == (memories[1].created_at, ["b"])
+    assert (both.created_at, both.updated_at, both.tags) == (memories[0].created_at, memories[1].updated_at, ["a", "b"])
+    events = log.read_since(0)
+    assert [(event.memory_id, event.source_id) for event in events] == [("new1", "m1"), ("new2", "m0"), ("new2", "m1")]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+from collections import deque
+
+import pytest
+
+from app.core.config import settings
+from app.db.elasticsearch.models import MemoryDocument, MemoryType
+from app.llm.memory_processor_worker import MemoryProcessor, Reprocessor, take_batch
+
+
+def make_memory(memory_id, user_id, created_at=None, content=None):
+    memory = MemoryDocument(user_id=user_id, content=content or memory_id, memory_type=MemoryType.RAW, tags=[],
+                            processed=False, created_at=created_at)
+    memory._id = memory_id
+    return memory
+
+
+@pytest.mark.asyncio
+async def test_users_in_parallel_and_in_order_per_user():
+    running = 0
+    peak = 0
+    order = {}
+
+    async def handler(memories, owner):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        for memory in memories:
+            order.setdefault(memory.user_id, []).append(memory._id)
+        running -= 1
+        return memories[0]._id != "b2"
+
+    processor = MemoryProcessor(concurrency=2, handler=handler)
+    memories = [make_memory(f"{user}{i}", user) for i in range(3) for user in "abc"]
+    assert processor.submit(memories) == 9
+    # Already queued memories are not submitted twice
+    assert processor.submit(memories) == 0
+    await processor.drain()
+
+    assert peak == 2
+    assert order == {"a": ["a0", "a1", "a2"], "b": ["b0", "b1", "b2"], "c": ["c0", "c1", "c2"]}
+    assert (processor.processed, processor.failed) == (8, 1)
+    assert not processor.busy
+
+
+class ClaimingRepository:
+    def __init__(self, memories):
+        self.memories = memories
+        self.claims = []
+
+    async def claim_unprocessed_memories(self, owner, batch_size, lease_seconds, user_id=None, shard=None):
+        self.claims.append(batch_size)
+        claimed, self.memories = self.memories[:batch_size], self.memories[batch_size:]
+        return claimed
+
+
+@pytest.mark.asyncio
+async def test_poll_claims_up_to_the_queue_limit():
+    release = asyncio.Event()
+
+    async def handler(memories, owner):
+        await release.wait()
+        return True
+
+    repo = ClaimingRepository([make_memory(f"m{i}", f"u{i % 3}") for i in range(20)])
+    processor = MemoryProcessor(concurrency=2, batch_size=5, handler=handler, repo=repo)
+    assert await processor.poll() == 5
+    # Queue is full (max(batch_size, 2 * concurrency)): nothing is claimed
+    assert await processor.poll() == 0
+    assert repo.claims == [5]
+    release.set()
+    await processor.drain()
+    assert await processor.poll() == 5
+    release.set()
+    await processor.drain()
+
+
+@pytest.mark.asyncio
+async def test_notification_during_claim_is_not_lost():
+    class NotifiedRepository:
+        async def claim_unprocessed_memories(self, owner, batch_size, lease_seconds, user_id=None, shard=None):
+            # A memory is created while the claim query runs
+            processor._wakeup.set()
+            return []
+
+    processor = MemoryProcessor(handler=lambda memories, owner: True, repo=NotifiedRepository())
+    await processor.poll()
+    await asyncio.wait_for(processor.wait(5), 1)
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_in_flight_and_cancels_after_deadline():
+    started = []
+
+    async def handler(memories, owner):
+        started.extend(memory._id for memory in memories)
+        await asyncio.sleep(0 if memories[0].user_id == "fast" else 10)
+        return True
+
+    class Repository:
+        released = []
+
+        async def release_memory(self, memory_id, owner):
+            self.released.append(memory_id)
+
+    repo = Repository()
+    processor = MemoryProcessor(concurrency=4, handler=handler, repo=repo)
+    processor.submit([make_memory("f0", "fast"), make_memory("s0", "slow"), make_memory("s1", "slow")])
+    await asyncio.sleep(0.01)
+    processor.stop()
+    await processor.drain(timeout=0.05)
+
+    # The slow user's in-flight memory is cancelled, its queued one given back unstarted
+    assert started == ["f0", "s0"]
+    assert processor.processed == 1
+    assert repo.released == ["s1"]
+    assert not processor.busy
+
+
+def test_take_batch_coalesces_within_window_and_budget():
+    queue = deque([
+        make_memory("m0", "u", "2025-01-01T10:00:00+0800"),
+        make_memory("m1", "u", "2025-01-01T10:02:00+0800"),
+        make_memory("m2", "u", "2025-01-01T10:04:00+0800", content="x" * 300),
+        make_memory("m3", "u", "2025-01-01T10:20:00+0800"),
+    ])
+    assert [m._id for m in take_batch(queue, 300, 100, 20)] == ["m0", "m1"]
+    assert [m._id for m in take_batch(queue, 300, 100, 20)] == ["m2"]
+    assert [m._id for m in take_batch(queue, 300, 100, 20)] == ["m3"]
+
+    queue = deque(make_memory(f"m{i}", "u", "2025-01-01T10:00:00+0800") for i in range(5))
+    assert len(take_batch(queue, 300, 100, 3)) == 3
+    # A window of 0 processes memories one by one
+    assert len(take_batch(queue, 0, 100, 3)) == 1
+
+
+class RangeRepository:
+    def __init__(self, memories):
+        self.memories = memories
+        self.live = [0]
+
+    async def list_raw_memories_between(self, user_id, since, until, after=None, size=100):
+        return [m for m in self.memories if after is None or m.created_at >= after][:size]
+
+    async def count_live_memories(self, user_id=None):
+        return self.live.pop(0) if len(self.live) > 1 else self.live[0]
+
+
+@pytest.mark.asyncio
+async def test_reprocess_checkpoints_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_COALESCE_WINDOW", 0)
+    memories = [make_memory(f"m{i}", "u", f"2025-01-01T10:00:0{i // 2}+0800") for i in range(6)]
+    repo = RangeRepository(memories)
+    checkpoint = str(tmp_path / "checkpoint.json")
+    handled = []
+
+    async def handler(batch):
+        handled.append([m._id for m in batch])
+        if batch[0]._id == "m2":
+            reprocessor.stop()
+
+    # Live memories are waiting at first: reprocessing yields until they are gone
+    repo.live = [3, 0]
+    reprocessor = Reprocessor("u", "2025-01-01", "2025-01-01", rate=6000, checkpoint_path=checkpoint,
+                              handler=handler, repo=repo, page_size=4, yield_interval=0.01)
+    await reprocessor.run()
+    assert handled == [["m0"], ["m1"], ["m2"]]
+    saved = json.load(open(checkpoint))
+    assert saved["after"] == memories[2].created_at and saved["done_ids"] == ["m2"]
+
+    # A new run with the same checkpoint continues after m2, within the same second
+    reprocessor = Reprocessor("u", "2025-01-01", "2025-01-01", rate=6000, checkpoint_path=checkpoint,
+                              handler=handler, repo=repo, page_size=4)
+    result = await reprocessor.run()
+    assert handled[3:] == [["m3"], ["m4"], ["m5"]]
+    assert result["reprocessed"] == 6 and result["finished"]
@@ -0,0 +1,35 @@
+import asyncio
+
+from agents import RunContextWrapper
+
+from app.db.elasticsearch.models import MemoryDocument, MemoryType
+from app.llm import memory_agent
+from app.llm.model_provider import get_llm_client, get_model_provider
+
+
+def test_one_client_per_event_loop(monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.OPENAI_API_KEY_FOR_LLM", "test-key")
+
+    async def shared():
+        provider = get_model_provider(use_responses=True)
+        assert get_model_provider(use_responses=True) is provider
+        assert get_model_provider(use_responses=False) is not provider
+        return get_llm_client()
+
+    async def same_loop():
+        return await shared(), await shared()
+
+    first, second = asyncio.run(same_loop())
+    assert first is second
+    assert asyncio.run(shared()) is not first
+
+
+
+def test_triage_instructions_are_built_per_run(monkeypatch):
+    async def get_projects(user_id):
+        return []
+
+    monkeypatch.setattr(memory_agent.project_catalog, "get", get_projects)
+    memory = MemoryDocument(user_id="u", content="c", memory_type=MemoryType.RAW, tags=[], processed=False)
+    prompt = asyncio.run(memory_agent.triage_agent.get_system_prompt(RunContextWrapper(context=memory)))
+    assert prompt.endswith("No Projects Created")
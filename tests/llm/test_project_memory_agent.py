@@ -0,0 +1,48 @@
+import pytest
+
+from app.db.elasticsearch.models import MemoryDocument, MemoryType
+from app.llm import project_memory_agent
+from app.llm.project_memory_agent import TaskUpdate
+
+
+class TaskRepository:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.lookups = 0
+        self.updated = []
+
+    async def get_memories(self, ids, raw=False, return_vector=False, source_includes=None):
+        self.lookups += 1
+        return [self.tasks[id] for id in ids if id in self.tasks]
+
+    async def update_memory(self, id, memory):
+        self.updated.append((id, memory.summary))
+        return True
+
+
+class Storage:
+    def save_memory_document(self, memory_id, memory_doc):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_update_task_fetches_all_tasks_at_once(monkeypatch):
+    tasks = {}
+    for i in range(3):
+        tasks[f"t{i}"] = MemoryDocument(user_id="u", content=f"task {i}", memory_type=MemoryType.TASK,
+                                        tags=[], summary="To Do")
+        tasks[f"t{i}"]._id = f"t{i}"
+    repo = TaskRepository(tasks)
+    monkeypatch.setattr(project_memory_agent, "MemoryRepository", lambda: repo)
+    monkeypatch.setattr(project_memory_agent, "file_storage", Storage())
+
+    result = await project_memory_agent.update_task([
+        TaskUpdate(task_id="t0", task_status="Done"),
+        TaskUpdate(task_id="t2", task_status="In Progress"),
+        TaskUpdate(task_id="missing", task_status="Done"),
+        TaskUpdate(task_id="t1", task_status="Finished"),
+    ])
+    assert repo.lookups == 1
+    assert repo.updated == [("t0", "Done"), ("t2", "In Progress")]
+    assert "missing: Task not found" in result
+    assert "t1: Invalid task status" in result
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.services.event_broker import EventBroker
+from app.utils.event_log import INSIGHT_CREATED, MEMORY_PROCESSED, EventLog
+
+
+async def collect(stream, count):
+    events = []
+    async for event in stream:
+        if event is not None:
+            events.append(event)
+        if len(events) == count:
+            break
+    return events
+
+
+@pytest.mark.asyncio
+async def test_memory_stream_ends_after_processed(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"))
+    broker = EventBroker(log, poll_interval=0.01)
+    broker.start()
+    try:
+        # Published before the client connected: replayed from the log
+        log.publish(INSIGHT_CREATED, "u1", memory_id="i1", source_id="m1")
+        stream = broker.stream("u1", memory_id="m1", keepalive=0.05)
+        user_stream = collect(broker.stream("u1", keepalive=0.05), 1)
+        user_task = asyncio.create_task(user_stream)
+        await asyncio.sleep(0.05)
+
+        log.publish(INSIGHT_CREATED, "u2", memory_id="i2", source_id="m2")
+        log.publish(MEMORY_PROCESSED, "u1", memory_id="m1")
+        events = [event async for event in stream if event is not None]
+        assert [(e.type, e.memory_id) for e in events] == [(INSIGHT_CREATED, "i1"), (MEMORY_PROCESSED, "m1")]
+
+        # The user stream only gets live events of its user
+        user_events = await asyncio.wait_for(user_task, 1)
+        assert [e.memory_id for e in user_events] == ["m1"]
+    finally:
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_last_event_id_replays_missed_events(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"))
+    seen = log.publish(INSIGHT_CREATED, "u1", memory_id="i1")
+    log.publish(INSIGHT_CREATED, "u1", memory_id="i2")
+    log.publish(INSIGHT_CREATED, "u2", memory_id="i3")
+    broker = EventBroker(log, poll_interval=0.01)
+
+    events = await asyncio.wait_for(collect(broker.stream("u1", last_event_id=seen, keepalive=0.05), 1), 1)
+    assert [e.memory_id for e in events] == ["i2"]
+
+
+@pytest.mark.asyncio
+async def test_processed_memory_with_pruned_events_ends(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"))
+    log.publish(INSIGHT_CREATED, "u1", memory_id="i1", source_id="m1")
+    broker = EventBroker(log, poll_interval=0.01)
+
+    # The processed event is gone from the log: the stream ends with a synthetic one
+    stream = broker.stream("u1", memory_id="m1", keepalive=0.05, processed=True)
+    events = await asyncio.wait_for(collect(stream, 3), 1)
+    assert [(e.type, e.memory_id) for e in events] == [(INSIGHT_CREATED, "i1"), (MEMORY_PROCESSED, "m1")]
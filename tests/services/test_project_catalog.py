@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.project_catalog import ProjectCatalog
+from app.utils.event_log import MEMORY_PROCESSED, PROJECT_UPDATED, EventLog
+
+
+class ProjectRepository:
+    def __init__(self):
+        self.queries = 0
+
+    async def get_projects(self, user_id=None, return_vector=False):
+        self.queries += 1
+        await asyncio.sleep(0.01)
+        return [f"{user_id}-project-{self.queries}"]
+
+
+@pytest.mark.asyncio
+async def test_cached_until_invalidated_or_expired(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROJECT_CATALOG_SYNC_INTERVAL", 0)
+    log = EventLog(str(tmp_path / "events.db"))
+    repo = ProjectRepository()
+    catalog = ProjectCatalog(ttl=60, log=log, repo=repo)
+
+    # Concurrent lookups share one query
+    first, second = await asyncio.gather(catalog.get("u1"), catalog.get("u1"))
+    assert first == second == ["u1-project-1"]
+    assert await catalog.get("u1") == ["u1-project-1"]
+    assert repo.queries == 1
+
+    catalog.invalidate("u1")
+    assert await catalog.get("u1") == ["u1-project-2"]
+
+    # A project edit in another process, seen through the event log; other events are ignored
+    await catalog.get("u2")
+    log.publish(MEMORY_PROCESSED, "u1", memory_id="m1")
+    assert await catalog.get("u1") == ["u1-project-2"]
+    log.publish(PROJECT_UPDATED, "u1", memory_id="p1")
+    assert await catalog.get("u1") == ["u1-project-4"]
+    assert await catalog.get("u2") == ["u2-project-3"]
+
+    catalog.ttl = 0
+    assert await catalog.get("u2") == ["u2-project-5"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_fail_the_others(tmp_path):
+    repo = ProjectRepository()
+    catalog = ProjectCatalog(ttl=60, log=EventLog(str(tmp_path / "events.db")), repo=repo)
+
+    first = asyncio.create_task(catalog.get("u1"))
+    second = asyncio.create_task(catalog.get("u1"))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == ["u1-project-1"]
+    assert await catalog.get("u1") == ["u1-project-1"]
+    assert repo.queries == 1
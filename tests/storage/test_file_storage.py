@@ -0,0 +1,212 @@
+import numpy as np
+import pytest
+
+from app.storage.file_storage import FileStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = FileStorage(str(tmp_path), flush_interval=0.01)
+    yield storage
+    storage.close()
+
+
+def test_save_get_delete(storage):
+    storage.save_memory("m1", {"user_id": "u1", "content": "hello", "embedding": [0.1]})
+    # Readable before the writer has flushed
+    assert storage.get_memory("m1", "u1")["content"] == "hello"
+    storage.flush()
+    data = storage.get_memory("m1", "u1")
+    assert data["content"] == "hello"
+    assert "embedding" not in data
+    with pytest.raises(FileNotFoundError):
+        storage.get_memory("m1", "other_user")
+
+    storage.save_memory("m1", {"user_id": "u1", "content": "updated"})
+    assert storage.delete_memory("m1", "u1")
+    storage.flush()
+    with pytest.raises(FileNotFoundError):
+        storage.get_memory("m1", "u1")
+    with pytest.raises(FileNotFoundError):
+        storage.delete_memory("m1", "u1")
+
+
+def test_index_is_rebuilt_from_segments(tmp_path, storage):
+    for i in range(5):
+        storage.save_memory(f"m{i}", {"user_id": "u1", "content": f"v1-{i}"})
+    storage.save_memory("m0", {"user_id": "u1", "content": "v2-0"})
+    storage.delete_memory("m4", "u1")
+    storage.close()
+
+    reopened = FileStorage(str(tmp_path))
+    assert reopened.get_memory("m0", "u1")["content"] == "v2-0"
+    assert sorted(m["content"] for m in reopened.iter_memories()) == [
+        "v1-1", "v1-2", "v1-3", "v2-0"
+    ]
+    with pytest.raises(FileNotFoundError):
+        reopened.get_memory("m4", "u1")
+    reopened.close()
+
+
+def test_compaction_keeps_live_records(tmp_path):
+    storage = FileStorage(str(tmp_path), segment_max_bytes=200, flush_interval=0)
+    for round_ in range(3):
+        for i in range(10):
+            storage.save_memory(f"m{i}", {"user_id": "u1", "content": f"{round_}-{i}"})
+        storage.flush()
+    segments_before = len(list(storage.journal_dir.glob("segment-*")))
+
+    storage.compact()
+    assert len(list(storage.journal_dir.glob("segment-*"))) < segments_before
+    assert storage.get_memory("m3", "u1")["content"] == "2-3"
+    storage.close()
+
+    reopened = FileStorage(str(tmp_path))
+    assert sorted(m["content"] for m in reopened.iter_memories()) == [f"2-{i}" for i in range(10)]
+    reopened.close()
+
+
+def test_legacy_json_files_are_readable(tmp_path, storage):
+    user_dir = tmp_path / "u1"
+    user_dir.mkdir()
+    (user_dir / "old.json").write_text('{"user_id": "u1", "content": "legacy"}', encoding="utf-8")
+
+    assert storage.get_memory("old", "u1")["content"] == "legacy"
+    assert storage.delete_memory("old", "u1")
+    assert not (user_dir / "old.json").exists()
+
+
+def test_processes_share_one_journal(tmp_path):
+    api = FileStorage(str(tmp_path), flush_interval=0)
+    worker = FileStorage(str(tmp_path), flush_interval=0)
+    worker.writer_name = "worker"
+
+    api.save_memory("m1", {"user_id": "u1", "content": "from api"})
+    worker.save_memory("m2", {"user_id": "u1", "content": "from worker"})
+    worker.save_memory("m1", {"user_id": "u1", "content": "updated by worker"})
+    api.flush()
+    worker.flush()
+
+    # Records written by the other process are found after a rescan
+    assert api.get_memory("m2", "u1")["content"] == "from worker"
+    assert api.get_memory("m1", "u1")["content"] == "updated by worker"
+
+    # The API's active segment is locked, so compaction leaves it in place
+    worker.compact()
+    api_segments = list(tmp_path.glob(f"journal/segment-{api.writer_name}-*"))
+    assert api_segments
+    assert api.get_memory("m2", "u1")["content"] == "from worker"
+
+    api.close()
+    worker.close()
+    reopened = FileStorage(str(tmp_path))
+    assert sorted(m["content"] for m in reopened.iter_memories()) == [
+        "from worker", "updated by worker"
+    ]
+    reopened.close()
+
+
+def test_vectors_survive_updates_and_compaction(tmp_path):
+    storage = FileStorage(str(tmp_path), segment_max_bytes=200, flush_interval=0)
+    for i in range(5):
+        storage.save_memory(f"m{i}", {"user_id": "u1", "content": f"v1-{i}", "embedding": [float(i)] * 4})
+    storage.flush()
+    # An update loaded without its embedding keeps the stored vector
+    storage.save_memory("m1", {"user_id": "u1", "content": "v2-1"})
+    storage.flush()
+
+    vector = storage.get_vector("m1")
+    assert vector.dtype == np.float32
+    np.testing.assert_array_equal(vector, np.ones(4, dtype=np.float32))
+
+    storage.compact()
+    storage.close()
+    reopened = FileStorage(str(tmp_path))
+    pairs = {data["_id"]: (data, vector) for data, vector in reopened.iter_memories_with_vectors()}
+    assert pairs["m1"][0]["content"] == "v2-1"
+    for i in range(5):
+        np.testing.assert_array_equal(pairs[f"m{i}"][1], np.full(4, i, dtype=np.float32))
+    reopened.close()
+
+
+def test_index_is_built_lazily_and_refreshed_incrementally(tmp_path, monkeypatch):
+    storage = FileStorage(str(tmp_path / "memories"), flush_interval=0)
+    assert not (tmp_path / "memories").exists()
+
+    other = FileStorage(str(tmp_path / "memories"), flush_interval=0)
+    other.writer_name = "other"
+    other.save_memory("m1", {"user_id": "u1", "content": "first"})
+    other.flush()
+    assert storage.get_memory("m1", "u1")["content"] == "first"
+
+    full_loads = []
+    monkeypatch.setattr(storage, "_load_index", lambda: full_loads.append(1))
+    other.save_memory("m2", {"user_id": "u1", "content": "second"})
+    other.flush()
+    # Misses only read what was appended since the last scan
+    assert storage.get_memory("m2", "u1")["content"] == "second"
+    with pytest.raises(FileNotFoundError):
+        storage.delete_memory("unknown", "u1")
+    assert not full_loads
+
+    other.close()
+    storage.close()
+
+
+def test_update_keeps_vector_compacted_by_another_process(tmp_path):
+    api = FileStorage(str(tmp_path), flush_interval=0)
+    api.save_memory("m1", {"user_id": "u1", "content": "v1", "embedding": [0.5] * 4})
+    api.flush()
+    api.close()  # seals the segment, so the other process may compact it
+
+    worker = FileStorage(str(tmp_path), flush_interval=0)
+    worker.writer_name = "worker"
+    worker.compact()
+    worker.close()
+
+    # The API's index still points at the removed segment
+    api.save_memory("m1", {"user_id": "u1", "content": "v2"})
+    api.flush()
+    np.testing.assert_array_equal(api.get_vector("m1"), np.full(4, 0.5, dtype=np.float32))
+    api.close()
+
+
+def test_compaction_drops_tombstones_with_nothing_to_shadow(tmp_path):
+    storage = FileStorage(str(tmp_path), flush_interval=0)
+    for i in range(100):
+        storage.save_memory(f"m{i}", {"user_id": "u1", "content": "x" * 20})
+    storage.flush()
+    for i in range(80):
+        storage.delete_memory(f"m{i}", "u1")
+    storage.flush()
+
+    storage.compact()
+    # Nothing is left to compact, so deletes no longer keep the journal above the ratio
+    assert storage._dead_bytes == 0
+    assert len(storage._index) == 20
+    storage.close()
+
+    reopened = FileStorage(str(tmp_path))
+    assert len(list(reopened.iter_memories())) == 20
+    with pytest.raises(FileNotFoundError):
+        reopened.get_memory("m0", "u1")
+    reopened.close()
+
+
+def test_compaction_keeps_tombstones_shadowing_an_active_segment(tmp_path):
+    worker = FileStorage(str(tmp_path), flush_interval=0)
+    worker.writer_name = "worker"
+    worker.save_memory("m1", {"user_id": "u1", "content": "put by the worker"})
+    worker.flush()  # stays in the worker's active, locked segment
+
+    api = FileStorage(str(tmp_path), flush_interval=0)
+    api.delete_memory("m1", "u1")
+    api.flush()
+    api.compact()
+    api.close()
+
+    reopened = FileStorage(str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        reopened.get_memory("m1", "u1")
+    reopened.close()
+    worker.close()
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 from app.db.elasticsearch.memory_repository import embed_text
 
@@ -10,15 +11,15 @@ def test_embed_text():
     
     # Basic assertions
     assert embedding is not None
-    assert isinstance(embedding, list)
+    assert isinstance(embedding, np.ndarray)
     assert len(embedding) > 0
     
-    # Check that all elements are floats
-    assert all(isinstance(x, float) for x in embedding)
+    # Check that the vector is carried as float32
+    assert embedding.dtype == np.float32
     
     # Check that the embedding vector is normalized (cosine similarity)
     # The sum of squares should be approximately 1
-    sum_squares = sum(x * x for x in embedding)
+    sum_squares = float(np.dot(embedding, embedding))
     assert 0.99 <= sum_squares <= 1.01  # Allow for small floating point differences
     
     # Test with empty string
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by the worker or when a text is first embedded
+LAZY_PACKAGES = {"openai", "agents", "agno", "dateutil", "pytz"}
+
+# Generous for slow CI machines; importing app.main takes about 0.9s on a laptop
+IMPORT_BUDGET_SECONDS = 3.0
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in seconds per module, from python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_api_import_stays_lean():
+    times = import_times("app.main")
+    eager = sorted(name for name in times if name.split(".")[0] in LAZY_PACKAGES)
+    assert not eager, f"imported at startup: {eager[:10]}"
+    assert times["app.main"] < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,20 @@
+from app.utils.event_log import INSIGHT_CREATED, MEMORY_CREATED, MEMORY_PROCESSED, EventLog
+
+
+def test_publish_and_read(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"))
+    first = log.publish(INSIGHT_CREATED, "u1", memory_id="i1", source_id="m1", data={"content": "用户喜欢苹果"})
+    second = log.publish(MEMORY_PROCESSED, "u1", memory_id="m1")
+    log.publish(MEMORY_PROCESSED, "u2", memory_id="m2")
+
+    assert second > first
+    assert log.last_id() == second + 1
+    assert log.last_id(INSIGHT_CREATED) == first
+    assert log.last_id(MEMORY_CREATED) == 0
+    assert [e.type for e in log.read_since(first)] == [MEMORY_PROCESSED, MEMORY_PROCESSED]
+    events = log.read_for_memory("m1")
+    assert [e.id for e in events] == [first, second]
+    assert events[0].data == {"content": "用户喜欢苹果"}
+
+    assert log.prune(max_age=-1) == 3
+    assert log.read_since(0) == []
@@ -0,0 +1,62 @@
+import time
+
+from app.utils.session_manager import SessionManager
+
+
+def test_token_round_trip(tmp_path):
+    manager = SessionManager(secret_key="secret", session_dir=str(tmp_path))
+    token = manager.create_session("admin")
+    assert manager.validate_session(token)
+    assert manager.decode_session(token)["u"] == "admin"
+
+    # Tampered payloads and tokens signed with another key are rejected
+    payload, signature = token.split(".")
+    assert not manager.validate_session(payload[:-2] + "AA." + signature)
+    assert not manager.validate_session("garbage")
+    other = SessionManager(secret_key="other", session_dir=str(tmp_path))
+    assert not other.validate_session(token)
+
+
+def test_expired_token_is_rejected(tmp_path):
+    manager = SessionManager(secret_key="secret", session_dir=str(tmp_path))
+    manager.expiry_seconds = -1
+    assert not manager.validate_session(manager.create_session("admin"))
+
+
+def test_revocation_is_shared_and_swept(tmp_path):
+    api = SessionManager(secret_key="secret", session_dir=str(tmp_path))
+    other_node = SessionManager(secret_key="secret", session_dir=str(tmp_path))
+    token = api.create_session("admin")
+    assert other_node.validate_session(token)
+
+    api.revoke_session(token)
+    assert not api.validate_session(token)
+    # Other processes pick the revocation up on their next sweep
+    other_node.sweep_revocations()
+    assert not other_node.validate_session(token)
+    assert not SessionManager(secret_key="secret", session_dir=str(tmp_path)).validate_session(token)
+
+    # Expired revocations are dropped from the file
+    api._revoked = {"old": int(time.time()) - 10}
+    (tmp_path / "revoked.txt").write_text("old 1\n", encoding="utf-8")
+    api.sweep_revocations()
+    assert (tmp_path / "revoked.txt").read_text(encoding="utf-8") == ""
+
+
+def test_placeholder_key_is_replaced_by_a_persisted_random_key(tmp_path):
+    forged = SessionManager(secret_key="your-secret-key-here", session_dir=str(tmp_path / "elsewhere"))
+    manager = SessionManager(secret_key="your-secret-key-here", session_dir=str(tmp_path))
+    assert not manager.validate_session(forged.create_session("admin"))
+
+    # Processes sharing the session directory share the generated key
+    token = manager.create_session("admin")
+    assert SessionManager(secret_key="", session_dir=str(tmp_path)).validate_session(token)
+    assert (tmp_path / "secret.key").stat().st_mode & 0o077 == 0
+
+
+def test_nothing_is_written_until_first_use(tmp_path):
+    manager = SessionManager(secret_key="", session_dir=str(tmp_path / "sessions"))
+    assert not (tmp_path / "sessions").exists()
+
+    manager.load()
+    assert (tmp_path / "sessions" / "secret.key").exists()
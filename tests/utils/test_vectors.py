@@ -0,0 +1,49 @@
+import base64
+
+import numpy as np
+
+from app.utils.vectors import (
+    as_vector, cosine_similarity, cosine_similarity_matrix, normalize, stack, to_wire, top_k
+)
+
+
+def test_as_vector_conversions():
+    values = [0.5, -1.0, 2.0]
+    vector = as_vector(values)
+    assert vector.dtype == np.float32
+    assert to_wire(vector) == values
+
+    raw = np.asarray(values, dtype=np.float32).tobytes()
+    assert np.array_equal(as_vector(raw), vector)
+    assert np.array_equal(as_vector(base64.b64encode(raw).decode()), vector)
+
+    # float32 arrays are passed through without a copy
+    assert as_vector(vector) is vector
+    assert as_vector(None) is None
+    assert to_wire(None) is None
+
+
+def test_normalize_and_similarity():
+    matrix = stack([[3.0, 4.0], [0.0, 0.0], [-1.0, 0.0]])
+    normalized = normalize(matrix)
+    assert np.allclose(normalized[0], [0.6, 0.8])
+    assert np.allclose(normalized[1], [0.0, 0.0])
+
+    assert np.isclose(cosine_similarity([1.0, 0.0], [2.0, 0.0]), 1.0)
+    assert np.isclose(cosine_similarity([1.0, 0.0], [0.0, 5.0]), 0.0)
+
+    scores = cosine_similarity_matrix([1.0, 0.0], matrix)
+    assert scores.shape == (3,)
+    assert np.allclose(scores, [0.6, 0.0, -1.0])
+    assert cosine_similarity_matrix(matrix, matrix).shape == (3, 3)
+
+
+def test_top_k():
+    matrix = stack([[1.0, 0.0], [0.0, 1.0], [0.7, 0.7], [-1.0, 0.0]])
+    indices, scores = top_k([1.0, 0.1], matrix, 2)
+    assert indices.tolist() == [0, 2]
+    assert scores[0] >= scores[1]
+
+    indices, _ = top_k([1.0, 0.0], matrix, 10)
+    assert len(indices) == 4
+    assert len(top_k([1.0, 0.0], stack([]).reshape(0, 2), 3)[0]) == 0